@@ -1,5 +1,7 @@
 import numpy as np
-from scipy.integrate import quad
+
+from cumlus.blackbody_band import bose_einstein_band_integral
+from cumlus.instrumentation import instrumented, instrumented_integral, counted_quad
 
 # Constants
 planck_constant = 6.62607004e-34   # m^2 kg/s
@@ -24,20 +26,70 @@ def radiative_spectral_emittance(wavelength_, temperature_):
     return I_star
 
 
-def radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_):
+@instrumented_integral
+def planck_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, relative_tolerance_=1e-12):
+    """
+    Integral of radiative_spectral_emittance over the band, with the series of blackbody_band.py
+    Works with arrays of temperatures and band limits
+    :param lambda_interval_bottom_: integral limit
+    :param lambda_interval_top_: integral limit
+    :param temperature_: in kelvin
+    :param relative_tolerance_: truncation of the series
+    :return: integral, error
+    """
+    wavelength_scale = planck_constant * speed_of_light / (boltzmann_constant * np.asarray(temperature_, dtype=float))
+    integral, integral_error = bose_einstein_band_integral(wavelength_scale / np.asarray(lambda_interval_top_),
+                                                           wavelength_scale / np.asarray(lambda_interval_bottom_),
+                                                           order=3, relative_tolerance=relative_tolerance_)
+    scale = 2 * np.pi * planck_constant * speed_of_light ** 2 / wavelength_scale ** 4
+    return integral * scale, integral_error * scale
+
+
+@instrumented_integral
+def photon_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, relative_tolerance_=1e-12):
+    """
+    Integral of radiative_spectral_emittance/planck_einstein_relation over the band (number of photons emitted),
+    with the series of blackbody_band.py. Works with arrays of temperatures and band limits
+    :param lambda_interval_bottom_: integral limit
+    :param lambda_interval_top_: integral limit
+    :param temperature_: in kelvin
+    :param relative_tolerance_: truncation of the series
+    :return: integral, error
+    """
+    wavelength_scale = planck_constant * speed_of_light / (boltzmann_constant * np.asarray(temperature_, dtype=float))
+    integral, integral_error = bose_einstein_band_integral(wavelength_scale / np.asarray(lambda_interval_top_),
+                                                           wavelength_scale / np.asarray(lambda_interval_bottom_),
+                                                           order=2, relative_tolerance=relative_tolerance_)
+    scale = 2 * np.pi * speed_of_light / wavelength_scale ** 3
+    return integral * scale, integral_error * scale
+
+
+@instrumented_integral
+def radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, method_='series'):
     """
     The integral part of the equation 2.7 from Gabor thesis -  without "flux_ratio"
     :param lambda_interval_bottom_: integral limit
     :param lambda_interval_top_: integral limit
     :param temperature_:
-    :return:
+    :param method_: 'series' (planck_band_integral, also for arrays), 'table' (band_flux_table.py) or 'quad'
+    :return: integral, error
     """
-    F_star_fluxratio = quad(radiative_spectral_emittance, lambda_interval_bottom_, lambda_interval_top_,
-                            args=temperature_)
+    if method_ == 'series':
+        F_star_fluxratio = planck_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_)
+    elif method_ == 'table':
+        # imported here, band_flux_table.py builds its tables with the functions of this module
+        from cumlus.band_flux_table import tabulated_planck_band_integral
+        F_star_fluxratio = tabulated_planck_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_)
+    elif method_ == 'quad':
+        F_star_fluxratio = counted_quad('GT_for_cumlus.radiant_flux_perratioflux_integral', radiative_spectral_emittance,
+                                        lambda_interval_bottom_, lambda_interval_top_, args=temperature_)
+    else:
+        raise ValueError(f'Unknown integration method {method_}. Use "series", "table" or "quad".')
     return F_star_fluxratio
 
 
-def radiant_flux_calculator(flux_sun_, lambda_interval_bottom_, lambda_interval_top_, temperature_):
+@instrumented
+def radiant_flux_calculator(flux_sun_, lambda_interval_bottom_, lambda_interval_top_, temperature_, method_='series'):
     """
     Total power in Watts/m^2
     Full equation 2.7 from Gabor thesis
@@ -45,9 +97,11 @@ def radiant_flux_calculator(flux_sun_, lambda_interval_bottom_, lambda_interval_
     :param lambda_interval_bottom_:
     :param lambda_interval_top_:
     :param temperature_:
+    :param method_: integration method of radiant_flux_perratioflux_integral
     :return:
     """
-    flux_star_fluxratio = radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_)
+    flux_star_fluxratio = radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_,
+                                                             method_)
     radiant_flux = np.sqrt(flux_sun_ * flux_star_fluxratio[0])
     radiant_flux_error = ((1/2)*np.sqrt(flux_sun_ * flux_star_fluxratio[0])/(flux_star_fluxratio[0]))*flux_star_fluxratio[1]
     return radiant_flux, radiant_flux_error
@@ -81,6 +135,7 @@ def sensor_photon_irradiance(wavelength_, radiant_flux_, quantum_efficiency_):
     """
     # TODO adapt here and below
     Gabor eqn 2.10 -- need to adapt, since it considers it a fix QE
+    (quantum_efficiency.py has the photon count with the QE curves of the detectors)
     :param wavelength_:
     :param radiant_flux_:
     :param quantum_efficiency_:
@@ -91,22 +146,36 @@ def sensor_photon_irradiance(wavelength_, radiant_flux_, quantum_efficiency_):
     return E_sensor
 
 
+@instrumented_integral
 def total_number_of_incident_photon_per_second_per_area(lambda_interval_bottom_, lambda_interval_top_,
-                                                        radiant_flux_, quantum_efficiency_):
+                                                        radiant_flux_, quantum_efficiency_, method_='closed_form'):
     """
     Gabor Eqn 2.11
     # TODO adapt here and above
+    With a fixed QE the integrand (sensor_photon_irradiance) is linear in the wavelength, so the integral has a
+    closed form: radiant_flux * QE * (top^2 - bottom^2) / (2 h c). It works with arrays.
     :param lambda_interval_bottom_:
     :param lambda_interval_top_:
     :param radiant_flux_:
     :param quantum_efficiency_:
-    :return:
+    :param method_: 'closed_form' or 'quad'
+    :return: integral, error
     """
-    E_range = quad(sensor_photon_irradiance, lambda_interval_bottom_, lambda_interval_top_,
-                            args=(radiant_flux_, quantum_efficiency_))
+    if method_ == 'closed_form':
+        E_range_value = (np.asarray(radiant_flux_) * quantum_efficiency_ *
+                         (np.asarray(lambda_interval_top_) ** 2 - np.asarray(lambda_interval_bottom_) ** 2) /
+                         (2 * planck_constant * speed_of_light))
+        E_range = E_range_value, np.finfo(float).eps * np.abs(E_range_value)
+    elif method_ == 'quad':
+        E_range = counted_quad('GT_for_cumlus.total_number_of_incident_photon_per_second_per_area',
+                               sensor_photon_irradiance, lambda_interval_bottom_, lambda_interval_top_,
+                               args=(radiant_flux_, quantum_efficiency_))
+    else:
+        raise ValueError(f'Unknown integration method {method_}. Use "closed_form" or "quad".')
     return E_range
 
 
+@instrumented
 def photoelectrons_per_exposure_cauculator(E_range_pe_smm2_, magnitude_star_, exposuretime_sec_, diameter_telescope_mm2_):
     """
     Liebe 2002 eqn4
@@ -122,6 +191,7 @@ def photoelectrons_per_exposure_cauculator(E_range_pe_smm2_, magnitude_star_, ex
 
 # From Sensitivity of an Active Space Telescope to Faint Sources
 # and Extrasolar Planets (Angel and Woolf 1998)
+@instrumented
 def signal_to_noise_ratio(photoelectrons_per_second_signal, dark_current_noise, read_out_noise, diffuse_background):
     """
     This function calculated the signal to noise, using as input the count of photoelectrons per second for all of these
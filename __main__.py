@@ -0,0 +1,8 @@
+"""
+python -m cumlus runs the command line tool of cli.py
+"""
+import sys
+
+from cumlus.cli import main
+
+sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Adaptive time sampling of light curves
+MagnificationSignal.timeseries of notebooks/simulating_the_lightcurve.ipynb is np.linspace(-30, 30, n_data_points), so
+a short anomaly (the peak, a caustic crossing) is only resolved by sampling the whole baseline as finely as the anomaly.
+Here the light curve starts on a coarse grid, and every interval is split in four where the magnification at its quarter
+points or in its middle differs from the linear interpolation between its ends by more than the tolerance. All the
+intervals of one refinement are evaluated in one call, so the (vectorized) magnification of point_lens.py and
+binary_lens.py is called a few dozen times per light curve. The light curve between the samples is the linear
+interpolation (interpolate_light_curve).
+"""
+import numpy as np
+
+from cumlus.point_lens import pspl_light_curves
+from cumlus.binary_lens import binary_lens_light_curve, source_trajectory, caustic_distance
+
+# Where the interpolation of an interval is tested, in fractions of the interval
+TEST_FRACTIONS = np.array([0.25, 0.5, 0.75])
+
+
+def adaptive_time_grid(magnification_function, start, stop, tolerance=1e-3, initial_points=65, required_times=None,
+                       maximum_refinements=20):
+    """
+    Times where magnification_function has to be sampled for the linear interpolation to be within tolerance
+    :param magnification_function: function of an array of times that returns the magnification at these times
+    :param start: first time in days
+    :param stop: last time in days
+    :param tolerance: largest relative difference between the magnification and the linear interpolation, tested at
+                      TEST_FRACTIONS of every interval (between the tested points the difference can be a little
+                      larger, e.g. on a peak narrower than a quarter of the interval)
+    :param initial_points: number of points of the uniform grid to start with
+    :param required_times: times added to the initial grid (e.g. the peak), outside [start, stop] they are ignored
+    :param maximum_refinements: largest number of times an interval is split (in four)
+    :return: sorted times, magnification at these times
+    """
+    times = np.linspace(start, stop, initial_points)
+    if required_times is not None:
+        required_times = np.asarray(required_times, dtype=float).ravel()
+        times = np.union1d(times, required_times[(required_times > start) & (required_times < stop)])
+    magnification = np.asarray(magnification_function(times), dtype=float)
+    refine = np.ones(len(times) - 1, dtype=bool)
+    for _ in range(maximum_refinements):
+        if not np.any(refine):
+            break
+        interval = np.flatnonzero(refine)
+        # the quarter points and the middle of every interval (number of intervals, 3)
+        test_times = times[interval, np.newaxis] + \
+            (times[interval + 1] - times[interval])[:, np.newaxis] * TEST_FRACTIONS
+        test_magnification = np.asarray(magnification_function(test_times.ravel()),
+                                        dtype=float).reshape(test_times.shape)
+        interpolation = magnification[interval, np.newaxis] + \
+            (magnification[interval + 1] - magnification[interval])[:, np.newaxis] * TEST_FRACTIONS
+        split_again = np.any(np.abs(test_magnification - interpolation) > tolerance * np.abs(test_magnification),
+                             axis=-1)
+        # the test points of the intervals that fail are inserted after the start of their interval, and the four
+        # quarters are tested in the next refinement
+        interval, test_times, test_magnification = interval[split_again], test_times[split_again], \
+            test_magnification[split_again]
+        times = np.insert(times, np.repeat(interval + 1, len(TEST_FRACTIONS)), test_times.ravel())
+        magnification = np.insert(magnification, np.repeat(interval + 1, len(TEST_FRACTIONS)),
+                                  test_magnification.ravel())
+        first_quarter = interval + len(TEST_FRACTIONS) * np.arange(len(interval))
+        refine = np.zeros(len(times) - 1, dtype=bool)
+        for quarter in range(len(TEST_FRACTIONS) + 1):
+            refine[first_quarter + quarter] = True
+    return times, magnification
+
+
+def interpolate_light_curve(times, magnification, new_times):
+    """
+    Light curve of an adaptive grid at other times
+    :param times: output of adaptive_time_grid
+    :param magnification: output of adaptive_time_grid
+    :param new_times: array of times, inside the adaptive grid
+    :return: magnification at new_times
+    """
+    return np.interp(new_times, times, magnification)
+
+
+def adaptive_pspl_light_curve(t0, u0, tE, start=-30.0, stop=30.0, tolerance=1e-3, initial_points=65,
+                              maximum_refinements=20):
+    """
+    PSPL light curve (point_lens.pspl_light_curves) sampled where it changes
+    :param t0: time of the peak in days
+    :param u0: impact parameter in Einstein radii
+    :param tE: Einstein radius crossing time in days
+    :param start: first time in days
+    :param stop: last time in days
+    :param tolerance: relative accuracy of the linear interpolation
+    :param initial_points: number of points of the uniform grid to start with
+    :param maximum_refinements: largest number of times an interval is split
+    :return: times, magnification
+    """
+    return adaptive_time_grid(lambda times: pspl_light_curves(times, t0, u0, tE)[0], start, stop, tolerance,
+                              initial_points, [t0], maximum_refinements)
+
+
+def caustic_approach_times(t0, u0, tE, s, q, alpha, start, stop, probe_points=10001):
+    """
+    Times where the source trajectory is closest to the caustics (local minima of the distance to the caustics, caustic
+    crossings included). Anomalies shorter than the initial grid are found by adding these times to it.
+    :param t0: in days
+    :param u0:
+    :param tE: in days
+    :param s:
+    :param q:
+    :param alpha: in radians
+    :param start: first time in days
+    :param stop: last time in days
+    :param probe_points: number of positions of the trajectory where the distance is computed (no magnification)
+    :return: array of times
+    """
+    times = np.linspace(start, stop, probe_points)
+    x, y = source_trajectory(times, t0, u0, tE, alpha)
+    # the caustics are sampled about as finely as the trajectory
+    step = (stop - start) / ((probe_points - 1) * tE)
+    distance, _ = caustic_distance(x + 1j * y, s, q, resolution=step)
+    minimum = np.flatnonzero((distance[1:-1] <= distance[:-2]) & (distance[1:-1] < distance[2:])) + 1
+    return times[minimum]
+
+
+def adaptive_binary_lens_light_curve(t0, u0, tE, rho, s, q, alpha, start=-30.0, stop=30.0, tolerance=1e-3,
+                                     initial_points=65, maximum_refinements=20, relative_tolerance=1e-3):
+    """
+    Binary-lens light curve (binary_lens.binary_lens_light_curve) sampled where it changes. The closest approaches to
+    the caustics are added to the initial grid, with a point one source radius crossing time on each side.
+    :param t0: in days
+    :param u0:
+    :param tE: in days
+    :param rho: source radius in Einstein radii
+    :param s:
+    :param q:
+    :param alpha: in radians
+    :param start: first time in days
+    :param stop: last time in days
+    :param tolerance: relative accuracy of the linear interpolation
+    :param initial_points: number of points of the uniform grid to start with
+    :param maximum_refinements: largest number of times an interval is split
+    :param relative_tolerance: accuracy of the finite source magnification
+    :return: times, magnification
+    """
+    approach_times = caustic_approach_times(t0, u0, tE, s, q, alpha, start, stop)
+    crossing_time = rho * tE
+    required_times = np.concatenate([[t0], approach_times - crossing_time, approach_times,
+                                     approach_times + crossing_time])
+    return adaptive_time_grid(
+        lambda times: binary_lens_light_curve(times, t0, u0, tE, rho, s, q, alpha, relative_tolerance),
+        start, stop, tolerance, initial_points, required_times, maximum_refinements)
+
+
+if __name__ == '__main__':
+    import time
+
+    # Examples of the notebook, compared with the 2000 uniform points of MagnificationSignal.timeseries and with a fine
+    # uniform grid
+    fine_times = np.linspace(-30, 30, 200001)
+    examples = {'PSPL': (lambda: adaptive_pspl_light_curve(0.0, 0.1, 15.0),
+                         lambda times: pspl_light_curves(times, 0.0, 0.1, 15.0)[0]),
+                'binary': (lambda: adaptive_binary_lens_light_curve(0.0, 0.1, 15.0, 0.000049, 0.9, 0.0001, 100),
+                           lambda times: binary_lens_light_curve(times, 0.0, 0.1, 15.0, 0.000049, 0.9, 0.0001, 100))}
+    for name, (adaptive, uniform) in examples.items():
+        start_time = time.perf_counter()
+        times, magnification = adaptive()
+        elapsed_time = time.perf_counter() - start_time
+        reference = uniform(fine_times)
+        adaptive_error = np.max(np.abs(interpolate_light_curve(times, magnification, fine_times) / reference - 1))
+        uniform_times = np.linspace(-30, 30, 2000)
+        uniform_error = np.max(np.abs(np.interp(fine_times, uniform_times, uniform(uniform_times)) / reference - 1))
+        print(f'{name}: {times.size} adaptive points in {elapsed_time:.3f} s, largest relative error '
+              f'{adaptive_error:.2e} (2000 uniform points: {uniform_error:.2e})')
@@ -0,0 +1,258 @@
+"""
+Precomputed black body band integrals
+For each band (lambda_interval_bottom, lambda_interval_top) the power (planck_band_integral) and photon
+(photon_band_integral) integrals of GT_for_cumlus.py are tabulated once on a uniform grid in log(temperature) and
+interpolated with a cubic polynomial in log(integral). The grid is refined until the interpolation error bound
+(twice the largest error against the series on three points of every cell) is below the tolerance.
+The tables are saved as .npy files (memory mapped when loaded) keyed on the band, the temperature range, the
+tolerance and the physical constants, so they are rebuilt only when one of those changes. The tables used in a
+process are kept in an LRU cache, so repeated calls skip the integration entirely.
+"""
+import functools
+import json
+import os
+
+import numpy as np
+
+from cumlus.GT_for_cumlus import planck_band_integral, photon_band_integral, planck_constant, speed_of_light, \
+    boltzmann_constant
+from cumlus.caching import cache_directory, hash_key, save_array, save_json
+
+# Change this when the format or the method of the tables changes, so the old files are not used
+TABLE_VERSION = 1
+TEMPERATURE_MIN = 1000.0  # K
+TEMPERATURE_MAX = 100000.0  # K
+TABLE_RELATIVE_TOLERANCE = 1e-10
+MAXIMUM_NUMBER_OF_TEMPERATURES = 2 ** 20 + 1
+# Order of the rows in the tables
+KINDS = ('planck', 'photon')
+# The interpolation error is checked on 3 points per cell, the bound we return is this factor times the largest
+# error found there
+ERROR_SAFETY_FACTOR = 2.0
+
+
+def cubic_lagrange_interpolate(values, position):
+    """
+    Cubic a0 + a1 t + a2 t^2 + a3 t^3 through the values at the nodes i-1, i, i+1, i+2 (t = 0 at node i) of the cell
+    of every position, evaluated there. The first and last cells use the closest complete stencil. Only the 4 nodes
+    of each position are read, so values can be memory mapped
+    :param values: array (..., n), nodes at 0, 1, ..., n-1 along the last axis
+    :param position: array of positions in units of the node spacing, from 0 to n-1
+    :return: array (values.shape[:-1] + position.shape)
+    """
+    stencil = np.clip(position.astype(np.int64), 1, values.shape[-1] - 3)
+    t = position - stencil
+    y_previous, y_0, y_1, y_2 = (values[..., stencil + offset] for offset in (-1, 0, 1, 2))
+    a1 = -y_previous / 3 - y_0 / 2 + y_1 - y_2 / 6
+    a2 = y_previous / 2 - y_0 + y_1 / 2
+    a3 = -y_previous / 6 + y_0 / 2 - y_1 / 2 + y_2 / 6
+    return y_0 + t * (a1 + t * (a2 + t * a3))
+
+
+def log_band_integrals(lambda_interval_bottom, lambda_interval_top, temperature):
+    """
+    log of the power and photon band integrals, computed with the series
+    :param lambda_interval_bottom:
+    :param lambda_interval_top:
+    :param temperature: array
+    :return: array of shape (2,) + temperature.shape, in the order of KINDS
+    """
+    with np.errstate(divide='ignore'):
+        return np.log([planck_band_integral(lambda_interval_bottom, lambda_interval_top, temperature)[0],
+                       photon_band_integral(lambda_interval_bottom, lambda_interval_top, temperature)[0]])
+
+
+class BandFluxTable:
+    """
+    Band integrals of one band, tabulated in log(temperature)
+    """
+
+    def __init__(self, lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                 log_integrals, max_log_error):
+        """
+        :param lambda_interval_bottom: band limit
+        :param lambda_interval_top: band limit
+        :param temperature_min: first node of the grid
+        :param temperature_max: last node of the grid
+        :param log_integrals: array (2, number_of_temperatures) with the log of the integrals, in the order of KINDS
+        :param max_log_error: largest interpolation error in log(integral) for each kind (~ relative error)
+        """
+        self.lambda_interval_bottom = lambda_interval_bottom
+        self.lambda_interval_top = lambda_interval_top
+        self.temperature_min = temperature_min
+        self.temperature_max = temperature_max
+        self.log_integrals = log_integrals
+        self.max_log_error = np.asarray(max_log_error, dtype=float)
+        self.log_temperature_min = np.log(temperature_min)
+        self.log_temperature_step = (np.log(temperature_max) - np.log(temperature_min)) / (log_integrals.shape[1] - 1)
+
+    def interpolate_log(self, temperature, kind_index):
+        """
+        Cubic interpolation of log(integral), only valid inside [temperature_min, temperature_max]
+        :param temperature: array
+        :param kind_index: row of the table
+        :return: log(integral)
+        """
+        position = (np.log(temperature) - self.log_temperature_min) / self.log_temperature_step
+        return cubic_lagrange_interpolate(self.log_integrals[kind_index], position)
+
+    def band_integral(self, temperature, kind):
+        """
+        Band integral from the table. Temperatures outside the table are computed with the series
+        :param temperature: array
+        :param kind: 'planck' or 'photon'
+        :return: integral, error
+        """
+        kind_index = KINDS.index(kind)
+        temperature = np.asarray(temperature, dtype=float)
+        inside = (temperature >= self.temperature_min) & (temperature <= self.temperature_max)
+        integral = np.empty(temperature.shape)
+        integral_error = np.empty(temperature.shape)
+
+        integral[inside] = np.exp(self.interpolate_log(temperature[inside], kind_index))
+        integral_error[inside] = np.expm1(self.max_log_error[kind_index]) * integral[inside]
+        if not np.all(inside):
+            series = planck_band_integral if kind == 'planck' else photon_band_integral
+            integral[~inside], integral_error[~inside] = series(self.lambda_interval_bottom, self.lambda_interval_top,
+                                                                temperature[~inside])
+        return integral, integral_error
+
+    def planck_band_integral(self, temperature):
+        """
+        Same as GT_for_cumlus.planck_band_integral for this band
+        :param temperature: in kelvin
+        :return: integral, error
+        """
+        return self.band_integral(temperature, 'planck')
+
+    def photon_band_integral(self, temperature):
+        """
+        Same as GT_for_cumlus.photon_band_integral for this band
+        :param temperature: in kelvin
+        :return: integral, error
+        """
+        return self.band_integral(temperature, 'photon')
+
+
+def build_band_flux_table(lambda_interval_bottom, lambda_interval_top, temperature_min=TEMPERATURE_MIN,
+                          temperature_max=TEMPERATURE_MAX, relative_tolerance=TABLE_RELATIVE_TOLERANCE):
+    """
+    Tabulate the band integrals, doubling the number of temperatures until the interpolation error bound is below
+    relative_tolerance. The bound is ERROR_SAFETY_FACTOR times the largest error on the points 1/4, 1/2 and 3/4 of
+    every cell
+    :param lambda_interval_bottom: band limit
+    :param lambda_interval_top: band limit
+    :param temperature_min: in kelvin
+    :param temperature_max: in kelvin
+    :param relative_tolerance: largest relative interpolation error
+    :return: BandFluxTable
+    """
+    number_of_temperatures = 129
+    while True:
+        log_temperature = np.linspace(np.log(temperature_min), np.log(temperature_max), number_of_temperatures)
+        log_integrals = log_band_integrals(lambda_interval_bottom, lambda_interval_top, np.exp(log_temperature))
+        if not np.all(np.isfinite(log_integrals)):
+            raise ValueError(f'The band {lambda_interval_bottom}-{lambda_interval_top} has no flux (in double '
+                             f'precision) at some temperatures between {temperature_min} and {temperature_max} K.')
+        table = BandFluxTable(lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                              log_integrals, max_log_error=[0.0, 0.0])
+
+        step = log_temperature[1] - log_temperature[0]
+        check_log_temperature = (log_temperature[:-1, np.newaxis] + step * np.array([0.25, 0.5, 0.75])).ravel()
+        check_temperature = np.exp(check_log_temperature)
+        check_log_integrals = log_band_integrals(lambda_interval_bottom, lambda_interval_top, check_temperature)
+        max_log_error = [np.max(np.abs(table.interpolate_log(check_temperature, kind_index) -
+                                       check_log_integrals[kind_index])) for kind_index in range(len(KINDS))]
+        max_log_error = ERROR_SAFETY_FACTOR * np.asarray(max_log_error) + 4 * np.finfo(float).eps
+        if max(max_log_error) <= relative_tolerance or number_of_temperatures >= MAXIMUM_NUMBER_OF_TEMPERATURES:
+            table.max_log_error = max_log_error
+            return table
+        number_of_temperatures = 2 * (number_of_temperatures - 1) + 1
+
+
+def table_description(lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                      relative_tolerance):
+    """
+    Everything a table depends on, to build its key
+    """
+    return {'version': TABLE_VERSION,
+            'band': [float(lambda_interval_bottom), float(lambda_interval_top)],
+            'temperature_range': [float(temperature_min), float(temperature_max)],
+            'relative_tolerance': float(relative_tolerance),
+            'constants': [planck_constant, speed_of_light, boltzmann_constant]}
+
+
+@functools.lru_cache(maxsize=64)
+def load_band_flux_table(lambda_interval_bottom, lambda_interval_top, temperature_min=TEMPERATURE_MIN,
+                         temperature_max=TEMPERATURE_MAX, relative_tolerance=TABLE_RELATIVE_TOLERANCE):
+    """
+    Table of a band, from the LRU cache, from the disk cache, or built (and saved) if it is not there yet
+    :param lambda_interval_bottom: band limit
+    :param lambda_interval_top: band limit
+    :param temperature_min: in kelvin
+    :param temperature_max: in kelvin
+    :param relative_tolerance: largest relative interpolation error
+    :return: BandFluxTable
+    """
+    description = table_description(lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                                    relative_tolerance)
+    filepath = os.path.join(cache_directory('band_flux_tables'), hash_key(description))
+    if os.path.exists(f'{filepath}.json') and os.path.exists(f'{filepath}.npy'):
+        with open(f'{filepath}.json') as file:
+            metadata = json.load(file)
+        return BandFluxTable(lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                             np.load(f'{filepath}.npy', mmap_mode='r'), metadata['max_log_error'])
+
+    table = build_band_flux_table(lambda_interval_bottom, lambda_interval_top, temperature_min, temperature_max,
+                                  relative_tolerance)
+    save_array(f'{filepath}.npy', table.log_integrals)
+    save_json(f'{filepath}.json', dict(description, max_log_error=table.max_log_error.tolist(),
+                                       number_of_temperatures=table.log_integrals.shape[1]))
+    return table
+
+
+def tabulated_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, kind):
+    """
+    Band integral for arrays of bands and temperatures, using one table per distinct band
+    :param lambda_interval_bottom_: band limit
+    :param lambda_interval_top_: band limit
+    :param temperature_: in kelvin
+    :param kind: 'planck' or 'photon'
+    :return: integral, error
+    """
+    bottom, top, temperature = np.broadcast_arrays(np.asarray(lambda_interval_bottom_, dtype=float),
+                                                   np.asarray(lambda_interval_top_, dtype=float),
+                                                   np.asarray(temperature_, dtype=float))
+    bands = np.unique(np.stack([bottom.ravel(), top.ravel()], axis=1), axis=0)
+    if len(bands) == 1:
+        return load_band_flux_table(*bands[0]).band_integral(temperature, kind)
+
+    integral = np.empty(temperature.shape)
+    integral_error = np.empty(temperature.shape)
+    for band_bottom, band_top in bands:
+        in_band = (bottom == band_bottom) & (top == band_top)
+        integral[in_band], integral_error[in_band] = load_band_flux_table(band_bottom, band_top).band_integral(
+            temperature[in_band], kind)
+    return integral, integral_error
+
+
+def tabulated_planck_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_):
+    """
+    Same as GT_for_cumlus.planck_band_integral, from the tables
+    :param lambda_interval_bottom_: band limit
+    :param lambda_interval_top_: band limit
+    :param temperature_: in kelvin
+    :return: integral, error
+    """
+    return tabulated_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, 'planck')
+
+
+def tabulated_photon_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_):
+    """
+    Same as GT_for_cumlus.photon_band_integral, from the tables
+    :param lambda_interval_bottom_: band limit
+    :param lambda_interval_top_: band limit
+    :param temperature_: in kelvin
+    :return: integral, error
+    """
+    return tabulated_band_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, 'photon')
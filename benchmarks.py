@@ -0,0 +1,331 @@
+"""
+Benchmarks of the physics kernels and of the sweep paths
+Every benchmark runs at several input sizes. The results are saved as json (one file per commit by default, in
+benchmark_results/), so two commits can be compared and the regressions show up.
+A benchmark whose optional dependencies (e.g. pandas for reading_plots/QE_values.py, or muLAn for the light curves of
+notebooks/simulating_the_lightcurve.ipynb) are not installed is skipped.
+
+Usage:
+    python -m cumlus.benchmarks run                        # all the benchmarks, saved as benchmark_results/<commit>.json
+    python -m cumlus.benchmarks run --filter quad --quick  # only the benchmarks with quad in the name, smallest size
+    python -m cumlus.benchmarks compare benchmark_results/<old>.json benchmark_results/<new>.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIRECTORY = 'benchmark_results'
+# A benchmark is a regression if it is this many times slower than in the baseline
+REGRESSION_THRESHOLD = 1.2
+
+# name: (setup, sizes). setup(size) returns the function (without arguments) that is timed, or the function and the
+# number of elements it computes when that is not size (for the time per element)
+BENCHMARKS = {}
+
+
+def benchmark(sizes):
+    """
+    Decorator to register a benchmark. The name is the name of the setup function without 'benchmark_'
+    :param sizes: input sizes the benchmark runs at
+    """
+    def register(setup):
+        BENCHMARKS[setup.__name__.replace('benchmark_', '', 1)] = (setup, sizes)
+        return setup
+    return register
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_radiative_spectral_emittance(size):
+    from cumlus.GT_for_cumlus import radiative_spectral_emittance
+    wavelength = np.linspace(1300e-9, 1900e-9, size)
+    return lambda: radiative_spectral_emittance(wavelength, 2800)
+
+
+def _temperatures(size):
+    return np.linspace(2500, 6000, size)
+
+
+@benchmark(sizes=[10, 100, 1000])
+def benchmark_gt_radiant_flux_quad(size):
+    from cumlus.GT_for_cumlus import radiant_flux_perratioflux_integral
+    temperatures = _temperatures(size)
+    return lambda: [radiant_flux_perratioflux_integral(1300, 1900, temperature, method_='quad')
+                    for temperature in temperatures]
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_gt_radiant_flux_series(size):
+    from cumlus.GT_for_cumlus import radiant_flux_perratioflux_integral
+    temperatures = _temperatures(size)
+    return lambda: radiant_flux_perratioflux_integral(1300, 1900, temperatures, method_='series')
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_gt_radiant_flux_table(size):
+    from cumlus.GT_for_cumlus import radiant_flux_perratioflux_integral
+    temperatures = _temperatures(size)
+    radiant_flux_perratioflux_integral(1300, 1900, temperatures[:1], method_='table')  # build or load the table
+    return lambda: radiant_flux_perratioflux_integral(1300, 1900, temperatures, method_='table')
+
+
+@benchmark(sizes=[10, 100, 1000])
+def benchmark_gt_photon_count_quad(size):
+    from cumlus.GT_for_cumlus import total_number_of_incident_photon_per_second_per_area
+    radiant_fluxes = np.linspace(1e-10, 1e-8, size)
+    return lambda: [total_number_of_incident_photon_per_second_per_area(1300e-9, 1900e-9, radiant_flux, 0.45,
+                                                                        method_='quad')
+                    for radiant_flux in radiant_fluxes]
+
+
+@benchmark(sizes=[10, 100, 1000])
+def benchmark_gaborthesis_radiant_flux_quad(size):
+    from cumlus.gaborthesis import radiant_flux_perratioflux_integral
+    temperatures = _temperatures(size)
+    return lambda: [radiant_flux_perratioflux_integral(1300, 1900, temperature, method_='quad')
+                    for temperature in temperatures]
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_gaborthesis_radiant_flux_series(size):
+    from cumlus.gaborthesis import radiant_flux_perratioflux_integral
+    temperatures = _temperatures(size)
+    return lambda: radiant_flux_perratioflux_integral(1300, 1900, temperatures, method_='series')
+
+
+def _sensitivity_parameters(size):
+    from astropy import units as u
+    from cumlus.sensitivity_equations import photoelectrons
+    return {'wavelength_star_peak': 4e-7 * u.m, 'luminosity_of_the_star': 0.02 * 4e26 * u.W,
+            'distance_from_observer': np.linspace(1.5e3, 7e3, size) * u.pc, 'telescope_diameter': 15 * u.cm,
+            'quantum_efficiency_value': 0.95, 'etenue_value': 0.95, 'dark_current': 0.001 * photoelectrons / u.s,
+            'read_out': 3.0 * photoelectrons / u.s, 'diffuse_background': 1.0 * photoelectrons / u.s,
+            'magnification': 1.34}
+
+
+@benchmark(sizes=[10, 100, 1000])
+def benchmark_sensitivity_astropy_per_point(size):
+    from cumlus.sensitivity_equations import command_to_return_relative_signal_to_noise_ratio
+    parameters = _sensitivity_parameters(size)
+    distances = parameters.pop('distance_from_observer')
+    return lambda: [command_to_return_relative_signal_to_noise_ratio(distance_from_observer=distance, **parameters)
+                    for distance in distances]
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_sensitivity_plan(size):
+    from cumlus.sensitivity_equations import compile_relative_signal_to_noise_ratio_plan, \
+        relative_signal_to_noise_ratio_from_plan
+    parameters = _sensitivity_parameters(size)
+    return lambda: relative_signal_to_noise_ratio_from_plan(compile_relative_signal_to_noise_ratio_plan(**parameters))
+
+
+@benchmark(sizes=[1000, 100000, 1000000])
+def benchmark_snr_sweep(size):
+    from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+    temperatures = _temperatures(size)
+    return lambda: signal_to_noise_ratio_sweep(temperatures, 18.0, 185, 1300, 1900, 1.0)
+
+
+@benchmark(sizes=[1, 10])
+def benchmark_qe_values_pandas(size):
+    # reading_plots/QE_values.py reads its csv files from the working directory
+    from cumlus.reading_plots import QE_values
+
+    def load():
+        working_directory = os.getcwd()
+        os.chdir(os.path.join(PACKAGE_DIRECTORY, 'reading_plots'))
+        try:
+            for _ in range(size):
+                QE_values.get_quantum_efficiency_commercial_camera()
+                QE_values.get_quantum_efficiency_h2rg()
+        finally:
+            os.chdir(working_directory)
+    return load
+
+
+@benchmark(sizes=[1, 10])
+def benchmark_qe_values_numpy(size):
+    from cumlus.detector_registry import quantum_efficiency_curve
+    from cumlus.quantum_efficiency import load_quantum_efficiency_curves
+
+    def load():
+        # the curves are loaded from the cache directory every time, not taken from the LRU cache
+        for _ in range(size):
+            quantum_efficiency_curve.cache_clear()
+            load_quantum_efficiency_curves()
+    return load
+
+
+def _light_curve_times(size):
+    return np.linspace(-30, 30, size)
+
+
+@benchmark(sizes=[30, 2000, 100000])
+def benchmark_light_curve_pspl_mulan(size):
+    # Same call as MagnificationSignal.generating_magnification_PSPL of notebooks/simulating_the_lightcurve.ipynb
+    import muLAn.models.PSPL as PSPL
+    times = _light_curve_times(size)
+    lens_parameters = {'u0': 0.1, 'tE': 15.0, 't0': 0.0, 'piEN': 0.0, 'piEE': 0.0}
+    Ds = {'N': np.zeros(size), 'E': np.zeros(size)}
+    return lambda: PSPL.magnifcalc(times, lens_parameters, Ds=Ds)
+
+
+@benchmark(sizes=[30, 2000])
+def benchmark_light_curve_binary_vbb(size):
+    # Same as MagnificationSignal.calculating_magnification_from_vbb of notebooks/simulating_the_lightcurve.ipynb
+    from muLAn.models.vbb.vbb import vbbmagU
+    tau = _light_curve_times(size) / 15.0
+    alpha = 100
+    x = -(tau * np.cos(alpha) - 0.1 * np.sin(alpha))
+    y = tau * np.sin(alpha) + 0.1 * np.cos(alpha)
+    return lambda: [vbbmagU(0.9, 0.0001, 0.000049, x_, y_, 1e-3) for x_, y_ in zip(x, y)]
+
+
+@benchmark(sizes=[30, 2000, 10000])
+def benchmark_light_curve_pspl_batched(size):
+    # 1000 events of size times each (at most 1e7 samples, 80 MB of results)
+    from cumlus.point_lens import pspl_light_curves
+    times = _light_curve_times(size)
+    t0, u0, tE = np.zeros(1000), np.linspace(0.01, 1.0, 1000), np.full(1000, 15.0)
+    return lambda: pspl_light_curves(times, t0, u0, tE), len(t0) * size
+
+
+@benchmark(sizes=[30, 2000])
+def benchmark_light_curve_binary_batched(size):
+    # Same event as benchmark_light_curve_binary_vbb
+    from cumlus.binary_lens import binary_lens_light_curve
+    times = _light_curve_times(size)
+    return lambda: binary_lens_light_curve(times, t0=0.0, u0=0.1, tE=15.0, rho=0.000049, s=0.9, q=0.0001, alpha=100)
+
+
+def time_function(function, repeat=5):
+    """
+    Time a function as timeit does: the number of calls per measurement is chosen so a measurement takes at least 0.2 s
+    :param function: function without arguments
+    :param repeat: number of measurements
+    :return: best and median time per call in seconds
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [measurement / number for measurement in timer.repeat(repeat=repeat, number=number)]
+    return min(times), statistics.median(times)
+
+
+def git_commit():
+    """
+    :return: short hash of the commit of the working tree (with '-dirty' if there are changes), or 'unknown'
+    """
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=PACKAGE_DIRECTORY,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = 'unknown'
+    return commit
+
+
+def run_benchmarks(name_filter='', quick=False, repeat=5, verbose=True):
+    """
+    Run the benchmarks
+    :param name_filter: only the benchmarks with this in their name
+    :param quick: only the smallest size of every benchmark
+    :param repeat: number of measurements per size
+    :param verbose: print every result
+    :return: dictionary with the environment and the results (name: size: timings, or the reason it was skipped)
+    """
+    results = {}
+    for name, (setup, sizes) in BENCHMARKS.items():
+        if name_filter not in name:
+            continue
+        results[name] = {}
+        for size in sizes[:1] if quick else sizes:
+            try:
+                function = setup(size)
+            except ModuleNotFoundError as error:
+                results[name] = {'skipped': str(error)}
+                if verbose:
+                    print(f'{name:45s} skipped ({error})')
+                break
+            function, number_of_elements = function if isinstance(function, tuple) else (function, size)
+            best, median = time_function(function, repeat)
+            results[name][str(size)] = {'best': best, 'median': median,
+                                        'best_per_element': best / number_of_elements}
+            if verbose:
+                print(f'{name:45s} {size:>9d} {best * 1e3:12.4f} ms '
+                      f'{best / number_of_elements * 1e9:12.2f} ns/element')
+    return {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+            'results': results}
+
+
+def compare_benchmark_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare two results of run_benchmarks
+    :param baseline: results (or the json file with them)
+    :param current: results (or the json file with them)
+    :param threshold: ratio of the times above which a benchmark is a regression
+    :return: list of (name, size, baseline best time, current best time, ratio, is regression)
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as file:
+            baseline = json.load(file)
+    if isinstance(current, str):
+        with open(current) as file:
+            current = json.load(file)
+    comparison = []
+    for name, sizes in current['results'].items():
+        for size, timings in sizes.items():
+            baseline_timings = baseline['results'].get(name, {}).get(size)
+            if not isinstance(timings, dict) or not isinstance(baseline_timings, dict):
+                continue
+            ratio = timings['best'] / baseline_timings['best']
+            comparison.append((name, size, baseline_timings['best'], timings['best'], ratio, ratio > threshold))
+    return comparison
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m cumlus.benchmarks', description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and save the results')
+    run_parser.add_argument('--filter', default='', help='only the benchmarks with this in their name')
+    run_parser.add_argument('--quick', action='store_true', help='only the smallest size of every benchmark')
+    run_parser.add_argument('--repeat', type=int, default=5, help='number of measurements per size')
+    run_parser.add_argument('--output', help=f'json file (default {RESULTS_DIRECTORY}/<commit>.json)')
+    compare_parser = subparsers.add_parser('compare', help='compare two saved results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                                help='ratio of the times above which a benchmark is a regression')
+    subparsers.add_parser('list', help='list the benchmarks and their sizes')
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'list':
+        for name, (_, sizes) in BENCHMARKS.items():
+            print(f'{name:45s} {sizes}')
+    elif arguments.command == 'run':
+        results = run_benchmarks(arguments.filter, arguments.quick, arguments.repeat)
+        output = arguments.output or os.path.join(RESULTS_DIRECTORY, f'{results["commit"]}.json')
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=1)
+        print(f'Results saved in {output}')
+    else:
+        comparison = compare_benchmark_results(arguments.baseline, arguments.current, arguments.threshold)
+        for name, size, baseline_time, current_time, ratio, is_regression in comparison:
+            print(f'{name:45s} {size:>9s} {baseline_time * 1e3:12.4f} ms {current_time * 1e3:12.4f} ms '
+                  f'{ratio:8.2f}x{"  REGRESSION" if is_regression else ""}')
+        if any(row[-1] for row in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
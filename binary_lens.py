@@ -0,0 +1,529 @@
+"""
+Binary-lens magnification for whole arrays of source positions, with numpy only
+Replaces the per-point calls to vbbmagU (muLAn) of MagnificationSignal.calculating_magnification_from_vbb in
+notebooks/simulating_the_lightcurve.ipynb.
+Coordinates are in Einstein radii of the total mass, with the origin in the center of mass and the lenses on the x axis,
+as in VBBinaryLensing: the first lens (mass 1/(1 + q)) at x = -s q / (1 + q) and the second one (mass q / (1 + q)) at
+x = s / (1 + q).
+- Point source: the lens equation is written as a fifth degree polynomial (Witt and Mao 1995), and the polynomials of
+  all the positions are solved at once (Aberth-Ehrlich iterations on arrays, eigenvalues of the companion matrices for
+  the few that do not converge). The roots that satisfy the lens equation are the images.
+- Finite source (uniform disk): it is only computed where a cheap test says it matters, i.e. where the quadrupole
+  correction (from the derivatives of the lens map at the images, Bozza et al. 2018) is larger than the tolerance, or
+  where the source is close to a caustic (distance to the caustics sampled once per lens). There, the images of the
+  source boundary are found for all the points of all the boundaries at once, and the area of the images is the sum of
+  the contour integrals (Green's theorem) along them. Every interval of a boundary is split in two until its area
+  changes less than its share of the tolerance, and until it is shorter than its distance to the caustics (so that a
+  caustic that only grazes the source is not missed between two points).
+Everywhere else the point-source magnification is used.
+"""
+import functools
+
+import numpy as np
+
+# Residual of the lens equation below which a root of the polynomial is an image
+IMAGE_TOLERANCE = 1e-6
+# Only the roots with a residual below this are polished (the others could converge to an image already found)
+POLISH_TOLERANCE = 1e-3
+# Intervals of the source boundaries shorter than this (in Einstein radii) are not split, the images are not precise
+# enough to resolve them
+MINIMUM_BOUNDARY_STEP = 1e-8
+# Number of finite sources computed together
+FINITE_SOURCE_CHUNK_SIZE = 1024
+# Largest number of angles used to sample the caustics (4 points per angle)
+MAXIMUM_CAUSTIC_POINTS = 2 ** 17
+
+
+def lens_positions(s, q):
+    """
+    :param s: separation of the lenses in Einstein radii
+    :param q: mass ratio (second / first)
+    :return: position and mass of the first lens, position and mass of the second lens
+    """
+    return -s * q / (1 + q), 1 / (1 + q), s / (1 + q), q / (1 + q)
+
+
+def _multiply(a, b):
+    """
+    Product of polynomials (coefficients from the lowest degree, in the last axis)
+    """
+    product = np.zeros(np.broadcast_shapes(a.shape[:-1], b.shape[:-1]) + (a.shape[-1] + b.shape[-1] - 1,),
+                       dtype=complex)
+    for i in range(a.shape[-1]):
+        product[..., i:i + b.shape[-1]] += a[..., i:i + 1] * b
+    return product
+
+
+def lens_equation_polynomial(source, s, q, origin=0.0):
+    """
+    Fifth degree polynomial whose roots contain the images of a point source
+    :param source: complex array of source positions x + iy
+    :param s:
+    :param q:
+    :param origin: the variable of the polynomial is z - origin. The roots close to the origin are the most accurate
+    :return: coefficients (source.shape + (6,)), from the highest degree
+    """
+    z1, m1, z2, m2 = lens_positions(s, q)
+    z1, z2 = z1 - origin, z2 - origin
+    source = np.asarray(source, dtype=complex)[..., np.newaxis] - origin
+    source_conjugate = np.conj(source)
+    denominator = np.array([z1 * z2, -(z1 + z2), 1], dtype=complex)
+    numerator = np.array([-(m1 * z2 + m2 * z1), m1 + m2, 0], dtype=complex)
+    # conj(z) - z_k = W_k / D, with conj(z) from the conjugate of the lens equation
+    w1 = (source_conjugate - z1) * denominator + numerator
+    w2 = (source_conjugate - z2) * denominator + numerator
+    polynomial = _multiply(np.concatenate([source, -np.ones_like(source)], axis=-1), _multiply(w1, w2))
+    polynomial[..., :5] += _multiply(denominator[np.newaxis], m1 * w2 + m2 * w1)
+    return polynomial[..., ::-1]
+
+
+def _horner(coefficients, z):
+    polynomial = np.broadcast_to(coefficients[..., :1], z.shape).astype(complex)
+    derivative = np.zeros_like(z)
+    for i in range(1, coefficients.shape[-1]):
+        derivative = derivative * z + polynomial
+        polynomial = polynomial * z + coefficients[..., i:i + 1]
+    return polynomial, derivative
+
+
+def polynomial_roots(coefficients, initial_roots=None, maximum_iterations=50):
+    """
+    Roots of many polynomials at once (Aberth-Ehrlich). The polynomials that do not converge are solved with the
+    eigenvalues of their companion matrix
+    :param coefficients: array (..., degree + 1), from the highest degree
+    :param initial_roots: array (..., degree) of starting values (e.g. the roots of nearby polynomials), optional
+    :param maximum_iterations:
+    :return: array (..., degree) of complex roots
+    """
+    shape = coefficients.shape[:-1]
+    degree = coefficients.shape[-1] - 1
+    coefficients = coefficients.reshape(-1, degree + 1)
+    coefficients = coefficients / coefficients[:, :1]
+    if initial_roots is None:
+        radius = np.max(np.abs(coefficients[:, 1:]) ** (1 / np.arange(1, degree + 1)), axis=-1, keepdims=True)
+        roots = radius * np.exp(1j * (2 * np.pi * np.arange(degree) / degree + 0.4))
+    else:
+        roots = np.array(initial_roots, dtype=complex).reshape(-1, degree)
+    active = np.arange(len(roots))
+    diagonal = np.arange(degree)
+    for _ in range(maximum_iterations):
+        if active.size == 0:
+            break
+        active_roots = roots[active]
+        polynomial, derivative = _horner(coefficients[active], active_roots)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton_step = polynomial / derivative
+            differences = active_roots[:, :, np.newaxis] - active_roots[:, np.newaxis, :]
+            differences[:, diagonal, diagonal] = np.inf
+            step = newton_step / (1 - newton_step * (1 / differences).sum(axis=-1))
+        step = np.where(np.isfinite(step), step, 0)
+        roots[active] = active_roots - step
+        converged = np.all(np.abs(step) <= 1e-10 * np.maximum(np.abs(active_roots), 1), axis=-1)
+        active = active[~converged]
+    if active.size:
+        companion = np.zeros((active.size, degree, degree), dtype=complex)
+        companion[:, 0, :] = -coefficients[active, 1:]
+        companion[:, diagonal[1:], diagonal[:-1]] = 1
+        roots[active] = np.linalg.eigvals(companion)
+    return roots.reshape(shape + (degree,))
+
+
+def _lens_map(images, s, q, derivatives=False):
+    """
+    Source position of every image position and the derivatives of f(conj(z)) = -sum m_k / (conj(z) - z_k)
+    """
+    z1, m1, z2, m2 = lens_positions(s, q)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse1 = 1 / (np.conj(images) - z1)
+        inverse2 = 1 / (np.conj(images) - z2)
+    source = images - m1 * inverse1 - m2 * inverse2
+    first = m1 * inverse1 ** 2 + m2 * inverse2 ** 2
+    if not derivatives:
+        return source, first
+    second = -2 * (m1 * inverse1 ** 3 + m2 * inverse2 ** 3)
+    third = 6 * (m1 * inverse1 ** 4 + m2 * inverse2 ** 4)
+    return source, first, second, third
+
+
+def polish_images(roots, source, s, q, iterations=2):
+    """
+    Newton iterations on the lens equation itself (better conditioned than the polynomial, e.g. for the images close
+    to a small mass). Only the roots close to an image, away from the critical curves, are polished, and a step is only
+    kept if it reduces the residual
+    :param roots: array (..., 5)
+    :param source: complex array of source positions (roots.shape[:-1])
+    :param s:
+    :param q:
+    :param iterations:
+    :return: roots, residual of the lens equation, jacobian determinant
+    """
+    source = source[..., np.newaxis]
+    mapped_source, first = _lens_map(roots, s, q)
+    residual = mapped_source - source
+    # not close to the critical curves, where two images are close and could end on the same one
+    close = (np.abs(residual) < POLISH_TOLERANCE) & (np.abs(1 - np.abs(first) ** 2) > 0.5)
+    for _ in range(iterations):
+        jacobian = 1 - np.abs(first) ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_roots = roots + (first * np.conj(residual) - residual) / jacobian
+        new_mapped_source, new_first = _lens_map(new_roots, s, q)
+        new_residual = new_mapped_source - source
+        better = close & (np.abs(new_residual) < np.abs(residual))
+        roots = np.where(better, new_roots, roots)
+        residual = np.where(better, new_residual, residual)
+        first = np.where(better, new_first, first)
+    residual = np.abs(residual)
+    return roots, np.where(np.isfinite(residual), residual, np.inf), 1 - np.abs(first) ** 2
+
+
+def point_source_images(source, s, q, initial_roots=None, warm_start_stride=16):
+    """
+    Images of point sources
+    :param source: complex array of source positions x + iy
+    :param s:
+    :param q:
+    :param initial_roots: starting values for the roots (e.g. the images of nearby sources), optional
+    :param warm_start_stride: without initial_roots, every warm_start_stride-th source (in the order of the flattened
+                              array) is solved first, and its roots are the starting values of the next ones. For light
+                              curves, where the next sources are close, it saves most of the iterations
+    :return: roots (source.shape + (5,)), which roots are images (3 or 5 of them), jacobian determinant of each root
+    """
+    source = np.asarray(source, dtype=complex)
+    # origin on the smaller mass, to resolve the images close to it
+    z1, m1, z2, m2 = lens_positions(s, q)
+    origin = z2 if m2 <= m1 else z1
+    polynomial = lens_equation_polynomial(source, s, q, origin)
+    if initial_roots is not None:
+        initial_roots = initial_roots - origin
+    if initial_roots is None and source.size > warm_start_stride > 1:
+        flat_polynomial = polynomial.reshape(-1, polynomial.shape[-1])
+        coarse_roots = polynomial_roots(flat_polynomial[::warm_start_stride])
+        initial_roots = np.repeat(coarse_roots, warm_start_stride, axis=0)[:len(flat_polynomial)]
+    roots = polynomial_roots(polynomial, initial_roots) + origin
+    roots, residual, jacobian = polish_images(roots, source, s, q)
+    # the three best roots are always images, the other two are images together or not at all
+    order = np.argsort(residual, axis=-1)
+    sorted_residual = np.take_along_axis(residual, order, axis=-1)
+    five_images = np.all(sorted_residual[..., 3:] < IMAGE_TOLERANCE, axis=-1, keepdims=True)
+    is_sorted_image = np.concatenate([np.ones_like(sorted_residual[..., :3], dtype=bool),
+                                      np.broadcast_to(five_images, sorted_residual[..., 3:].shape)], axis=-1)
+    is_image = np.empty_like(is_sorted_image)
+    np.put_along_axis(is_image, order, is_sorted_image, axis=-1)
+    return roots, is_image, jacobian
+
+
+def point_source_magnification(x, y, s, q):
+    """
+    Magnification of point sources
+    :param x: array of source positions along the lens axis
+    :param y: array of source positions
+    :param s:
+    :param q:
+    :return: magnification (x and y broadcast together)
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    _, is_image, jacobian = point_source_images(np.atleast_1d(x + 1j * y), s, q)
+    return np.sum(np.where(is_image, 1 / np.abs(jacobian), 0), axis=-1).reshape(x.shape)
+
+
+def quadrupole_correction(roots, is_image, s, q, rho):
+    """
+    Second order finite-source correction of a uniform source of radius rho, rho^2 / 8 times the laplacian of the
+    point-source magnification (the derivatives come from the lens map at the images)
+    :param roots: output of point_source_images
+    :param is_image: output of point_source_images
+    :param s:
+    :param q:
+    :param rho: source radius in Einstein radii
+    :return: correction to add to the point-source magnification
+    """
+    _, first, second, third = _lens_map(roots, s, q, derivatives=True)
+    jacobian = 1 - np.abs(first) ** 2
+    cross = second * np.conj(first) - first ** 2 * np.conj(second)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        laplacian = 4 * ((np.abs(second) ** 2 * (1 + 2 * np.abs(first) ** 2) -
+                          2 * np.real(first ** 2 * np.conj(third))) / jacobian ** 4 +
+                         3 * np.abs(cross) ** 2 / jacobian ** 5)
+    return rho ** 2 / 8 * np.sum(np.where(is_image, np.sign(jacobian) * laplacian, 0), axis=-1)
+
+
+def caustics(s, q, number_of_points=2048):
+    """
+    Points of the caustics, from the critical curves sum m_k / (conj(z) - z_k)^2 = exp(i phi)
+    :param s:
+    :param q:
+    :param number_of_points: number of angles phi (there are 4 points per angle)
+    :return: complex array of caustic points, complex array of the critical curve points
+    """
+    z1, m1, z2, m2 = lens_positions(s, q)
+    phase = np.exp(2j * np.pi * np.arange(number_of_points) / number_of_points)[:, np.newaxis]
+    # m1 (w - z2)^2 + m2 (w - z1)^2 - exp(i phi) (w - z1)^2 (w - z2)^2, with w = conj(z)
+    square1 = np.array([z1 ** 2, -2 * z1, 1], dtype=complex)
+    square2 = np.array([z2 ** 2, -2 * z2, 1], dtype=complex)
+    polynomial = -phase * _multiply(square1[np.newaxis], square2[np.newaxis])
+    polynomial[:, :3] += m1 * square2 + m2 * square1
+    critical_curves = np.conj(polynomial_roots(polynomial[:, ::-1])).ravel()
+    return _lens_map(critical_curves, s, q)[0], critical_curves
+
+
+@functools.lru_cache(maxsize=16)
+def _caustic_tree(s, q, resolution):
+    """
+    k-d tree of caustic points, sampled finely enough for the largest gap between neighbouring points to be below
+    resolution (the gaps shrink like one over the number of points)
+    :return: scipy.spatial.cKDTree, largest gap
+    """
+    from scipy.spatial import cKDTree
+    caustic_points = caustics(s, q, 1024)[0]
+    tree = cKDTree(np.column_stack([caustic_points.real, caustic_points.imag]))
+    # the nearest neighbour can be on the other side of a point, hence the factor 2
+    gap = 2 * np.max(tree.query(tree.data, k=2)[0][:, 1])
+    if gap > resolution:
+        number_of_points = min(1024 * 2 ** int(np.ceil(np.log2(gap / resolution))), MAXIMUM_CAUSTIC_POINTS)
+        caustic_points = caustics(s, q, number_of_points)[0]
+        tree = cKDTree(np.column_stack([caustic_points.real, caustic_points.imag]))
+        gap *= 1024 / number_of_points
+    return tree, gap
+
+
+def caustic_distance(source, s, q, resolution=1e-3, upper_bound=np.inf):
+    """
+    Distance of the sources to the closest caustic
+    :param source: complex array of source positions
+    :param s:
+    :param q:
+    :param resolution: the caustics are sampled finely enough to know the distance within about this
+    :param upper_bound: number, the distances larger than this are not needed and are infinite (much faster)
+    :return: distance (source.shape), largest gap between the caustic points (the distance is known up to this gap)
+    """
+    tree, gap = _caustic_tree(float(s), float(q), float(resolution))
+    source = np.asarray(source, dtype=complex)
+    distance = tree.query(np.column_stack([source.real.ravel(), source.imag.ravel()]),
+                          distance_upper_bound=upper_bound)[0]
+    return distance.reshape(source.shape), gap
+
+
+def _match_next(roots, next_roots):
+    """
+    For every root, the index of the closest root of the next boundary point (each root is used once)
+    """
+    distance = np.abs(roots[..., :, np.newaxis] - next_roots[..., np.newaxis, :])
+    degree = roots.shape[-1]
+    match = np.zeros(roots.shape, dtype=int)
+    for _ in range(degree):
+        flat = np.argmin(distance.reshape(distance.shape[:-2] + (-1,)), axis=-1)
+        row, column = np.divmod(flat, degree)
+        np.put_along_axis(match, row[..., np.newaxis], column[..., np.newaxis], axis=-1)
+        row_mask = np.arange(degree) == row[..., np.newaxis]
+        column_mask = np.arange(degree) == column[..., np.newaxis]
+        distance[row_mask[..., :, np.newaxis] | column_mask[..., np.newaxis, :]] = np.inf
+    return match
+
+
+def _pair_area(positions, flagged, jacobian):
+    """
+    Area term 1/2 Im(conj(a) b) joining every flagged image with the closest other flagged image, where a is the one
+    with the largest jacobian (the positive parity image, the sign of the jacobians of a pair at a critical curve is not
+    reliable)
+    """
+    distance = np.abs(positions[..., :, np.newaxis] - positions[..., np.newaxis, :])
+    distance = np.where(flagged[..., :, np.newaxis] & flagged[..., np.newaxis, :], distance, np.inf)
+    diagonal = np.arange(positions.shape[-1])
+    distance[..., diagonal, diagonal] = np.inf
+    partner = np.argmin(distance, axis=-1)
+    partner_positions = np.take_along_axis(positions, partner, axis=-1)
+    is_first = flagged & np.isfinite(np.min(distance, axis=-1)) & \
+        (jacobian > np.take_along_axis(jacobian, partner, axis=-1))
+    return np.sum(np.where(is_first, np.imag(np.conj(positions) * partner_positions) / 2, 0), axis=-1)
+
+
+def _interval_area(start_images, end_images):
+    """
+    Area swept by the images between two points of the source boundary, 1/2 Im(conj(z) dz) with the parity of each
+    image. Where two images appear or disappear between the two points (at a critical curve), their contours are joined
+    :param start_images: roots, is_image, jacobian at the first point of the intervals (arrays (..., 5))
+    :param end_images: same at the second point
+    :return: area of every interval
+    """
+    roots, is_image, jacobian = start_images
+    match = _match_next(roots, end_images[0])
+    next_roots, next_is_image, next_jacobian = (np.take_along_axis(values, match, axis=-1) for values in end_images)
+    # the parity from the end where the jacobian is the largest (the most reliable close to a critical curve)
+    parity = np.sign(np.where(np.abs(jacobian) > np.abs(next_jacobian), jacobian, next_jacobian))
+    segments = np.imag(np.conj(roots) * next_roots) / 2 * parity
+    area = np.sum(np.where(is_image & next_is_image, segments, 0), axis=-1)
+    area += _pair_area(roots, is_image & ~next_is_image, jacobian)
+    area -= _pair_area(next_roots, ~is_image & next_is_image, next_jacobian)
+    return area
+
+
+def finite_source_magnification(source, s, q, rho, relative_tolerance=1e-3, initial_samples=128,
+                                maximum_refinements=16):
+    """
+    Magnification of uniform sources of radius rho, from the area of the images of the source boundary.
+    The boundaries start with initial_samples points, and every interval between two points is split in two until
+    splitting changes its area by less than its share (proportional to its angle) of the tolerance, and until it is
+    shorter than the distance of its ends to the caustics (down to MINIMUM_BOUNDARY_STEP where images appear or
+    disappear). The intervals of all the sources are refined together
+    :param source: 1D complex array of source positions
+    :param s:
+    :param q:
+    :param rho: source radius in Einstein radii
+    :param relative_tolerance:
+    :param initial_samples: number of points of the boundary to start with
+    :param maximum_refinements: largest number of times an interval is split
+    :return: magnification
+    """
+    source = np.asarray(source, dtype=complex)
+    angles = 2 * np.pi * np.arange(initial_samples) / initial_samples
+    boundary = source[:, np.newaxis] + rho * np.exp(1j * angles)
+    roots, is_image, jacobian = point_source_images(boundary, s, q)
+    # distance of the points of the boundaries to the caustics, not smaller than the uncertainty on it
+    distance, gap = caustic_distance(boundary, s, q, rho / 4, upper_bound=2 * np.pi * rho / initial_samples)
+    distance = np.maximum(distance, gap)
+    # one row per interval: the source, the angles and the images at both ends
+    owner = np.repeat(np.arange(len(source)), initial_samples)
+    start_angle = np.tile(angles, len(source))
+    width = np.full(owner.shape, 2 * np.pi / initial_samples)
+    start_images = tuple(values.reshape(-1, 5) for values in (roots, is_image, jacobian))
+    end_images = tuple(np.roll(values, -1, axis=1).reshape(-1, 5) for values in (roots, is_image, jacobian))
+    start_distance = distance.ravel()
+    end_distance = np.roll(distance, -1, axis=1).ravel()
+    area = _interval_area(start_images, end_images)
+    refine = np.ones(owner.shape, dtype=bool)
+    for _ in range(maximum_refinements):
+        if not np.any(refine):
+            break
+        middle_angle = start_angle[refine] + width[refine] / 2
+        middle = source[owner[refine]] + rho * np.exp(1j * middle_angle)
+        middle_images = point_source_images(middle, s, q, initial_roots=start_images[0][refine])
+        middle_distance = caustic_distance(middle, s, q, rho / 4, upper_bound=rho * np.max(width[refine]))[0]
+        middle_distance = np.maximum(middle_distance, gap)
+        first_half = _interval_area(tuple(values[refine] for values in start_images), middle_images)
+        second_half = _interval_area(middle_images, tuple(values[refine] for values in end_images))
+        change = np.abs(first_half + second_half - area[refine])
+        total_area = np.bincount(owner, area, minlength=len(source)) + \
+            np.bincount(owner[refine], first_half + second_half - area[refine], minlength=len(source))
+        split_again = change > relative_tolerance * np.abs(total_area[owner[refine]]) * width[refine] / (2 * np.pi)
+        # the halves where images appear or disappear, or that are close to a caustic, are split again anyway
+        half_length = rho * width[refine] / 2
+        start_count, middle_count, end_count = (np.count_nonzero(images[1], axis=-1) for images in
+                                                (start_images, middle_images, end_images))
+        split_first = (split_again | (start_count[refine] != middle_count) |
+                       (half_length > np.minimum(start_distance[refine], middle_distance))) & \
+            (half_length > MINIMUM_BOUNDARY_STEP)
+        split_second = (split_again | (middle_count != end_count[refine]) |
+                        (half_length > np.minimum(middle_distance, end_distance[refine]))) & \
+            (half_length > MINIMUM_BOUNDARY_STEP)
+        # the refined intervals are replaced by their two halves
+        keep = ~refine
+        owner = np.concatenate([owner[keep], owner[refine], owner[refine]])
+        start_angle = np.concatenate([start_angle[keep], start_angle[refine], middle_angle])
+        half_width = width[refine] / 2
+        width = np.concatenate([width[keep], half_width, half_width])
+        start_images, end_images = (tuple(np.concatenate([values[keep], values[refine], middle_values])
+                                          for values, middle_values in zip(start_images, middle_images)),
+                                    tuple(np.concatenate([values[keep], middle_values, values[refine]])
+                                          for values, middle_values in zip(end_images, middle_images)))
+        start_distance = np.concatenate([start_distance[keep], start_distance[refine], middle_distance])
+        end_distance = np.concatenate([end_distance[keep], middle_distance, end_distance[refine]])
+        area = np.concatenate([area[keep], first_half, second_half])
+        refine = np.concatenate([np.zeros(np.count_nonzero(keep), dtype=bool), split_first, split_second])
+    return np.bincount(owner, area, minlength=len(source)) / (np.pi * rho ** 2)
+
+
+def binary_lens_magnification(x, y, s, q, rho=0.0, relative_tolerance=1e-3, caustic_factor=2.0,
+                              quadrupole_factor=6.0):
+    """
+    Magnification of a uniform source by a binary lens, for arrays of source positions. The finite source is only
+    computed where the quadrupole correction or the distance to the caustics says that it matters
+    :param x: array of source positions along the lens axis
+    :param y: array of source positions
+    :param s: separation of the lenses in Einstein radii
+    :param q: mass ratio
+    :param rho: source radius in Einstein radii (0 for a point source)
+    :param relative_tolerance:
+    :param caustic_factor: the finite source is computed closer than caustic_factor * rho to a caustic
+    :param quadrupole_factor: the finite source is computed where quadrupole_factor * |quadrupole correction| is larger
+                              than the tolerance
+    :return: magnification (x and y broadcast together)
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    # scalars are solved as arrays of one source, and the result gets the shape of the inputs back
+    source = np.atleast_1d(x + 1j * y)
+    roots, is_image, jacobian = point_source_images(source, s, q)
+    magnification = np.sum(np.where(is_image, 1 / np.abs(jacobian), 0), axis=-1)
+    if rho == 0:
+        return magnification.reshape(x.shape)
+    quadrupole = quadrupole_correction(roots, is_image, s, q, rho)
+    distance, gap = caustic_distance(source, s, q, rho / 4)
+    finite_source = (quadrupole_factor * np.abs(quadrupole) > relative_tolerance * magnification) | \
+                    (distance < caustic_factor * rho + gap) | ~np.isfinite(magnification)
+    # the boundaries of a chunk of sources are refined together, chunk by chunk to bound the memory
+    finite_source = np.flatnonzero(finite_source)
+    flat_magnification = magnification.reshape(-1)
+    for chunk_start in range(0, len(finite_source), FINITE_SOURCE_CHUNK_SIZE):
+        chunk = finite_source[chunk_start:chunk_start + FINITE_SOURCE_CHUNK_SIZE]
+        flat_magnification[chunk] = finite_source_magnification(source.ravel()[chunk], s, q, rho, relative_tolerance)
+    return flat_magnification.reshape(x.shape)
+
+
+def source_trajectory(times, t0, u0, tE, alpha):
+    """
+    Source positions along a straight trajectory, as MagnificationSignal.calculating_magnification_from_vbb (with the
+    conversion of the secondary lens from the left to the right)
+    :param times: in days
+    :param t0: time of the closest approach to the center of mass, in days
+    :param u0: impact parameter in Einstein radii
+    :param tE: Einstein radius crossing time in days
+    :param alpha: angle of the trajectory with the lens axis in radians
+    :return: x, y
+    """
+    tau = (np.asarray(times, dtype=float) - t0) / tE
+    x = tau * np.cos(alpha) - u0 * np.sin(alpha)
+    y = tau * np.sin(alpha) + u0 * np.cos(alpha)
+    return -x, y
+
+
+def binary_lens_light_curve(times, t0, u0, tE, rho, s, q, alpha, relative_tolerance=1e-3):
+    """
+    Magnification of a binary-lens event (same parameters as MagnificationSignal.generating_magnification_binary)
+    :param times: in days
+    :param t0: in days
+    :param u0:
+    :param tE: in days
+    :param rho: source radius in Einstein radii
+    :param s:
+    :param q:
+    :param alpha: in radians
+    :param relative_tolerance:
+    :return: magnification at every time
+    """
+    x, y = source_trajectory(times, t0, u0, tE, alpha)
+    return binary_lens_magnification(x, y, s, q, rho, relative_tolerance)
+
+
+if __name__ == '__main__':
+    import time
+
+    # Binary example of the notebook
+    times = np.linspace(-30, 30, 2000)
+    start_time = time.perf_counter()
+    magnification = binary_lens_light_curve(times, t0=0.0, u0=0.1, tE=15.0, rho=0.000049, s=0.9, q=0.0001, alpha=100)
+    print(f'{times.size} points in {time.perf_counter() - start_time:.3f} s, largest magnification '
+          f'{magnification.max():.4f}')
+
+    # A single source position gives a single magnification, as the same position in an array
+    for rho in (0.0, 0.02):
+        single = binary_lens_magnification(0.1, 0.0, 1.0, 0.01, rho)
+        in_array = binary_lens_magnification(np.array([0.1, 0.3]), 0.0, 1.0, 0.01, rho)[0]
+        if np.shape(single) != () or not np.isclose(single, in_array, rtol=1e-6):
+            raise ValueError(f'The magnification of a single source ({single}) is not the one in an array '
+                             f'({in_array}).')
+        print(f'rho = {rho}: magnification at (0.1, 0) = {single:.6f}')
+
+    # Caustic crossings of an equal mass binary with a large source
+    start_time = time.perf_counter()
+    magnification = binary_lens_light_curve(times, t0=0.0, u0=0.05, tE=15.0, rho=0.01, s=1.0, q=1.0, alpha=0.5)
+    print(f'{times.size} points in {time.perf_counter() - start_time:.3f} s, largest magnification '
+          f'{magnification.max():.4f}')
@@ -0,0 +1,143 @@
+"""
+Series kernel for the band integrals of a black body
+With x = h*c/(wavelength*k*T) the band integrals of the Planck law become (dimensionless) integrals of
+x^n/(e^x - 1), n = 3 for the power and n = 2 for the number of photons. Those have fast converging series:
+ - for small x (x < 2*pi), expanding x/(e^x - 1) with the Bernoulli numbers
+   int_0^x t^n/(e^t - 1) dt = x^n/n - x^(n+1)/(2(n+1)) + sum_k B_2k/(2k)! x^(2k+n)/(2k+n)
+ - for large x
+   int_x^inf t^n/(e^t - 1) dt = sum_k e^(-kx) sum_j n!/(n-j)! x^(n-j)/k^(j+1)
+The band is split at x = SERIES_SWITCH and each part uses the series that converges faster there, so all the
+temperatures and band limits are done with a fixed number of terms in the same numpy pass.
+"""
+import math
+from fractions import Fraction
+
+import numpy as np
+
+# x where we change from the small x series to the large x series
+SERIES_SWITCH = 2.0
+
+
+def bernoulli_numbers(number_of_numbers):
+    """
+    Bernoulli numbers B_0, B_1, ... (B_1 = -1/2) from the usual recurrence, exact with fractions
+    :param number_of_numbers:
+    :return: list of Fractions
+    """
+    bernoulli = [Fraction(1)]
+    for m in range(1, number_of_numbers):
+        bernoulli.append(-sum(math.comb(m + 1, j) * bernoulli[j] for j in range(m)) / (m + 1))
+    return bernoulli
+
+
+# B_2k/(2k)! for k = 1, 2, ...
+_BERNOULLI = bernoulli_numbers(62)
+EVEN_BERNOULLI_OVER_FACTORIAL = np.array([float(_BERNOULLI[2 * k] / math.factorial(2 * k)) for k in range(1, 31)])
+
+
+def number_of_series_terms(relative_tolerance):
+    """
+    Number of terms for each series so that the truncation stays below relative_tolerance up to SERIES_SWITCH
+    Small x: the terms decrease at least by (SERIES_SWITCH/(2 pi))^2
+    Large x: the terms decrease at least by e^(-SERIES_SWITCH)
+    :param relative_tolerance:
+    :return: number_of_lower_terms, number_of_upper_terms
+    """
+    relative_tolerance = max(relative_tolerance, np.finfo(float).eps)
+    lower_ratio = (SERIES_SWITCH / (2 * np.pi)) ** 2
+    number_of_lower_terms = int(np.ceil(np.log(relative_tolerance) / np.log(lower_ratio)))
+    number_of_upper_terms = int(np.ceil(-np.log(relative_tolerance) / SERIES_SWITCH)) + 1
+    return min(number_of_lower_terms, len(EVEN_BERNOULLI_OVER_FACTORIAL) - 1), number_of_upper_terms
+
+
+def lower_series(x, order, number_of_terms):
+    """
+    int_0^x t^order/(e^t - 1) dt, for 0 <= x < 2 pi
+    The Bernoulli terms are summed with Horner's rule in x^2
+    :param x: array
+    :param order: power of t in the integrand
+    :param number_of_terms: number of Bernoulli terms
+    :return: integral, error (first term left out)
+    """
+    x = np.asarray(x, dtype=float)
+    x_squared = x * x
+    coefficients = EVEN_BERNOULLI_OVER_FACTORIAL / (2 * np.arange(1, len(EVEN_BERNOULLI_OVER_FACTORIAL) + 1) + order)
+    series = np.full(x.shape, coefficients[number_of_terms - 1])
+    for coefficient in coefficients[number_of_terms - 2::-1]:
+        series = series * x_squared + coefficient
+    x_order = x ** order
+    integral = x_order * (1 / order - x / (2 * (order + 1)) + x_squared * series)
+    integral_error = (np.abs(coefficients[number_of_terms]) * x_order * x_squared ** (number_of_terms + 1) /
+                      (1 - x_squared / (2 * np.pi) ** 2))
+    return integral, integral_error
+
+
+def upper_series(x, order, number_of_terms):
+    """
+    int_x^inf t^order/(e^t - 1) dt, for x > 0 (converges fast for x > 1)
+    The powers e^(-kx) are built by repeated products, so there is only one exponential per element
+    :param x: array
+    :param order: power of t in the integrand
+    :param number_of_terms: number of exponential terms
+    :return: integral, error (bound of the terms left out)
+    """
+    x = np.asarray(x, dtype=float)
+    # n!/(n-j)! for j = 0 .. n, the coefficients of x^(n-j)/k^(j+1)
+    coefficients = [math.factorial(order) / math.factorial(order - j) for j in range(order + 1)]
+    with np.errstate(over='ignore', invalid='ignore'):
+        exponential = np.exp(-x)
+        exponential_k = np.ones(x.shape)
+        integral = np.zeros(x.shape)
+        for k in range(1, number_of_terms + 1):
+            exponential_k = exponential_k * exponential
+            polynomial = np.zeros(x.shape)
+            for j, coefficient in enumerate(coefficients):
+                polynomial = polynomial * x + coefficient / k ** (j + 1)
+            integral = integral + exponential_k * polynomial
+        polynomial_bound = np.zeros(x.shape)
+        for coefficient in coefficients:
+            polynomial_bound = polynomial_bound * x + coefficient
+        integral_error = exponential_k * exponential / (1 - exponential) * polynomial_bound
+    # very large x (i.e. wavelength -> 0) has nothing left to integrate
+    integral = np.where(np.isinf(x), 0.0, integral)
+    integral_error = np.where(np.isinf(x), 0.0, integral_error)
+    return integral, integral_error
+
+
+def _masked(series, x, used, order, number_of_terms):
+    """
+    Evaluate series only on the elements that are used, zero elsewhere
+    """
+    integral = np.zeros(x.shape)
+    integral_error = np.zeros(x.shape)
+    integral[used], integral_error[used] = series(x[used], order, number_of_terms)
+    return integral, integral_error
+
+
+def bose_einstein_band_integral(x_low, x_high, order=3, relative_tolerance=1e-12):
+    """
+    int_{x_low}^{x_high} x^order/(e^x - 1) dx, for arrays of limits (broadcast together)
+    :param x_low: integral limit
+    :param x_high: integral limit
+    :param order: 3 for the power (Planck law), 2 for the number of photons
+    :param relative_tolerance: tolerance for the truncation of the series
+    :return: integral, error (truncation of the series plus rounding), like quad
+    """
+    x_low, x_high = np.broadcast_arrays(np.asarray(x_low, dtype=float), np.asarray(x_high, dtype=float))
+    number_of_lower_terms, number_of_upper_terms = number_of_series_terms(relative_tolerance)
+
+    lower_x_high, lower_x_low = np.minimum(x_high, SERIES_SWITCH), np.minimum(x_low, SERIES_SWITCH)
+    upper_x_low, upper_x_high = np.maximum(x_low, SERIES_SWITCH), np.maximum(x_high, SERIES_SWITCH)
+    # a part of the band that is empty cancels exactly, so it is not evaluated and does not add any error
+    lower_used = lower_x_high != lower_x_low
+    upper_used = upper_x_low != upper_x_high
+    lower_high, lower_high_error = _masked(lower_series, lower_x_high, lower_used, order, number_of_lower_terms)
+    lower_low, lower_low_error = _masked(lower_series, lower_x_low, lower_used, order, number_of_lower_terms)
+    upper_low, upper_low_error = _masked(upper_series, upper_x_low, upper_used, order, number_of_upper_terms)
+    upper_high, upper_high_error = _masked(upper_series, upper_x_high, upper_used, order, number_of_upper_terms)
+
+    integral = (lower_high - lower_low) + (upper_low - upper_high)
+    rounding_error = 4 * np.finfo(float).eps * (np.abs(lower_high) + np.abs(lower_low) +
+                                                np.abs(upper_low) + np.abs(upper_high))
+    integral_error = lower_high_error + lower_low_error + upper_low_error + upper_high_error + rounding_error
+    return integral, integral_error
@@ -0,0 +1,70 @@
+"""
+Helpers for the on-disk caches (band flux tables, detector curves, ...)
+The caches live in $CUMLUS_CACHE_DIRECTORY, or ~/.cache/cumlus if it is not set.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def cache_directory(subdirectory):
+    """
+    Return (and create) the cache directory for one kind of cache
+    :param subdirectory: e.g. 'band_flux_tables'
+    :return: path
+    """
+    root = os.environ.get('CUMLUS_CACHE_DIRECTORY', os.path.join(os.path.expanduser('~'), '.cache', 'cumlus'))
+    directory = os.path.join(root, subdirectory)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def hash_key(description):
+    """
+    Key of a cache entry: the hash of everything the entry depends on
+    :param description: json serializable dictionary (band, constants, tolerances, file hashes, ...)
+    :return: hex string
+    """
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def file_hash(filepath):
+    """
+    sha256 of the content of a file
+    :param filepath:
+    :return: hex string
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def save_array(filepath, array):
+    """
+    Save a .npy file so that it can be memory mapped, writing to a temporary file first so that a half written file
+    is never read by another process
+    :param filepath:
+    :param array:
+    :return: None
+    """
+    temporary_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(temporary_filepath, 'wb') as file:
+        np.save(file, array)
+    os.replace(temporary_filepath, filepath)
+
+
+def save_json(filepath, dictionary):
+    """
+    Same as save_array, for the metadata of an entry
+    :param filepath:
+    :param dictionary:
+    :return: None
+    """
+    temporary_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(temporary_filepath, 'w') as file:
+        json.dump(dictionary, file, indent=1)
+    os.replace(temporary_filepath, filepath)
@@ -0,0 +1,324 @@
+"""
+Signal to noise ratio of every star of a large catalog, read and written a chunk at a time
+Bulge-field catalogs have tens of millions of rows (magnitude, temperature, position, ...), too many to load whole
+with pandas. Here the catalog is read a chunk of rows at a time (csv lines, or records of a .npy or FITS binary table
+read straight from the file), only the columns that are used are converted to float arrays, and each chunk goes
+through the vectorized chain of snr_sweep.py. The positions (and the other columns that are kept), the
+photoelectrons, the S/N, the limiting magnitude of the star (limiting_magnitude.py) and whether it is above it are
+appended to one .npy file per column (sweep_stream.ColumnarWriter), which open_columns memory maps. The memory used is
+set by the chunk size, not by the size of the catalog.
+
+Usage:
+    python -m cumlus.catalog_ingest bulge.fits catalog_output/bulge --diameter 185 --exposure 60 --snr 5
+    python -m cumlus.catalog_ingest stars.csv catalog_output/stars --column magnitude=Hmag --column temperature=Teff
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+from cumlus.limiting_magnitude import magnitude_for_photoelectrons, signal_for_signal_to_noise_ratio
+from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+from cumlus.sweep_stream import ColumnarWriter
+
+# Number of stars read and evaluated at once
+CATALOG_CHUNK_SIZE = 250000
+CATALOG_FORMATS = ('csv', 'npy', 'fits')
+# File extension: format (a directory is a catalog of .npy columns written by sweep_stream.ColumnarWriter)
+CATALOG_EXTENSIONS = {'.csv': 'csv', '.txt': 'csv', '.npy': 'npy', '.fits': 'fits', '.fit': 'fits', '.fts': 'fits'}
+# Column of the chain: default column of the catalog
+CATALOG_COLUMNS = {'magnitude': 'magnitude', 'temperature': 'temperature'}
+# Columns copied from the catalog to the output when they are there
+POSITION_COLUMNS = ('ra', 'dec')
+OUTPUT_COLUMNS = ('photoelectrons', 'snr', 'limiting_magnitude', 'detected')
+
+
+def catalog_format(filepath, given_format=None):
+    """
+    Format of a catalog: given_format if there is one, else from the extension
+    :param filepath: file, or directory of .npy columns
+    :param given_format: 'csv', 'npy', 'fits' or None
+    :return: format
+    """
+    if given_format is not None:
+        if given_format not in CATALOG_FORMATS:
+            raise ValueError(f'Unknown catalog format {given_format}. Use one of {", ".join(CATALOG_FORMATS)}.')
+        return given_format
+    if os.path.isdir(filepath):
+        return 'npy'
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in CATALOG_EXTENSIONS:
+        raise ValueError(f'Cannot tell the format of {filepath} from its extension, give one of '
+                         f'{", ".join(CATALOG_FORMATS)}.')
+    return CATALOG_EXTENSIONS[extension]
+
+
+def _select_columns(available, names):
+    missing = [name for name in names if name not in available]
+    if missing:
+        raise ValueError(f'The catalog has no column {", ".join(missing)}, its columns are {", ".join(available)}.')
+
+
+def read_csv_catalog_chunks(filepath, names, chunk_size=CATALOG_CHUNK_SIZE, delimiter=','):
+    """
+    Read columns of a csv catalog (header line first) a chunk of lines at a time
+    :param filepath:
+    :param names: names of the columns to read
+    :param chunk_size: number of rows per chunk
+    :param delimiter:
+    :return: generator of dictionaries column name: float array
+    """
+    with open(filepath) as file:
+        header = [name.strip() for name in file.readline().split(delimiter)]
+        _select_columns(header, names)
+        usecols = [header.index(name) for name in names]
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                return
+            values = np.loadtxt(lines, delimiter=delimiter, usecols=usecols, ndmin=2)
+            yield {name: values[:, position] for position, name in enumerate(names)}
+
+
+def read_record_chunks(filepath, offset, dtype, number_of_rows, chunk_size=CATALOG_CHUNK_SIZE):
+    """
+    Read a binary table of fixed size records a chunk of rows at a time (without a memory map, whose pages would stay
+    in the resident memory of the process as the catalog is read)
+    :param filepath:
+    :param offset: position of the first record in bytes
+    :param dtype: dtype of the records (with the byte order of the file)
+    :param number_of_rows:
+    :param chunk_size: number of rows per chunk
+    :return: generator of arrays of records
+    """
+    with open(filepath, 'rb') as file:
+        file.seek(offset)
+        for start in range(0, number_of_rows, chunk_size):
+            records = np.fromfile(file, dtype=dtype, count=min(chunk_size, number_of_rows - start))
+            if len(records) < min(chunk_size, number_of_rows - start):
+                raise ValueError(f'{filepath} ends after {start + len(records)} rows instead of {number_of_rows}.')
+            yield records
+
+
+def npy_layout(filepath):
+    """
+    :param filepath: .npy file
+    :return: position of the data in bytes, dtype, shape
+    """
+    with open(filepath, 'rb') as file:
+        version = np.lib.format.read_magic(file)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+            np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(file)
+        if fortran_order and len(shape) > 1:
+            raise ValueError(f'{filepath} is in Fortran order, save it in C order.')
+        return file.tell(), dtype, shape
+
+
+def read_npy_catalog_chunks(filepath, names, chunk_size=CATALOG_CHUNK_SIZE):
+    """
+    Read columns of a .npy catalog (structured array) or of a directory of .npy columns (e.g. written by
+    sweep_stream.ColumnarWriter) a chunk of rows at a time
+    :param filepath: .npy file or directory
+    :param names: names of the columns to read
+    :param chunk_size: number of rows per chunk
+    :return: generator of dictionaries column name: float array
+    """
+    if not os.path.isdir(filepath):
+        offset, dtype, shape = npy_layout(filepath)
+        if dtype.names is None:
+            raise ValueError(f'{filepath} is not a structured array: save the catalog with named fields, or as a '
+                             f'directory of one .npy file per column.')
+        _select_columns(dtype.names, names)
+        for records in read_record_chunks(filepath, offset, dtype, int(np.prod(shape)), chunk_size):
+            yield {name: records[name].astype(float) for name in names}
+        return
+    _select_columns(catalog_column_names(filepath), names)
+    readers = []
+    for name in names:
+        column_filepath = os.path.join(filepath, f'{name}.npy')
+        offset, dtype, shape = npy_layout(column_filepath)
+        readers.append(read_record_chunks(column_filepath, offset, dtype, int(np.prod(shape)), chunk_size))
+    for columns in zip(*readers):
+        yield {name: column.astype(float) for name, column in zip(names, columns)}
+
+
+def read_fits_catalog_chunks(filepath, names, chunk_size=CATALOG_CHUNK_SIZE, hdu=None):
+    """
+    Read columns of a FITS binary table a chunk of rows at a time. Needs astropy (for the header)
+    :param filepath:
+    :param names: names of the columns to read
+    :param chunk_size: number of rows per chunk
+    :param hdu: index or name of the table (default: the first table)
+    :return: generator of dictionaries column name: float array
+    """
+    from astropy.io import fits
+
+    with fits.open(filepath, memmap=True) as hdu_list:
+        if hdu is None:
+            tables = [extension for extension in hdu_list if isinstance(extension, fits.BinTableHDU)]
+            if not tables:
+                raise ValueError(f'{filepath} has no binary table.')
+            table = tables[0]
+        else:
+            table = hdu_list[hdu]
+        _select_columns(table.columns.names, names)
+        # FITS tables are big endian, and the data of the header is not read
+        dtype = table.columns.dtype.newbyteorder('>')
+        if dtype.itemsize != table.header['NAXIS1']:
+            raise ValueError(f'The rows of {filepath} have {table.header["NAXIS1"]} bytes, not the {dtype.itemsize} '
+                             f'bytes of their columns.')
+        offset, number_of_rows = table.fileinfo()['datLoc'], table.header['NAXIS2']
+        scales = {column.name: (column.bscale, column.bzero) for column in table.columns}
+    for records in read_record_chunks(filepath, offset, dtype, number_of_rows, chunk_size):
+        chunk = {name: records[name].astype(float) for name in names}
+        for name in names:
+            bscale, bzero = scales[name]
+            if bscale is not None:
+                chunk[name] *= bscale
+            if bzero is not None:
+                chunk[name] += bzero
+        yield chunk
+
+
+def read_catalog_chunks(filepath, names, chunk_size=CATALOG_CHUNK_SIZE, given_format=None):
+    """
+    :param filepath: csv, .npy (or directory of .npy columns) or FITS catalog
+    :param names: names of the columns to read
+    :param chunk_size: number of rows per chunk
+    :param given_format: see catalog_format
+    :return: generator of dictionaries column name: float array
+    """
+    readers = {'csv': read_csv_catalog_chunks, 'npy': read_npy_catalog_chunks, 'fits': read_fits_catalog_chunks}
+    return readers[catalog_format(filepath, given_format)](filepath, names, chunk_size)
+
+
+def catalog_column_names(filepath, given_format=None):
+    """
+    :param filepath: csv, .npy (or directory of .npy columns) or FITS catalog
+    :param given_format: see catalog_format
+    :return: names of the columns of the catalog
+    """
+    file_format = catalog_format(filepath, given_format)
+    if file_format == 'csv':
+        with open(filepath) as file:
+            return [name.strip() for name in file.readline().split(',')]
+    if file_format == 'npy':
+        if os.path.isdir(filepath):
+            return [os.path.splitext(name)[0] for name in sorted(os.listdir(filepath)) if name.endswith('.npy')]
+        return list(npy_layout(filepath)[1].names or ())
+    from astropy.io import fits
+    with fits.open(filepath, memmap=True) as hdu_list:
+        return next(list(extension.columns.names) for extension in hdu_list if isinstance(extension, fits.BinTableHDU))
+
+
+def evaluate_catalog_chunk(magnitude, temperature, diameter, lambda_interval_bottom, lambda_interval_top, exposure,
+                           limiting_snr=5.0, flux_sun=1361, quantum_efficiency=0.45, dark_current=0.05, read_out=0.3,
+                           diffuse_background=9.11, integration_method='series'):
+    """
+    Photoelectrons, S/N and limiting magnitude of a chunk of stars (same steps and units as
+    snr_sweep.signal_to_noise_ratio_sweep and limiting_magnitude.limiting_magnitude, with the band integrals done once)
+    :param magnitude: array
+    :param temperature: array in kelvin
+    :param limiting_snr: S/N of the limiting magnitude
+    :return: dictionary of arrays (OUTPUT_COLUMNS)
+    """
+    results = signal_to_noise_ratio_sweep(temperature, magnitude, diameter, lambda_interval_bottom,
+                                          lambda_interval_top, exposure, flux_sun, quantum_efficiency, dark_current,
+                                          read_out, diffuse_background, integration_method)
+    limiting_photoelectrons = signal_for_signal_to_noise_ratio(limiting_snr,
+                                                               dark_current + read_out + diffuse_background)
+    return {'photoelectrons': results['photoelectrons'],
+            'snr': results['snr'],
+            'limiting_magnitude': magnitude_for_photoelectrons(limiting_photoelectrons, results['E_range'], exposure,
+                                                               diameter),
+            'detected': results['snr'] >= limiting_snr}
+
+
+def ingest_catalog(filepath, directory, diameter=185, lambda_interval_bottom=1300, lambda_interval_top=1900,
+                   exposure=1.0, limiting_snr=5.0, columns=None, keep_columns=None, chunk_size=CATALOG_CHUNK_SIZE,
+                   given_format=None, progress=False, **detector):
+    """
+    S/N of every star of a catalog, streamed to .npy columns (see sweep_stream.open_columns)
+    :param filepath: csv, .npy (or directory of .npy columns) or FITS catalog
+    :param directory: where the columns are written
+    :param diameter: in mm
+    :param lambda_interval_bottom: in nm
+    :param lambda_interval_top: in nm
+    :param exposure: in seconds
+    :param limiting_snr: S/N of the limiting magnitude (detected is snr >= limiting_snr)
+    :param columns: dictionary 'magnitude'/'temperature': column of the catalog (default CATALOG_COLUMNS)
+    :param keep_columns: columns of the catalog copied to the output (default: those of POSITION_COLUMNS it has)
+    :param chunk_size: number of rows per chunk (it sets the memory used)
+    :param given_format: see catalog_format
+    :param progress: print the rows done and the rows/s after every chunk
+    :param detector: flux_sun, quantum_efficiency, dark_current, read_out, diffuse_background, integration_method
+                     (see snr_sweep.signal_to_noise_ratio_sweep)
+    :return: dictionary with the number of rows, the time in seconds and the rows/s
+    """
+    columns = dict(CATALOG_COLUMNS, **(columns or {}))
+    if keep_columns is None:
+        available = catalog_column_names(filepath, given_format)
+        keep_columns = [name for name in POSITION_COLUMNS if name in available]
+    names = list(dict.fromkeys(list(columns.values()) + list(keep_columns)))
+    parameters = dict(diameter=diameter, lambda_interval_bottom=lambda_interval_bottom,
+                      lambda_interval_top=lambda_interval_top, exposure=exposure, limiting_snr=limiting_snr,
+                      **detector)
+    metadata = {'catalog': os.path.abspath(filepath), 'catalog_columns': columns, 'parameters': parameters}
+    start_time = time.perf_counter()
+    with ColumnarWriter(directory, metadata) as writer:
+        for chunk in read_catalog_chunks(filepath, names, chunk_size, given_format):
+            results = evaluate_catalog_chunk(chunk[columns['magnitude']], chunk[columns['temperature']], **parameters)
+            writer.append(dict({name: chunk[name] for name in keep_columns},
+                               **{name: np.broadcast_to(results[name], len(chunk[columns['magnitude']]))
+                                  for name in OUTPUT_COLUMNS}))
+            if progress:
+                seconds = time.perf_counter() - start_time
+                print(f'{writer.number_of_rows} rows, {writer.number_of_rows / seconds:.0f} rows/s', file=sys.stderr)
+    seconds = time.perf_counter() - start_time
+    return {'rows': writer.number_of_rows, 'seconds': seconds,
+            'rows_per_second': writer.number_of_rows / seconds if seconds > 0 else float('inf')}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m cumlus.catalog_ingest', description=__doc__.split('\n')[1])
+    parser.add_argument('catalog', help='csv, .npy (or directory of .npy columns) or FITS catalog')
+    parser.add_argument('output', help='directory of the output columns')
+    parser.add_argument('--format', choices=CATALOG_FORMATS, help='format of the catalog (default: from extension)')
+    parser.add_argument('--column', action='append', default=[], metavar='NAME=CATALOG_COLUMN',
+                        help='catalog column of magnitude or temperature, e.g. --column magnitude=Hmag')
+    parser.add_argument('--keep', nargs='*', help=f'catalog columns copied to the output '
+                                                  f'(default: {", ".join(POSITION_COLUMNS)} if there)')
+    parser.add_argument('--diameter', type=float, default=185, help='telescope diameter in mm')
+    parser.add_argument('--lambda-interval-bottom', type=float, default=1300, help='in nm')
+    parser.add_argument('--lambda-interval-top', type=float, default=1900, help='in nm')
+    parser.add_argument('--exposure', type=float, default=1.0, help='in seconds')
+    parser.add_argument('--snr', type=float, default=5.0, help='S/N of the limiting magnitude')
+    parser.add_argument('--integration-method', choices=('series', 'table'), default='series')
+    parser.add_argument('--chunk-size', type=int, default=CATALOG_CHUNK_SIZE, help='rows per chunk')
+    arguments = parser.parse_args(arguments)
+
+    columns = {}
+    for column in arguments.column:
+        name, _, catalog_column = column.partition('=')
+        if name not in CATALOG_COLUMNS or not catalog_column:
+            parser.error(f'--column needs {" or ".join(CATALOG_COLUMNS)}=<catalog column>, not {column}')
+        columns[name] = catalog_column
+    try:
+        report = ingest_catalog(arguments.catalog, arguments.output, arguments.diameter,
+                                arguments.lambda_interval_bottom, arguments.lambda_interval_top, arguments.exposure,
+                                arguments.snr, columns, arguments.keep, arguments.chunk_size, arguments.format,
+                                progress=True, integration_method=arguments.integration_method)
+    except (OSError, ValueError) as error:
+        print(f'{parser.prog}: error: {error}', file=sys.stderr)
+        return 1
+    print(f'{report["rows"]} rows in {report["seconds"]:.2f} s ({report["rows_per_second"]:.0f} rows/s), '
+          f'columns in {arguments.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
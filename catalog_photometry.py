@@ -0,0 +1,213 @@
+"""
+Photoelectron rates of whole star fields, for many filters and detectors at once
+Instead of one call of total_number_of_incident_photon_per_second_per_area per star (one band, a fixed QE), the
+spectrum of every star (a black body, or one of a few tabulated templates) and the throughput of every filter x
+detector pair (filter transmission x QE curve of detector_registry.py) are put on one wavelength grid, and the photon
+counts of a chunk of stars in all the filters and detectors come out of one matrix product, as blackbody_photon_count
+of quantum_efficiency.py does for one band.
+The grid is made of Gauss-Legendre nodes between the edges of the filters, so the edges of the top-hat filters are
+integrated exactly. The counts give how the light of a star spreads over the filters and detectors; the magnitude
+sets its level as in the chain of GT_for_cumlus.py (snr_sweep.py): the rate in the reference band with the reference
+QE is the rate of that chain, and the others follow from the ratio of the counts.
+"""
+import numpy as np
+
+from cumlus.GT_for_cumlus import radiant_flux_calculator, total_number_of_incident_photon_per_second_per_area, \
+    photoelectrons_per_exposure_cauculator, planck_constant, speed_of_light, boltzmann_constant
+from cumlus.detector_registry import quantum_efficiency_curve
+from cumlus.quantum_efficiency import photon_count_response
+
+# Largest length of the intervals of the wavelength grid in nm, and Gauss-Legendre nodes per interval
+GRID_STEP = 25.0
+GRID_ORDER = 4
+# Number of stars per matrix product
+CATALOG_CHUNK_SIZE = 65536
+
+
+def wavelength_quadrature(edges, step=GRID_STEP, order=GRID_ORDER):
+    """
+    Gauss-Legendre nodes and weights between sorted edges (no interval longer than step), so that functions that
+    jump at the edges are integrated as well as smooth ones
+    :param edges: wavelengths in nm (e.g. the edges of all the filters)
+    :param step: largest interval in nm
+    :param order: nodes per interval
+    :return: wavelength, weights, in m
+    """
+    edges = np.unique(np.asarray(edges, dtype=float))
+    if len(edges) < 2:
+        raise ValueError(f'The wavelength grid needs at least two different edges, not {edges}.')
+    points = np.concatenate([np.linspace(bottom, top, int(np.ceil((top - bottom) / step)) + 1)[:-1]
+                             for bottom, top in zip(edges[:-1], edges[1:])] + [edges[-1:]])
+    nodes, node_weights = np.polynomial.legendre.leggauss(order)
+    half_widths = np.diff(points)[:, np.newaxis] / 2
+    wavelength = (points[:-1, np.newaxis] + half_widths * (nodes + 1)).ravel()
+    return wavelength * 1e-9, (half_widths * node_weights).ravel() * 1e-9
+
+
+def filter_edges(filters):
+    """
+    Wavelengths where the transmission of the filters can jump
+    :param filters: dictionary name: (bottom, top) in nm for a top-hat filter, or (wavelength in nm, transmission)
+    :return: array in nm
+    """
+    edges = []
+    for band in filters.values():
+        edges.extend([band[0], band[1]] if np.ndim(band[0]) == 0 else [np.min(band[0]), np.max(band[0])])
+    return np.array(edges, dtype=float)
+
+
+def filter_transmission(filters, wavelength):
+    """
+    Transmission of every filter on the grid
+    :param filters: dictionary name: (bottom, top) in nm for a top-hat filter, or (wavelength in nm, transmission)
+    :param wavelength: grid in m
+    :return: names, array (number of filters, number of wavelengths)
+    """
+    wavelength_nm = wavelength * 1e9
+    transmission = []
+    for band in filters.values():
+        if np.ndim(band[0]) == 0:
+            transmission.append(((wavelength_nm >= band[0]) & (wavelength_nm <= band[1])).astype(float))
+        else:
+            transmission.append(np.interp(wavelength_nm, band[0], band[1], left=0.0, right=0.0))
+    return list(filters), np.array(transmission)
+
+
+def detector_quantum_efficiency(detectors, wavelength):
+    """
+    QE of every detector on the grid
+    :param detectors: list of names of detector_registry.py, or dictionary name: QE (a number, a name of
+                      detector_registry.py, or (wavelength in nm, QE))
+    :param wavelength: grid in m
+    :return: names, array (number of detectors, number of wavelengths)
+    """
+    if not isinstance(detectors, dict):
+        detectors = {name: name for name in detectors}
+    quantum_efficiency = []
+    for curve in detectors.values():
+        if isinstance(curve, str):
+            curve = quantum_efficiency_curve(curve)
+        if np.ndim(curve) == 0:
+            quantum_efficiency.append(np.full(wavelength.shape, float(curve)))
+        else:
+            quantum_efficiency.append(np.interp(wavelength, np.asarray(curve[0]) * 1e-9, curve[1], left=0.0,
+                                                right=0.0))
+    return list(detectors), np.array(quantum_efficiency)
+
+
+class PhotometryEngine:
+    """
+    Response of a set of filters x detectors on a shared wavelength grid
+    """
+
+    def __init__(self, filters, detectors, reference_band=(1300, 1900), reference_quantum_efficiency=0.45,
+                 flux_sun=1361, integration_method='series', step=GRID_STEP):
+        """
+        :param filters: dictionary name: (bottom, top) in nm for a top-hat filter, or (wavelength in nm, transmission)
+        :param detectors: see detector_quantum_efficiency
+        :param reference_band: (bottom, top) in nm of the band that sets the level with the magnitude
+        :param reference_quantum_efficiency: QE of the reference band
+        :param flux_sun: in W/m^2
+        :param integration_method: 'series' or 'table' (radiant_flux_calculator of the reference band)
+        :param step: largest interval of the grid in nm
+        """
+        self.reference_band = tuple(reference_band)
+        self.reference_quantum_efficiency = reference_quantum_efficiency
+        self.flux_sun = flux_sun
+        self.integration_method = integration_method
+        self.wavelength, self.weights = wavelength_quadrature(np.append(filter_edges(filters), reference_band), step)
+        self.filters, transmission = filter_transmission(filters, self.wavelength)
+        self.detectors, quantum_efficiency = detector_quantum_efficiency(detectors, self.wavelength)
+        _, reference = filter_transmission({'reference': reference_band}, self.wavelength)
+        # every filter x detector pair, and the reference band last
+        pairs = transmission[:, np.newaxis, :] * quantum_efficiency
+        throughput = np.concatenate([pairs.reshape(-1, self.wavelength.size), reference * reference_quantum_efficiency])
+        self.response = photon_count_response(self.wavelength, self.weights, throughput)
+        # GT_for_cumlus.radiative_spectral_emittance is 2 pi h c^2 / wavelength^5 / (exp(exponent / T) - 1): the first
+        # factor only depends on the wavelength and goes in the response
+        self.planck_response = (2 * np.pi * planck_constant * speed_of_light ** 2 /
+                                self.wavelength ** 5)[:, np.newaxis] * self.response
+        self.planck_exponent = planck_constant * speed_of_light / (self.wavelength * boltzmann_constant)
+
+    def reference_rate(self, temperature, magnitude, diameter):
+        """
+        Photoelectrons/second in the reference band, with the chain (and units) of GT_for_cumlus.py
+        :param temperature: in kelvin
+        :param magnitude:
+        :param diameter: in mm
+        :return: array
+        """
+        bottom, top = self.reference_band
+        radiant_flux, _ = radiant_flux_calculator(flux_sun_=self.flux_sun, lambda_interval_bottom_=bottom,
+                                                  lambda_interval_top_=top, temperature_=temperature,
+                                                  method_=self.integration_method)
+        E_range, _ = total_number_of_incident_photon_per_second_per_area(
+            lambda_interval_bottom_=bottom * 1e-9, lambda_interval_top_=top * 1e-9, radiant_flux_=radiant_flux,
+            quantum_efficiency_=self.reference_quantum_efficiency)
+        return photoelectrons_per_exposure_cauculator(E_range, magnitude, 1.0, diameter)
+
+    def spectrum_counts(self, wavelength, spectra):
+        """
+        Photon counts of tabulated spectra (e.g. a few templates), to give to rates
+        :param wavelength: in nm
+        :param spectra: array (number of spectra, len(wavelength)) of energy per unit wavelength (e.g. W/m^2/m, the
+                        response turns energy into photons); the scale does not matter, the magnitude sets the level
+        :return: array (number of spectra, number of filters x detectors + 1)
+        """
+        on_grid = np.array([np.interp(self.wavelength, np.asarray(wavelength) * 1e-9, spectrum, left=0.0, right=0.0)
+                            for spectrum in np.atleast_2d(spectra)])
+        return on_grid @ self.response
+
+    def rates(self, temperature, magnitude, diameter=185, template_counts=None, template_index=None,
+              chunk_size=CATALOG_CHUNK_SIZE):
+        """
+        Photoelectrons/second of every star in every filter and detector
+        :param temperature: array of temperatures in kelvin (sets the level in the reference band, and the black body)
+        :param magnitude: array, broadcast with temperature
+        :param diameter: in mm, broadcast with temperature
+        :param template_counts: output of spectrum_counts, to use templates instead of black bodies
+        :param template_index: template of every star (broadcast with temperature)
+        :param chunk_size: number of stars per matrix product
+        :return: array (number of stars, number of filters, number of detectors)
+        """
+        temperature, magnitude, diameter = (array.ravel() for array in np.broadcast_arrays(
+            *(np.asarray(values, dtype=float) for values in (temperature, magnitude, diameter))))
+        if template_counts is not None:
+            # one template for every star, or one for all of them
+            template_index = np.broadcast_to(np.asarray(template_index, dtype=np.int64), temperature.shape)
+        rates = np.empty((temperature.size, len(self.filters), len(self.detectors)))
+        for start in range(0, temperature.size, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            if template_counts is None:
+                emittance = np.multiply.outer(1 / temperature[chunk], self.planck_exponent)
+                with np.errstate(over='ignore'):
+                    np.expm1(emittance, out=emittance)
+                counts = np.reciprocal(emittance, out=emittance) @ self.planck_response
+            else:
+                counts = template_counts[template_index[chunk]]
+            level = self.reference_rate(temperature[chunk], magnitude[chunk], diameter[chunk]) / counts[:, -1]
+            rates[chunk] = (counts[:, :-1] * level[:, np.newaxis]).reshape(-1, len(self.filters), len(self.detectors))
+        return rates
+
+
+if __name__ == '__main__':
+    import time
+
+    from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+
+    filters = {'J': (1100, 1400), 'H': (1300, 1900), 'Ks': (2000, 2300)}
+    engine = PhotometryEngine(filters, {'goldeye_g130': 'goldeye_g130', 'h2rg_184': 'h2rg_184', 'h2rg_211': 'h2rg_211',
+                                        'h2rg_212': 'h2rg_212', 'constant': 0.45})
+    print(f'{len(engine.filters)} filters x {len(engine.detectors)} detectors on {engine.wavelength.size} wavelengths')
+
+    # The reference band with the reference QE is the chain of snr_sweep.py
+    check = PhotometryEngine({'H': (1300, 1900)}, {'constant': 0.45})
+    print(f'M5 star, mag 18, 185 mm, H band: {check.rates(2800, 18.0)[0, 0, 0]:.6f} photoelectrons/s, snr_sweep: '
+          f'{signal_to_noise_ratio_sweep(2800, 18.0, 185, 1300, 1900, 1.0)["photoelectrons"]:.6f}')
+
+    rng = np.random.default_rng(0)
+    temperature = rng.uniform(2500, 10000, 1000000)
+    magnitude = rng.uniform(12, 22, 1000000)
+    start_time = time.perf_counter()
+    rates = engine.rates(temperature, magnitude)
+    print(f'{rates.shape} rates in {time.perf_counter() - start_time:.2f} s')
@@ -0,0 +1,295 @@
+"""
+Command line tool for the signal to noise chain, for batches of parameter sets
+Each parameter set is a row of a csv file, an object of a json or json lines file (or of the standard input). The rows
+are evaluated a chunk at a time with the vectorized functions (snr_sweep.py, limiting_magnitude.py, exposure_time.py,
+sensitivity_equations.py) and streamed to the standard output or to a file: the input columns as they were read, then
+the results. A parameter missing from the input can be given once on the command line for every row; without input,
+the command line gives one row.
+Only numpy and the module of the subcommand are imported, so a call starts in a fraction of a second: astropy is only
+loaded by relative-snr, and nothing loads bokeh or pandas.
+
+Usage:
+    python -m cumlus.cli snr --temperature 2800 --magnitude 18 --diameter 185 --lambda-interval-bottom 1300 \\
+        --lambda-interval-top 1900 --exposure 1
+    python -m cumlus.cli snr --input targets.csv --output snr.csv --integration-method table
+    cat targets.jsonl | python -m cumlus.cli limiting-magnitude --input - --snr 10 --output-format jsonl
+(python -m cumlus ... does the same)
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+# Number of rows evaluated at once
+DEFAULT_CHUNK_SIZE = 100000
+INPUT_FORMATS = ('csv', 'json', 'jsonl')
+OUTPUT_FORMATS = ('csv', 'jsonl')
+# File extension: format
+FORMAT_EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Parameters of the band and of the detector, as in snr_sweep.signal_to_noise_ratio_sweep
+BAND_COLUMNS = ('lambda_interval_bottom', 'lambda_interval_top')
+DETECTOR_COLUMNS = ('flux_sun', 'quantum_efficiency', 'dark_current', 'read_out', 'diffuse_background')
+# Columns that are not called like the keyword argument of the function
+ARGUMENT_NAMES = {'snr': 'signal_to_noise_ratio_'}
+
+
+def _signal_to_noise_ratio(**parameters):
+    from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+    return signal_to_noise_ratio_sweep(**parameters)
+
+
+def _limiting_magnitude(**parameters):
+    from cumlus.limiting_magnitude import limiting_magnitude
+    return {'limiting_magnitude': limiting_magnitude(**parameters)}
+
+
+def _exposure_time(**parameters):
+    from cumlus.exposure_time import exposure_time_calculator
+    results = exposure_time_calculator(**parameters)
+    # exposure is an input column of the other commands
+    results['exposure_per_coadd'] = results.pop('exposure')
+    return results
+
+
+def _relative_signal_to_noise_ratio(**parameters):
+    from cumlus.sensitivity_equations import PLAN_UNITS, compile_relative_signal_to_noise_ratio_plan, \
+        relative_signal_to_noise_ratio_from_plan
+    plan = compile_relative_signal_to_noise_ratio_plan(**{name: value * PLAN_UNITS[name]
+                                                          for name, value in parameters.items()})
+    snr_no_microlensing, snr_microlensing, relative_snr = relative_signal_to_noise_ratio_from_plan(plan)
+    return {'snr_no_microlensing': snr_no_microlensing.value, 'snr_microlensing': snr_microlensing.value,
+            'relative_snr': relative_snr.value}
+
+
+# subcommand: function, help, required and optional columns, output columns, and whether the function takes
+# integration_method
+COMMANDS = {
+    'snr': {'function': _signal_to_noise_ratio,
+            'help': 'signal to noise ratio (snr_sweep.signal_to_noise_ratio_sweep)',
+            'required': ('temperature', 'magnitude', 'diameter') + BAND_COLUMNS + ('exposure',),
+            'optional': DETECTOR_COLUMNS,
+            'outputs': ('radiant_flux', 'photoelectrons', 'snr'),
+            'integration_method': True},
+    'limiting-magnitude': {'function': _limiting_magnitude,
+                           'help': 'faintest magnitude with a signal to noise ratio of snr '
+                                   '(limiting_magnitude.limiting_magnitude)',
+                           'required': ('snr', 'temperature', 'diameter') + BAND_COLUMNS + ('exposure',),
+                           'optional': DETECTOR_COLUMNS,
+                           'outputs': ('limiting_magnitude',),
+                           'integration_method': True},
+    'exposure-time': {'function': _exposure_time,
+                      'help': 'exposure time to reach a signal to noise ratio of snr '
+                              '(exposure_time.exposure_time_calculator)',
+                      'required': ('snr', 'temperature', 'magnitude', 'diameter') + BAND_COLUMNS,
+                      'optional': ('number_of_coadds', 'flux_sun', 'quantum_efficiency', 'dark_current',
+                                   'diffuse_background', 'read_noise', 'reads_per_exposure'),
+                      'outputs': ('signal_rate', 'exposure_per_coadd', 'total_time'),
+                      'integration_method': True},
+    'relative-snr': {'function': _relative_signal_to_noise_ratio,
+                     'help': 'signal to noise ratio with and without microlensing '
+                             '(sensitivity_equations.relative_signal_to_noise_ratio_from_plan), in the units of '
+                             'sensitivity_equations.PLAN_UNITS (m, W, photoelectrons/s)',
+                     'required': ('wavelength_star_peak', 'luminosity_of_the_star', 'distance_from_observer',
+                                  'telescope_diameter', 'quantum_efficiency_value', 'etenue_value', 'dark_current',
+                                  'read_out', 'diffuse_background', 'magnification'),
+                     'optional': (),
+                     'outputs': ('snr_no_microlensing', 'snr_microlensing', 'relative_snr'),
+                     'integration_method': False},
+}
+
+
+def file_format(filepath, given_format, default):
+    """
+    Format of a file: given_format if there is one, else from the extension
+    :param filepath: path, or '-' for the standard input/output
+    :param given_format: e.g. 'csv', or None
+    :param default: format of the standard input/output and of unknown extensions
+    :return: format
+    """
+    if given_format is not None:
+        return given_format
+    return FORMAT_EXTENSIONS.get(os.path.splitext(filepath)[1].lower(), default)
+
+
+def read_chunks(file, input_format, chunk_size):
+    """
+    Read the rows of a csv, json (list of objects, or object of columns) or json lines file a chunk at a time
+    :param file: open text file
+    :param input_format: 'csv', 'json' or 'jsonl'
+    :param chunk_size: number of rows per chunk
+    :return: generator of (column names, list of rows)
+    """
+    if input_format == 'json':
+        content = json.load(file)
+        if isinstance(content, dict):
+            # a single value is the same for every row
+            header = list(content)
+            columns = [content[name] if isinstance(content[name], list) else [content[name]] for name in header]
+            size = max(map(len, columns), default=0)
+            rows = list(zip(*(column * size if len(column) == 1 else column for column in columns)))
+        else:
+            header = list(dict.fromkeys(name for row in content for name in row))
+            rows = [[row.get(name) for name in header] for row in content]
+        for start in range(0, len(rows), chunk_size):
+            yield header, rows[start:start + chunk_size]
+        return
+
+    if input_format == 'csv':
+        reader = csv.reader(file)
+        header = [name.strip() for name in next(reader, [])]
+        records = (row for row in reader if row)
+    else:
+        records = (json.loads(line) for line in file if line.strip())
+        first = next(records, None)
+        if first is None:
+            return
+        header = list(first)
+        records = ([record.get(name) for name in header] for record in itertools.chain([first], records))
+    rows = []
+    number_of_chunks = 0
+    for row in records:
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield header, rows
+            number_of_chunks += 1
+            rows = []
+    # a csv file with only a header gives an empty chunk, so the output still has its header
+    if rows or (number_of_chunks == 0 and header):
+        yield header, rows
+
+
+def evaluate_chunk(command, header, rows, constants, integration_method='series'):
+    """
+    Evaluate the rows of a chunk
+    :param command: name of a subcommand (key of COMMANDS)
+    :param header: column names of the rows
+    :param rows: list of rows (lists of values, numbers or strings)
+    :param constants: dictionary column: value for the parameters that are not in the rows (without rows, the row)
+    :param integration_method: 'series' or 'table' (see snr_sweep.signal_to_noise_ratio_sweep)
+    :return: output column names, columns (sequences)
+    """
+    spec = COMMANDS[command]
+    if not header:
+        # no input: the values of the command line are the row
+        header, rows = list(constants), [list(constants.values())]
+    clashes = [name for name in spec['outputs'] if name in header]
+    if clashes:
+        raise ValueError(f'The input has the column{"s" if len(clashes) > 1 else ""} {", ".join(clashes)}, that '
+                         f'{command} writes: rename or remove {"them" if len(clashes) > 1 else "it"}.')
+    columns = dict(zip(header, zip(*rows))) if rows else {name: () for name in header}
+    parameters = {}
+    for name in spec['required'] + spec['optional']:
+        if name in columns:
+            try:
+                parameters[ARGUMENT_NAMES.get(name, name)] = np.array(columns[name], dtype=float)
+            except (TypeError, ValueError) as error:
+                raise ValueError(f'The column {name} has values that are not numbers ({error}).') from error
+        elif name in constants:
+            parameters[ARGUMENT_NAMES.get(name, name)] = constants[name]
+        elif name in spec['required']:
+            raise ValueError(f'{command} needs a value of {name}: add a {name} column or --{name.replace("_", "-")}.')
+    if spec['integration_method']:
+        parameters['integration_method'] = integration_method
+    results = spec['function'](**parameters)
+    # the input values are written back as they were read
+    return header + list(spec['outputs']), [columns[name] for name in header] + \
+        [np.broadcast_to(results[name], len(rows)).tolist() for name in spec['outputs']]
+
+
+def write_chunk(file, output_format, names, columns, write_header):
+    """
+    Write a chunk of results
+    :param file: open text file
+    :param output_format: 'csv' or 'jsonl'
+    :param names: column names
+    :param columns: list of columns (sequences)
+    :param write_header: write the csv header (first chunk)
+    :return: None
+    """
+    if output_format == 'csv':
+        writer = csv.writer(file, lineterminator='\n')
+        if write_header:
+            writer.writerow(names)
+        writer.writerows(zip(*columns))
+    else:
+        file.writelines(json.dumps(dict(zip(names, row))) + '\n' for row in zip(*columns))
+
+
+def run_command(command, input_file, output_file, input_format, output_format, constants, chunk_size,
+                integration_method='series'):
+    """
+    Evaluate every row of input_file (or the single row of constants without input_file) and write the results
+    :param command: name of a subcommand (key of COMMANDS)
+    :param input_file: open text file, or None
+    :param output_file: open text file
+    :param input_format: 'csv', 'json' or 'jsonl'
+    :param output_format: 'csv' or 'jsonl'
+    :param constants: dictionary column: value for every row
+    :param chunk_size: number of rows evaluated at once
+    :param integration_method: 'series' or 'table'
+    :return: number of rows
+    """
+    chunks = read_chunks(input_file, input_format, chunk_size) if input_file is not None else [([], [])]
+    number_of_rows = 0
+    for header, rows in chunks:
+        names, columns = evaluate_chunk(command, header, rows, constants, integration_method)
+        write_chunk(output_file, output_format, names, columns, write_header=number_of_rows == 0)
+        number_of_rows += len(columns[0])
+    return number_of_rows
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m cumlus.cli', description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    command_parsers = {}
+    for command, spec in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=spec['help'], description=spec['help'])
+        command_parsers[command] = subparser
+        subparser.add_argument('--input', '-i', help='csv, json or json lines file of parameter sets (- for the '
+                                                     'standard input). Without it, the options give one row')
+        subparser.add_argument('--output', '-o', default='-', help='output file (default: the standard output)')
+        subparser.add_argument('--input-format', choices=INPUT_FORMATS,
+                               help='default: from the extension, csv for the standard input')
+        subparser.add_argument('--output-format', choices=OUTPUT_FORMATS,
+                               help='default: from the extension, csv for the standard output')
+        subparser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows evaluated at once')
+        if spec['integration_method']:
+            subparser.add_argument('--integration-method', choices=('series', 'table'), default='series',
+                                   help='band integrals from the series, or from the tables of band_flux_table.py')
+        parameters = subparser.add_argument_group('parameters', 'value for every row, when the column is not in the '
+                                                                'input')
+        for name in spec['required'] + spec['optional']:
+            parameters.add_argument(f'--{name.replace("_", "-")}', dest=name, type=float,
+                                    help='required' if name in spec['required'] else None)
+    arguments = parser.parse_args(arguments)
+
+    spec = COMMANDS[arguments.command]
+    constants = {name: getattr(arguments, name) for name in spec['required'] + spec['optional']
+                 if getattr(arguments, name) is not None}
+    input_file, output_file = None, None
+    try:
+        if arguments.input == '-':
+            input_file = sys.stdin
+        elif arguments.input is not None:
+            input_file = open(arguments.input, newline='')
+        output_file = sys.stdout if arguments.output == '-' else open(arguments.output, 'w', newline='')
+        run_command(arguments.command, input_file, output_file,
+                    file_format(arguments.input or '-', arguments.input_format, 'csv'),
+                    file_format(arguments.output, arguments.output_format, 'csv'), constants, arguments.chunk_size,
+                    getattr(arguments, 'integration_method', 'series'))
+    except (OSError, ValueError) as error:
+        # missing parameters, values that are not numbers, files that cannot be opened: a usage error (exit status 2)
+        command_parsers[arguments.command].error(str(error))
+    finally:
+        for file in (input_file, output_file):
+            if file not in (None, sys.stdin, sys.stdout):
+                file.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Registry of the detector quantum efficiency curves, built once and loaded by name
+get_quantum_efficiency_commercial_camera and get_quantum_efficiency_h2rg of reading_plots/QE_values.py read the
+digitized curves with pandas (relative to the working directory), clean them (cleaning_data) and resample them twice
+(super_smooth) every time they are called. Here the same steps are done with numpy, once per detector: the resampled
+curve (wavelength in nm, QE from 0 to 1) is saved in the cache directory as a .npy file keyed on the hash of the source
+csv and on the cleaning and smoothing parameters, so it is rebuilt only when one of those changes. Nothing is read
+when the module is imported, and the curves used in a process are kept in an LRU cache.
+"""
+import functools
+import os
+
+import numpy as np
+
+from cumlus.caching import cache_directory, file_hash, hash_key, save_array
+
+# Change this when the format or the method of the curves changes, so the old files are not used
+CURVE_VERSION = 1
+READING_PLOTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reading_plots')
+# Number of points of the two resamplings of super_smooth
+SMOOTH_POINTS = (100, 1000)
+# detector name: source csv (wavelength, quantum_efficiency columns) and the parameters of QE_values.py, in the units
+# of the csv. wavelength_unit and qe_unit convert them to nm and to 0-1
+DETECTORS = {
+    'goldeye_g130': {'source': os.path.join(READING_PLOTS_DIRECTORY, 'commercial_camera_QE.csv'),
+                     'qe_range': (1, 79), 'wavelength_range': (401, 1790), 'fill': (60, 0),
+                     'smooth_range': (400, 1800), 'wavelength_unit': 1.0, 'qe_unit': 0.01},
+    'h2rg_184': {'source': os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_red.csv'),
+                 'qe_range': (0.0, 1.1), 'wavelength_range': (0.84, 2.61), 'fill': (0.908, 0),
+                 'smooth_range': (0.846, 2.7), 'wavelength_unit': 1000.0, 'qe_unit': 1.0},
+    'h2rg_211': {'source': os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_blue.csv'),
+                 'qe_range': (0.0, 1.1), 'wavelength_range': (0.84, 2.67), 'fill': (0.901, 0),
+                 'smooth_range': (0.864, 2.7), 'wavelength_unit': 1000.0, 'qe_unit': 1.0},
+    'h2rg_212': {'source': os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_black.csv'),
+                 'qe_range': (0.0, 1.1), 'wavelength_range': (0.84, 2.72), 'fill': (0.920, 0),
+                 'smooth_range': (0.880, 2.7), 'wavelength_unit': 1000.0, 'qe_unit': 1.0},
+}
+
+
+def register_detector(name, source, qe_range, wavelength_range, fill, smooth_range, wavelength_unit=1.0,
+                      qe_unit=1.0):
+    """
+    Add a detector to the registry (or replace one)
+    :param name: detector name
+    :param source: csv with the columns wavelength, quantum_efficiency (e.g. digitized from a data sheet)
+    :param qe_range: (qe_initial, qe_final) of cleaning_data
+    :param wavelength_range: (wavelength_initial, wavelength_final) of cleaning_data
+    :param fill: (fill_initial, fill_final) of super_smooth
+    :param smooth_range: (wavelength_initial, wavelength_final) of super_smooth
+    :param wavelength_unit: nm per unit of wavelength of the csv
+    :param qe_unit: factor that takes the quantum efficiency of the csv to 0-1
+    :return: None
+    """
+    DETECTORS[name] = {'source': os.path.abspath(source), 'qe_range': tuple(qe_range),
+                       'wavelength_range': tuple(wavelength_range), 'fill': tuple(fill),
+                       'smooth_range': tuple(smooth_range), 'wavelength_unit': wavelength_unit, 'qe_unit': qe_unit}
+    quantum_efficiency_curve.cache_clear()
+
+
+def available_detectors():
+    """
+    :return: names of the registered detectors
+    """
+    return list(DETECTORS)
+
+
+def read_curve_csv(filepath):
+    """
+    Read a digitized curve
+    :param filepath: csv with a header line and the columns wavelength, quantum_efficiency
+    :return: wavelength, quantum_efficiency
+    """
+    with open(filepath) as file:
+        header = [column.strip() for column in file.readline().split(',')]
+    values = np.genfromtxt(filepath, delimiter=',', skip_header=1, ndmin=2)
+    return values[:, header.index('wavelength')], values[:, header.index('quantum_efficiency')]
+
+
+def clean_curve(wavelength, quantum_efficiency, qe_range, wavelength_range):
+    """
+    Same as cleaning_data of QE_values.py: drop the points read outside of the graph
+    :param wavelength:
+    :param quantum_efficiency:
+    :param qe_range: (qe_initial, qe_final), points with a QE outside are dropped
+    :param wavelength_range: (wavelength_initial, wavelength_final), points with a wavelength outside are dropped
+    :return: wavelength, quantum_efficiency
+    """
+    keep = (quantum_efficiency >= qe_range[0]) & (quantum_efficiency <= qe_range[1]) & \
+           (wavelength >= wavelength_range[0]) & (wavelength <= wavelength_range[1])
+    return wavelength[keep], quantum_efficiency[keep]
+
+
+def smooth_curve(wavelength, quantum_efficiency, fill, smooth_range):
+    """
+    Same as super_smooth of QE_values.py: linear interpolation on SMOOTH_POINTS[0] wavelengths, then on
+    SMOOTH_POINTS[1] wavelengths, with the fill values outside of the data
+    :param wavelength:
+    :param quantum_efficiency:
+    :param fill: (fill_initial, fill_final)
+    :param smooth_range: (wavelength_initial, wavelength_final) of the resampled curve
+    :return: wavelength, quantum_efficiency on SMOOTH_POINTS[1] points
+    """
+    order = np.argsort(wavelength, kind='stable')
+    smooth_wavelength = np.linspace(smooth_range[0], smooth_range[1], SMOOTH_POINTS[0])
+    smooth_qe = np.interp(smooth_wavelength, wavelength[order], quantum_efficiency[order], left=fill[0],
+                          right=fill[1])
+    wavelength_out = np.linspace(smooth_range[0], smooth_range[1], SMOOTH_POINTS[1])
+    return wavelength_out, np.interp(wavelength_out, smooth_wavelength, smooth_qe, left=fill[0], right=fill[1])
+
+
+def build_quantum_efficiency_curve(detector):
+    """
+    Clean and resample the curve of a detector from its source csv
+    :param detector: dictionary like the values of DETECTORS
+    :return: array (2, SMOOTH_POINTS[1]): wavelength in nm, quantum efficiency from 0 to 1
+    """
+    wavelength, quantum_efficiency = clean_curve(*read_curve_csv(detector['source']), detector['qe_range'],
+                                                 detector['wavelength_range'])
+    wavelength, quantum_efficiency = smooth_curve(wavelength, quantum_efficiency, detector['fill'],
+                                                  detector['smooth_range'])
+    return np.array([wavelength * detector['wavelength_unit'], quantum_efficiency * detector['qe_unit']])
+
+
+def curve_description(name, detector):
+    """
+    Everything a curve depends on, to build its key
+    """
+    return {'version': CURVE_VERSION, 'name': name, 'source_hash': file_hash(detector['source']),
+            'parameters': {key: value for key, value in detector.items() if key != 'source'},
+            'smooth_points': list(SMOOTH_POINTS)}
+
+
+@functools.lru_cache(maxsize=None)
+def quantum_efficiency_curve(name):
+    """
+    Curve of a detector, from the LRU cache, from the disk cache, or built (and saved) if it is not there yet
+    :param name: detector name (see available_detectors)
+    :return: wavelength in nm, quantum efficiency from 0 to 1 (read only arrays)
+    """
+    if name not in DETECTORS:
+        raise ValueError(f'Unknown detector {name}, the detectors are {", ".join(DETECTORS)}.')
+    filepath = os.path.join(cache_directory('detectors'), f'{hash_key(curve_description(name, DETECTORS[name]))}.npy')
+    if not os.path.exists(filepath):
+        save_array(filepath, build_quantum_efficiency_curve(DETECTORS[name]))
+    curve = np.load(filepath, mmap_mode='r')
+    return curve[0], curve[1]
+
+
+def quantum_efficiency_curves(names=None):
+    """
+    Curves of several detectors
+    :param names: detector names (default: all of them)
+    :return: dictionary detector name: (wavelength in nm, quantum efficiency), like
+             quantum_efficiency.load_quantum_efficiency_curves
+    """
+    return {name: quantum_efficiency_curve(name) for name in (available_detectors() if names is None else names)}
+
+
+if __name__ == '__main__':
+    import time
+
+    # Check against reading_plots/qe_values.csv (made by QE_values.py)
+    from cumlus.quantum_efficiency import QE_VALUES_FILEPATH, load_quantum_efficiency_curves
+
+    reference = load_quantum_efficiency_curves(QE_VALUES_FILEPATH)
+    for attempt in ('first call', 'cached'):
+        start_time = time.perf_counter()
+        curves = quantum_efficiency_curves()
+        print(f'{len(curves)} curves ({attempt}) in {1e3 * (time.perf_counter() - start_time):.2f} ms')
+    for name, (wavelength, quantum_efficiency) in curves.items():
+        print(f'{name}: {wavelength[0]:.0f}-{wavelength[-1]:.0f} nm, largest difference with qe_values.csv '
+              f'{np.max(np.abs(quantum_efficiency - reference[name][1])):.1e} (QE), '
+              f'{np.max(np.abs(wavelength - reference[name][0])):.1e} (nm)')
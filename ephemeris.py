@@ -0,0 +1,217 @@
+"""
+Heliocentric positions of the observers (Earth, Spitzer, ...) for whole arrays of epochs, without network calls
+getObserverPostion of notebooks/nasa-cumulus-nick.ipynb queries JPL Horizons once per observer and per epoch. Here the
+positions are fetched once for a range of dates on a uniform grid (astroquery, heliocentric vectors in the equatorial
+frame, as the RA/Dec of the notebook), saved in the cache directory, and interpolated with the cubic polynomials of
+band_flux_table.py. The interpolation error is estimated when the table is saved (from the table with every other
+point) and kept with it. Tables made elsewhere (e.g. exported from the Horizons web interface) can be saved with
+save_ephemeris_table and are then used the same way.
+Without a table, the Earth falls back to an analytic orbit (low precision formulae of the Astronomical Almanac for the
+Sun, brought to the J2000 frame, ~3e-4 au).
+Positions are in au, in the equatorial frame (x towards RA = 0, z towards the north pole), times are Julian dates.
+"""
+import functools
+import glob
+import json
+import os
+
+import numpy as np
+
+from cumlus.band_flux_table import cubic_lagrange_interpolate
+from cumlus.caching import cache_directory, hash_key, save_array, save_json
+
+# Change this when the format of the tables changes, so the old files are not used
+EPHEMERIS_VERSION = 1
+# Horizons identifiers of the Earth (geocentre)
+EARTH_OBSERVERS = ('399', 'earth')
+# Largest error of the analytic Earth orbit, in au (2.2e-4 against astropy between 1990 and 2040)
+ANALYTIC_EARTH_ERROR = 3e-4
+# General precession in longitude, in degrees per Julian century, and obliquity of the ecliptic at J2000, in degrees
+GENERAL_PRECESSION = 1.396971
+J2000_OBLIQUITY = 23.4392911
+
+
+class EphemerisTable:
+    """
+    Positions of one observer on a uniform grid of Julian dates
+    """
+
+    def __init__(self, observer, jd_start, jd_step, positions, max_error):
+        """
+        :param observer: Horizons identifier
+        :param jd_start: Julian date of the first row
+        :param jd_step: days between rows
+        :param positions: array (3, number_of_epochs) of x, y, z in au
+        :param max_error: estimate of the largest interpolation error in au
+        """
+        self.observer = observer
+        self.jd_start = jd_start
+        self.jd_step = jd_step
+        self.positions = positions
+        self.max_error = max_error
+        self.jd_stop = jd_start + jd_step * (positions.shape[1] - 1)
+
+    def covers(self, jd_min, jd_max):
+        """
+        :return: True if the table goes from jd_min to jd_max
+        """
+        return self.jd_start <= jd_min and jd_max <= self.jd_stop
+
+    def interpolate(self, jd):
+        """
+        Cubic interpolation of the positions
+        :param jd: array of Julian dates, inside the table
+        :return: array (jd.shape + (3,)) in au
+        """
+        jd = np.asarray(jd, dtype=float)
+        if jd.size and not self.covers(np.min(jd), np.max(jd)):
+            raise ValueError(f'The ephemeris of {self.observer} goes from JD {self.jd_start} to {self.jd_stop}, '
+                             f'the epochs go from JD {np.min(jd)} to {np.max(jd)}.')
+        return np.moveaxis(cubic_lagrange_interpolate(self.positions, (jd - self.jd_start) / self.jd_step), 0, -1)
+
+
+def interpolation_error(positions):
+    """
+    Estimate of the interpolation error of a table: the error of the table with every other row, on the rows left out,
+    divided by 2^4 (the error of a cubic goes like the step to the 4th power)
+    :param positions: array (3, number_of_epochs)
+    :return: error in the units of positions
+    """
+    if positions.shape[1] < 9:
+        raise ValueError(f'An ephemeris needs at least 9 epochs, not {positions.shape[1]}.')
+    coarse = EphemerisTable('', 0.0, 2.0, positions[:, ::2], 0.0)
+    odd = np.arange(1, positions.shape[1] - 1, 2)
+    return float(np.max(np.linalg.norm(coarse.interpolate(odd) - positions[:, odd].T, axis=-1)) / 16)
+
+
+def save_ephemeris_table(observer, jd, positions):
+    """
+    Save a table of positions in the cache, so observer_positions can use it
+    :param observer: Horizons identifier
+    :param jd: uniformly spaced Julian dates
+    :param positions: array (number_of_epochs, 3) of heliocentric equatorial x, y, z in au
+    :return: EphemerisTable
+    """
+    jd = np.asarray(jd, dtype=float)
+    positions = np.ascontiguousarray(np.asarray(positions, dtype=float).T)
+    steps = np.diff(jd)
+    if not np.allclose(steps, steps[0], rtol=1e-9, atol=1e-9):
+        raise ValueError('The epochs of an ephemeris have to be uniformly spaced.')
+    description = {'version': EPHEMERIS_VERSION, 'observer': str(observer), 'jd_start': float(jd[0]),
+                   'jd_step': float(steps[0]), 'number_of_epochs': len(jd)}
+    max_error = interpolation_error(positions)
+    filepath = os.path.join(cache_directory('ephemerides'), hash_key(description))
+    save_array(f'{filepath}.npy', positions)
+    save_json(f'{filepath}.json', dict(description, max_error=max_error))
+    find_ephemeris_table.cache_clear()
+    return EphemerisTable(str(observer), float(jd[0]), float(steps[0]), positions, max_error)
+
+
+def fetch_ephemeris(observer, jd_start, jd_stop, jd_step=1.0, id_type='majorbody'):
+    """
+    Query JPL Horizons (one query for the whole range) and save the table in the cache
+    :param observer: Horizons identifier, e.g. '399' (Earth) or 'spitzer'
+    :param jd_start: first Julian date
+    :param jd_stop: last Julian date
+    :param jd_step: days between epochs (rounded to the minute)
+    :param id_type: Horizons id_type, as in getObserverPostion
+    :return: EphemerisTable
+    """
+    try:
+        from astroquery.jplhorizons import Horizons
+    except ModuleNotFoundError as error:
+        raise ModuleNotFoundError(f'Fetching ephemerides requires the astroquery package (pip install astroquery), or '
+                                  f'save a table with save_ephemeris_table.') from error
+    from astropy.time import Time
+    start, stop = Time([jd_start, max(jd_stop, jd_start + 8 * jd_step)], format='jd', scale='tdb').iso
+    horizons = Horizons(id=observer, id_type=id_type, location='500@10',
+                        epochs={'start': start, 'stop': stop, 'step': f'{int(round(jd_step * 1440))}m'})
+    vectors = horizons.vectors(refplane='earth')
+    return save_ephemeris_table(observer, np.asarray(vectors['datetime_jd'], dtype=float),
+                                np.column_stack([np.asarray(vectors[axis], dtype=float) for axis in ('x', 'y', 'z')]))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_ephemeris_table(filepath):
+    with open(f'{filepath}.json') as file:
+        metadata = json.load(file)
+    return EphemerisTable(metadata['observer'], metadata['jd_start'], metadata['jd_step'],
+                          np.load(f'{filepath}.npy', mmap_mode='r'), metadata['max_error'])
+
+
+@functools.lru_cache(maxsize=256)
+def find_ephemeris_table(observer, jd_min, jd_max):
+    """
+    Most precise table of the cache that covers the epochs
+    :param observer: Horizons identifier
+    :param jd_min: first Julian date needed
+    :param jd_max: last Julian date needed
+    :return: EphemerisTable, or None
+    """
+    tables = []
+    for json_filepath in glob.glob(os.path.join(cache_directory('ephemerides'), '*.json')):
+        table = _load_ephemeris_table(json_filepath[:-len('.json')])
+        if table.observer == str(observer) and table.covers(jd_min, jd_max):
+            tables.append(table)
+    return min(tables, key=lambda table: table.max_error, default=None)
+
+
+def earth_position_analytic(jd):
+    """
+    Heliocentric position of the Earth from the low precision formulae for the Sun of the Astronomical Almanac
+    (good to ~0.01 degree between 1950 and 2050). The formulae give the longitude in the mean equinox of date: the
+    general precession since J2000 is taken out, and the J2000 obliquity is used, so the positions are in the frame of
+    the Horizons tables (ICRF, ~3e-4 au)
+    :param jd: array of Julian dates
+    :return: array (jd.shape + (3,)) in au, equatorial frame
+    """
+    days = np.asarray(jd, dtype=float) - 2451545.0
+    mean_longitude = np.radians(280.460 + 0.9856474 * days)
+    mean_anomaly = np.radians(357.528 + 0.9856003 * days)
+    ecliptic_longitude = mean_longitude + np.radians(1.915 * np.sin(mean_anomaly) + 0.020 * np.sin(2 * mean_anomaly)
+                                                     - GENERAL_PRECESSION * days / 36525)
+    distance = 1.00014 - 0.01671 * np.cos(mean_anomaly) - 0.00014 * np.cos(2 * mean_anomaly)
+    obliquity = np.radians(J2000_OBLIQUITY)
+    # the Earth is opposite to the Sun as seen from the Earth
+    return -distance[..., np.newaxis] * np.stack([np.cos(ecliptic_longitude),
+                                                  np.cos(obliquity) * np.sin(ecliptic_longitude),
+                                                  np.sin(obliquity) * np.sin(ecliptic_longitude)], axis=-1)
+
+
+def observer_positions(observer, jd, fetch=False, jd_step=1.0):
+    """
+    Heliocentric positions of an observer at many epochs: from a cached table, from the analytic orbit for the Earth,
+    or (with fetch) from a new Horizons query for the whole range
+    :param observer: Horizons identifier, e.g. '399' (Earth) or 'spitzer'
+    :param jd: array of Julian dates
+    :param fetch: if True, query Horizons when no table covers the epochs (one query, then cached)
+    :param jd_step: days between epochs of the fetched table
+    :return: array (jd.shape + (3,)) in au, estimate of the largest error in au
+    """
+    jd = np.asarray(jd, dtype=float)
+    jd_min, jd_max = float(np.min(jd)), float(np.max(jd))
+    table = find_ephemeris_table(str(observer), jd_min, jd_max)
+    if table is None and fetch:
+        table = fetch_ephemeris(observer, np.floor(jd_min) - 2 * jd_step, np.ceil(jd_max) + 2 * jd_step, jd_step)
+    if table is not None:
+        return table.interpolate(jd), table.max_error
+    if str(observer).lower() in EARTH_OBSERVERS:
+        return earth_position_analytic(jd), ANALYTIC_EARTH_ERROR
+    raise ValueError(f'No ephemeris of {observer} between JD {jd_min} and {jd_max} in '
+                     f'{cache_directory("ephemerides")}. Use fetch=True (astroquery) or save_ephemeris_table.')
+
+
+if __name__ == '__main__':
+    from astropy.time import Time
+
+    # Epoch of the notebook, and the following year every 6 hours
+    jd = Time('2021-04-11T00:00:00', scale='utc').jd + np.arange(0, 365, 0.25)
+    earth, error = observer_positions('399', jd)
+    print(f'Earth at JD {jd[0]}: {earth[0]} au (error ~{error} au), {jd.size} epochs')
+
+    # A table of the analytic orbit every day, to check the interpolation
+    table_jd = jd[0] - 10 + np.arange(400)
+    table_positions = earth_position_analytic(table_jd).T
+    table = EphemerisTable('399', table_jd[0], 1.0, table_positions, interpolation_error(table_positions))
+    print(f'Interpolation error estimate {table.max_error:.2e} au, '
+          f'actual {np.max(np.linalg.norm(table.interpolate(jd) - earth, axis=-1)):.2e} au')
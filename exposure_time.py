@@ -0,0 +1,109 @@
+"""
+Exposure time calculator, with the read noise per read and co-added exposures
+GT_for_cumlus.signal_to_noise_ratio takes every noise term as a rate (the read noise of 18 electrons every 60 seconds
+becomes 0.3 electrons/second), so it only describes a single exposure of a fixed length. Here the dark current and the
+background are rates (electrons/second), and the read noise is electrons rms per read. N co-added exposures of length t,
+with R reads each, give
+    S/N = N s t / sqrt(N ((s + d + b) t + R r^2))
+which is a quadratic in t, so the exposure time for a target S/N is closed form and broadcasts over arrays of targets.
+"""
+import numpy as np
+
+from cumlus.GT_for_cumlus import radiant_flux_calculator, total_number_of_incident_photon_per_second_per_area, \
+    photoelectrons_per_exposure_cauculator
+
+
+def coadded_signal_to_noise_ratio(signal_rate, exposure, number_of_coadds=1, dark_current=0.05,
+                                  diffuse_background=9.11, read_noise=18, reads_per_exposure=1):
+    """
+    Signal to noise ratio of number_of_coadds exposures added together
+    :param signal_rate: photoelectrons/second from the star
+    :param exposure: length of each exposure in seconds
+    :param number_of_coadds: number of exposures added together
+    :param dark_current: electrons/second
+    :param diffuse_background: photons/second
+    :param read_noise: electrons rms per read
+    :param reads_per_exposure: number of reads of each exposure (e.g. 2 for correlated double sampling)
+    :return: signal to noise ratio
+    """
+    signal = number_of_coadds * signal_rate * exposure
+    variance = number_of_coadds * ((signal_rate + dark_current + diffuse_background) * exposure +
+                                   reads_per_exposure * np.square(read_noise))
+    return signal / np.sqrt(variance)
+
+
+def exposure_time_for_signal_to_noise_ratio(signal_to_noise_ratio_, signal_rate, number_of_coadds=1, dark_current=0.05,
+                                            diffuse_background=9.11, read_noise=18, reads_per_exposure=1):
+    """
+    Inverse of coadded_signal_to_noise_ratio: the length of each exposure to reach signal_to_noise_ratio_.
+    The positive root of N s^2 t^2 - X^2 (s + d + b) t - X^2 R r^2 = 0
+    :param signal_to_noise_ratio_: target signal to noise ratio
+    :param signal_rate: photoelectrons/second from the star
+    :param number_of_coadds: number of exposures added together
+    :param dark_current: electrons/second
+    :param diffuse_background: photons/second
+    :param read_noise: electrons rms per read
+    :param reads_per_exposure: number of reads of each exposure
+    :return: length of each exposure in seconds (the total time is number_of_coadds times this)
+    """
+    snr_squared = np.square(signal_to_noise_ratio_)
+    rate = signal_rate + dark_current + diffuse_background
+    read_variance = reads_per_exposure * np.square(read_noise)
+    quadratic = number_of_coadds * np.square(signal_rate)
+    return (snr_squared * rate + np.sqrt(np.square(snr_squared * rate) + 4 * quadratic * snr_squared * read_variance)) \
+        / (2 * quadratic)
+
+
+def exposure_time_calculator(signal_to_noise_ratio_, temperature, magnitude, diameter, lambda_interval_bottom,
+                             lambda_interval_top, number_of_coadds=1, flux_sun=1361, quantum_efficiency=0.45,
+                             dark_current=0.05, diffuse_background=9.11, read_noise=18, reads_per_exposure=1,
+                             integration_method='series'):
+    """
+    Exposure time to reach a target signal to noise ratio, for arrays of targets. The inputs can be anything that numpy
+    broadcasts together. The signal follows the same steps (and units) as snr_sweep.signal_to_noise_ratio_sweep.
+    :param signal_to_noise_ratio_: target signal to noise ratio
+    :param temperature: in kelvin
+    :param magnitude:
+    :param diameter: in mm
+    :param lambda_interval_bottom: in nm
+    :param lambda_interval_top: in nm
+    :param number_of_coadds: number of exposures added together
+    :param flux_sun: in W/m^2
+    :param quantum_efficiency:
+    :param dark_current: electrons/second
+    :param diffuse_background: photons/second
+    :param read_noise: electrons rms per read
+    :param reads_per_exposure: number of reads of each exposure
+    :param integration_method: 'series', or 'table' to use the precomputed tables of band_flux_table.py
+    :return: dictionary with the signal rate, the length of each exposure and the total time
+    """
+    radiant_flux, _ = radiant_flux_calculator(flux_sun_=flux_sun, lambda_interval_bottom_=lambda_interval_bottom,
+                                              lambda_interval_top_=lambda_interval_top, temperature_=temperature,
+                                              method_=integration_method)
+    E_range, _ = total_number_of_incident_photon_per_second_per_area(
+        lambda_interval_bottom_=np.asarray(lambda_interval_bottom) * 1e-9,
+        lambda_interval_top_=np.asarray(lambda_interval_top) * 1e-9,
+        radiant_flux_=radiant_flux, quantum_efficiency_=quantum_efficiency)
+    signal_rate = photoelectrons_per_exposure_cauculator(E_range, magnitude, 1.0, diameter)
+    exposure = exposure_time_for_signal_to_noise_ratio(signal_to_noise_ratio_, signal_rate, number_of_coadds,
+                                                       dark_current, diffuse_background, read_noise,
+                                                       reads_per_exposure)
+    return {'signal_rate': signal_rate,
+            'exposure': exposure,
+            'total_time': number_of_coadds * exposure}
+
+
+if __name__ == '__main__':
+    # Same assumptions as GT_for_cumlus.py (M5 star, 185 mm, H band), read noise of 18 electrons per read
+    for coadds in [1, 4, 16]:
+        times = exposure_time_calculator(10.0, 2800, 18.0, 185, 1300, 1900, number_of_coadds=coadds)
+        print(f'S/N = 10 with {coadds:2d} co-adds: {times["exposure"]:.2f} s per exposure, '
+              f'{times["total_time"]:.2f} s in total')
+
+    # Thousands of targets at once
+    rng = np.random.default_rng(0)
+    temperature = rng.uniform(2500, 6000, 100000)
+    magnitude = rng.uniform(14, 20, 100000)
+    times = exposure_time_calculator(10.0, temperature, magnitude, 185, 1300, 1900, number_of_coadds=4)
+    snr = coadded_signal_to_noise_ratio(times['signal_rate'], times['exposure'], number_of_coadds=4)
+    print(f'{temperature.size} targets, S/N at the computed exposure between {snr.min():.12f} and {snr.max():.12f}')
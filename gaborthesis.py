@@ -1,6 +1,8 @@
 import numpy as np
 from scipy.integrate import quad
 
+from cumlus.blackbody_band import bose_einstein_band_integral
+
 # Constants
 planck_constant = 6.62607004e-34  # m^2 kg/s
 speed_of_light = 299792458  # m/s
@@ -25,16 +27,27 @@ def radiative_spectral_emittance(wavelength_, temperature_):
     return I_star
 
 
-def radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_):
+def radiant_flux_perratioflux_integral(lambda_interval_bottom_, lambda_interval_top_, temperature_, method_='series'):
     """
     Equation 2.7 from Gabor thesis
     :param lambda_interval_bottom_: integral limit
     :param lambda_interval_top_: integral limit
     :param temperature_:
+    :param method_: 'series' (blackbody_band.py) or 'quad'
     :return:
     """
-    F_star_fluxratio = quad(radiative_spectral_emittance, lambda_interval_bottom_, lambda_interval_top_,
-                            args=temperature_)
+    if method_ == 'series':
+        wavelength_scale = planck_constant * speed_of_light / (boltzmann_constant * np.asarray(temperature_))
+        integral, integral_error = bose_einstein_band_integral(wavelength_scale / np.asarray(lambda_interval_top_),
+                                                               wavelength_scale / np.asarray(lambda_interval_bottom_),
+                                                               order=3)
+        scale = 2 * np.pi * planck_constant * speed_of_light ** 2 / wavelength_scale ** 4
+        F_star_fluxratio = integral * scale, integral_error * scale
+    elif method_ == 'quad':
+        F_star_fluxratio = quad(radiative_spectral_emittance, lambda_interval_bottom_, lambda_interval_top_,
+                                args=temperature_)
+    else:
+        raise ValueError(f'Unknown integration method {method_}. Use "series" or "quad".')
     return F_star_fluxratio
 
 
@@ -92,17 +105,27 @@ def sensor_photon_irradiance(wavelength_, radiant_flux_, quantum_efficiency_):
 
 
 def total_number_of_incident_photon_per_second_per_area(lambda_interval_bottom_, lambda_interval_top_,
-                                                        radiant_flux_, quantum_efficiency_):
+                                                        radiant_flux_, quantum_efficiency_, method_='closed_form'):
     """
     The total number of incident photons/[s*mm^2] that the image sensor is able to detect from the emittance of a star
     :param lambda_interval_bottom_:
     :param lambda_interval_top_:
     :param radiant_flux_:
     :param quantum_efficiency_:
+    :param method_: 'closed_form' or 'quad'
     :return:
     """
-    E_range = quad(sensor_photon_irradiance, lambda_interval_bottom_, lambda_interval_top_,
-                   args=(radiant_flux_, quantum_efficiency_))
+    if method_ == 'closed_form':
+        # the integrand is linear in the wavelength
+        E_range_value = (np.asarray(radiant_flux_) * quantum_efficiency_ *
+                         (np.asarray(lambda_interval_top_) ** 2 - np.asarray(lambda_interval_bottom_) ** 2) /
+                         (2 * planck_constant * speed_of_light))
+        E_range = E_range_value, np.finfo(float).eps * np.abs(E_range_value)
+    elif method_ == 'quad':
+        E_range = quad(sensor_photon_irradiance, lambda_interval_bottom_, lambda_interval_top_,
+                       args=(radiant_flux_, quantum_efficiency_))
+    else:
+        raise ValueError(f'Unknown integration method {method_}. Use "closed_form" or "quad".')
     return E_range
 
 
@@ -0,0 +1,241 @@
+"""
+Opt-in instrumentation of the pipeline stages (sensitivity_equations.py, GT_for_cumlus.py, ...)
+For every stage it records the number of calls, the wall time, the size of the arrays it returns and, if asked, the
+memory it allocates (with tracemalloc). For the integrals it also records the number of function evaluations of quad
+and the error estimates. The results can be printed, saved as a json summary, or saved as a trace file that can be
+opened in chrome://tracing or https://ui.perfetto.dev
+When it is disabled (the default) an instrumented function only checks a flag before calling the original function
+(a fraction of a microsecond per call, nothing next to the array operations or a quad).
+
+Usage:
+    enable_instrumentation(trace=True)
+    ... run the sweep ...
+    print_instrumentation_summary()
+    write_trace('trace.json')
+"""
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+
+class _InstrumentationState:
+    """
+    Everything recorded since the last reset
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self.allocations = False
+        self.stages = {}
+        self.events = []
+        self.origin = time.perf_counter()
+        # largest memory traced since the innermost stage started (the peaks of the stages inside it included, their
+        # reset_peak discards them from tracemalloc)
+        self.carried_peak = 0
+        # tracemalloc was started by enable_instrumentation, and is stopped by disable_instrumentation
+        self.started_tracemalloc = False
+
+
+_state = _InstrumentationState()
+
+
+def enable_instrumentation(trace=False, allocations=False):
+    """
+    Start recording
+    :param trace: also keep every call, to write a trace file
+    :param allocations: also record the memory allocated by every stage (slower, it uses tracemalloc)
+    :return: None
+    """
+    _state.enabled = True
+    _state.trace = trace
+    _state.allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state.started_tracemalloc = True
+
+
+def disable_instrumentation():
+    """
+    Stop recording (what was recorded is kept until reset_instrumentation)
+    :return: None
+    """
+    _state.enabled = False
+    if _state.started_tracemalloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.started_tracemalloc = False
+    _state.allocations = False
+
+
+def reset_instrumentation():
+    """
+    Forget everything recorded so far
+    :return: None
+    """
+    _state.stages = {}
+    _state.events = []
+    _state.origin = time.perf_counter()
+
+
+def _stage_record(name):
+    if name not in _state.stages:
+        _state.stages[name] = {'calls': 0, 'wall_time': 0.0, 'elements': 0,
+                               'allocated_bytes': 0, 'peak_bytes': 0,
+                               'integrals': 0, 'quad_evaluations': 0, 'max_error': 0.0}
+    return _state.stages[name]
+
+
+def _result_size(result):
+    if isinstance(result, tuple):
+        result = result[0] if result else None
+    return int(np.size(result)) if result is not None else 0
+
+
+@contextlib.contextmanager
+def instrumented_block(name, size=0):
+    """
+    Record a block of code as a stage
+    :param name: name of the stage
+    :param size: number of elements the block works on
+    """
+    if not _state.enabled:
+        yield
+        return
+    if _state.allocations:
+        memory_before, peak_before = tracemalloc.get_traced_memory()
+        enclosing_peak = max(_state.carried_peak, peak_before)
+        tracemalloc.reset_peak()
+        _state.carried_peak = 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record = _stage_record(name)
+        record['calls'] += 1
+        record['wall_time'] += elapsed
+        record['elements'] += int(size)
+        if _state.allocations:
+            memory_after, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, _state.carried_peak)
+            record['allocated_bytes'] += max(memory_after - memory_before, 0)
+            record['peak_bytes'] = max(record['peak_bytes'], peak - memory_before)
+            # the enclosing stage sees the peaks of this one
+            _state.carried_peak = max(enclosing_peak, peak)
+        if _state.trace:
+            _state.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                  'ts': (start - _state.origin) * 1e6, 'dur': elapsed * 1e6,
+                                  'args': {'elements': int(size)}})
+
+
+def _stage_name(function):
+    return f'{function.__module__.split(".")[-1]}.{function.__name__}'
+
+
+def instrumented(function):
+    """
+    Decorator to record a function as a stage (named module.function). The size is the size of its output
+    """
+    name = _stage_name(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return function(*args, **kwargs)
+        with instrumented_block(name):
+            result = function(*args, **kwargs)
+        _state.stages[name]['elements'] += _result_size(result)
+        if _state.trace:
+            _state.events[-1]['args']['elements'] = _result_size(result)
+        return result
+    return wrapper
+
+
+def instrumented_integral(function):
+    """
+    Same as instrumented, for functions that return (integral, error) like quad. It also records the number of
+    integrals and the largest error estimate
+    """
+    name = _stage_name(function)
+    instrumented_function = instrumented(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return function(*args, **kwargs)
+        result = instrumented_function(*args, **kwargs)
+        record = _state.stages[name]
+        record['integrals'] += _result_size(result)
+        record['max_error'] = max(record['max_error'], float(np.max(result[1], initial=0.0)))
+        return result
+    return wrapper
+
+
+def counted_quad(stage, function, lambda_interval_bottom, lambda_interval_top, args=()):
+    """
+    scipy.integrate.quad, recording the number of evaluations of function and the error estimate under stage
+    :param stage: name of the stage
+    :param function: integrand
+    :param lambda_interval_bottom: integral limit
+    :param lambda_interval_top: integral limit
+    :param args: extra arguments of function
+    :return: integral, error (as quad)
+    """
+    # imported here, so the modules that only use the stages do not load scipy
+    from scipy.integrate import quad
+    if not _state.enabled:
+        return quad(function, lambda_interval_bottom, lambda_interval_top, args=args)
+    integral, integral_error, information = quad(function, lambda_interval_bottom, lambda_interval_top, args=args,
+                                                 full_output=1)[:3]
+    record = _stage_record(stage)
+    record['quad_evaluations'] += information['neval']
+    return integral, integral_error
+
+
+def instrumentation_summary():
+    """
+    :return: dictionary stage name: counters, with the mean time per call and per element
+    """
+    summary = {}
+    for name, record in _state.stages.items():
+        summary[name] = dict(record,
+                             mean_time_per_call=record['wall_time'] / max(record['calls'], 1),
+                             time_per_element=record['wall_time'] / max(record['elements'], 1))
+    return summary
+
+
+def print_instrumentation_summary():
+    """
+    Print the stages, slowest first
+    :return: None
+    """
+    summary = instrumentation_summary()
+    print(f'{"stage":70s} {"calls":>8s} {"time [s]":>10s} {"elements":>12s} {"alloc [MB]":>10s} '
+          f'{"quad evals":>10s} {"max error":>10s}')
+    for name, record in sorted(summary.items(), key=lambda item: -item[1]['wall_time']):
+        print(f'{name:70s} {record["calls"]:8d} {record["wall_time"]:10.4f} {record["elements"]:12d} '
+              f'{record["allocated_bytes"] / 1e6:10.2f} {record["quad_evaluations"]:10d} {record["max_error"]:10.3g}')
+
+
+def write_instrumentation_summary(filepath):
+    """
+    Save the summary as json
+    :param filepath:
+    :return: None
+    """
+    with open(filepath, 'w') as file:
+        json.dump(instrumentation_summary(), file, indent=1)
+
+
+def write_trace(filepath):
+    """
+    Save the calls recorded with enable_instrumentation(trace=True) in the trace event format
+    :param filepath:
+    :return: None
+    """
+    with open(filepath, 'w') as file:
+        json.dump({'traceEvents': _state.events, 'displayTimeUnit': 'ms'}, file)
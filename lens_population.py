@@ -0,0 +1,196 @@
+"""
+Monte Carlo population of microlensing events and their detection yield
+lensingsystem() of notebooks/nasa-cumulus-nick.ipynb builds one lens system (Ds = 8 kpc, Dl = 6 kpc, Ml = 0.3 Msun,
+vperp = 200 km/s) with astropy quantities. Here millions of systems are drawn as plain float arrays, chunk by chunk:
+    Re = sqrt(4 G Ml / c^2 Ds x (1 - x)),   tE = Re / vperp,   piE = (1 - x) / Re,   with x = Dl / Ds
+(same definitions as the notebook, piE in 1/m). Every system also gets an impact parameter and a source magnitude, and
+the magnitude at the peak goes through the signal to noise chain of snr_sweep.py: the event is detected if the S/N at
+the peak is above a threshold and tE is in the range the survey can see.
+Every chunk has its own random generator, spawned from one SeedSequence, so the result only depends on the seed and the
+chunk size (not on the number of processes). The chunks only return sums and histograms, which are added together in
+chunk order, so the memory does not grow with the number of systems.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy import constants as const
+from astropy import units as u
+
+from cumlus.point_lens import pspl_magnification
+from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+
+GRAVITATIONAL_CONSTANT = const.G.si.value
+SPEED_OF_LIGHT = const.c.si.value
+SOLAR_MASS = const.M_sun.si.value
+PARSEC = u.parsec.to(u.m)
+ASTRONOMICAL_UNIT = const.au.si.value
+DAY = u.day.to(u.s)
+
+# Galactic model. The lenses are uniformly distributed along the line of sight, so every system is weighted by its
+# event rate (proportional to Re vperp)
+DEFAULT_POPULATION = {'source_distance_mean': 8000.0,  # parsecs (bulge)
+                      'source_distance_sigma': 800.0,  # parsecs
+                      'mass_breaks': [0.08, 0.5, 1.5],  # solar masses (Kroupa 2001 above the hydrogen burning limit)
+                      'mass_slopes': [-1.3, -2.3],  # dN/dM proportional to M^slope between the breaks
+                      'velocity_sigma': 100.0,  # km/s, per component of the relative velocity
+                      'maximum_impact_parameter': 1.0,  # Einstein radii
+                      'source_magnitude_range': [14.0, 22.0]}
+
+# Survey: the S/N chain of snr_sweep.py (same assumptions as GT_for_cumlus.py) and the time scales it can see
+DEFAULT_SURVEY = {'temperature': 2800,  # K
+                  'diameter': 185,  # mm
+                  'lambda_interval_bottom': 1300,  # nm
+                  'lambda_interval_top': 1900,  # nm
+                  'exposure': 60.0,  # seconds
+                  'signal_to_noise_ratio_threshold': 10.0,
+                  'minimum_time_scale': 0.5,  # days
+                  'maximum_time_scale': 300.0}  # days
+
+# Bins of the histograms of tE, in days
+TIME_SCALE_BINS = np.logspace(-1, 3, 41)
+
+
+def lens_system(Ds, Dl, Ml, vperp):
+    """
+    Vectorized lensingsystem() of notebooks/nasa-cumulus-nick.ipynb
+    :param Ds: distance to the source in parsecs
+    :param Dl: distance to the lens in parsecs
+    :param Ml: mass of the lens in solar masses
+    :param vperp: relative source-lens velocity in km/s
+    :return: dictionary with x = Dl/Ds, Re in m, tE in days and piE in 1/m (multiply by ASTRONOMICAL_UNIT for the usual
+             dimensionless parallax)
+    """
+    x = np.asarray(Dl, dtype=float) / np.asarray(Ds, dtype=float)
+    Re = np.sqrt(4 * GRAVITATIONAL_CONSTANT * np.asarray(Ml, dtype=float) * SOLAR_MASS / SPEED_OF_LIGHT ** 2 *
+                 np.asarray(Ds, dtype=float) * PARSEC * x * (1 - x))
+    tE = Re / (np.asarray(vperp, dtype=float) * 1e3) / DAY
+    piE = (1 - x) / Re
+    return {'x': x, 'Re': Re, 'tE': tE, 'piE': piE}
+
+
+def broken_power_law(rng, size, breaks, slopes):
+    """
+    Draw from dN/dM proportional to M^slope between consecutive breaks (continuous at the breaks), by inverting the
+    cumulative distribution
+    :param rng: np.random.Generator
+    :param size: number of values
+    :param breaks: increasing limits of the segments (one more than slopes)
+    :param slopes: power law index of every segment
+    :return: array of values
+    """
+    breaks = np.asarray(breaks, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    # normalisation of every segment so the density is continuous at the breaks
+    normalisation = np.ones(len(slopes))
+    for segment in range(1, len(slopes)):
+        normalisation[segment] = normalisation[segment - 1] * breaks[segment] ** (slopes[segment - 1] - slopes[segment])
+    exponent = slopes + 1
+    low, high = breaks[:-1] ** exponent, breaks[1:] ** exponent
+    weight = normalisation * (high - low) / exponent
+    segment = rng.choice(len(slopes), size=size, p=weight / weight.sum())
+    uniform = rng.random(size)
+    return (low[segment] + uniform * (high[segment] - low[segment])) ** (1 / exponent[segment])
+
+
+def sample_lens_systems(rng, size, population=None):
+    """
+    Draw lens systems and events from the Galactic model
+    :param rng: np.random.Generator
+    :param size: number of systems
+    :param population: dictionary like DEFAULT_POPULATION (missing entries take the default values)
+    :return: dictionary with Ds, Dl (parsecs), Ml (solar masses), vperp (km/s), u0 and the source magnitude
+    """
+    population = {**DEFAULT_POPULATION, **(population or {})}
+    Ds = np.abs(rng.normal(population['source_distance_mean'], population['source_distance_sigma'], size))
+    Dl = Ds * rng.random(size)
+    Ml = broken_power_law(rng, size, population['mass_breaks'], population['mass_slopes'])
+    vperp = population['velocity_sigma'] * np.hypot(rng.standard_normal(size), rng.standard_normal(size))
+    u0 = population['maximum_impact_parameter'] * rng.random(size)
+    magnitude = rng.uniform(*population['source_magnitude_range'], size)
+    return {'Ds': Ds, 'Dl': Dl, 'Ml': Ml, 'vperp': vperp, 'u0': u0, 'magnitude': magnitude}
+
+
+def chunk_yield(seed_sequence, size, population=None, survey=None):
+    """
+    Draw one chunk of lens systems and reduce it to sums and histograms
+    :param seed_sequence: np.random.SeedSequence of the chunk
+    :param size: number of systems
+    :param population: dictionary like DEFAULT_POPULATION
+    :param survey: dictionary like DEFAULT_SURVEY
+    :return: dictionary of sums and histograms (all additive)
+    """
+    survey = {**DEFAULT_SURVEY, **(survey or {})}
+    systems = sample_lens_systems(np.random.default_rng(seed_sequence), size, population)
+    lens = lens_system(systems['Ds'], systems['Dl'], systems['Ml'], systems['vperp'])
+    rate = lens['Re'] * systems['vperp']
+    peak_magnitude = systems['magnitude'] - 2.5 * np.log10(pspl_magnification(systems['u0']))
+    snr = signal_to_noise_ratio_sweep(survey['temperature'], peak_magnitude, survey['diameter'],
+                                      survey['lambda_interval_bottom'], survey['lambda_interval_top'],
+                                      survey['exposure'])['snr']
+    detected = (snr >= survey['signal_to_noise_ratio_threshold']) & \
+               (lens['tE'] >= survey['minimum_time_scale']) & (lens['tE'] <= survey['maximum_time_scale'])
+    return {'number_of_systems': size,
+            'number_detected': int(np.count_nonzero(detected)),
+            'rate': rate.sum(),
+            'rate_detected': rate[detected].sum(),
+            'rate_time_scale': np.sum(rate * lens['tE']),
+            'rate_parallax': np.sum(rate * lens['piE']),
+            'time_scale_histogram': np.histogram(lens['tE'], TIME_SCALE_BINS, weights=rate)[0],
+            'time_scale_histogram_detected': np.histogram(lens['tE'][detected], TIME_SCALE_BINS,
+                                                          weights=rate[detected])[0]}
+
+
+def _chunk_yield(arguments):
+    return chunk_yield(*arguments)
+
+
+def _add_yields(results):
+    # in chunk order, so the sums do not depend on the order in which the chunks finish
+    totals = {}
+    for result in results:
+        for name, value in result.items():
+            totals[name] = totals[name] + value if name in totals else value
+    return totals
+
+
+def simulate_population(number_of_systems, seed=0, chunk_size=1000000, number_of_workers=None, population=None,
+                        survey=None):
+    """
+    Draw number_of_systems lens systems in chunks (in a pool of processes) and add up their yields
+    :param number_of_systems:
+    :param seed: the result only depends on the seed and chunk_size
+    :param chunk_size: number of systems per chunk (sets the memory of every process)
+    :param number_of_workers: number of processes (default: all the cpus). With 1 everything runs in this process
+    :param population: dictionary like DEFAULT_POPULATION
+    :param survey: dictionary like DEFAULT_SURVEY
+    :return: dictionary of sums and histograms, with the rate-weighted detection efficiency, mean tE (days) and mean
+             piE (1/m)
+    """
+    number_of_chunks = -(-number_of_systems // chunk_size)
+    sizes = [min(chunk_size, number_of_systems - chunk * chunk_size) for chunk in range(number_of_chunks)]
+    tasks = [(seed_sequence, size, population, survey)
+             for seed_sequence, size in zip(np.random.SeedSequence(seed).spawn(number_of_chunks), sizes)]
+    if number_of_workers == 1:
+        totals = _add_yields(map(_chunk_yield, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+            totals = _add_yields(executor.map(_chunk_yield, tasks))
+    totals['detection_efficiency'] = totals['rate_detected'] / totals['rate']
+    totals['mean_time_scale'] = totals['rate_time_scale'] / totals['rate']
+    totals['mean_parallax'] = totals['rate_parallax'] / totals['rate']
+    return totals
+
+
+if __name__ == '__main__':
+    import time
+
+    # The system of lensingsystem(): Re = 1.91 au, tE = 16.6 days
+    system = lens_system(8000, 6000, 0.3, 200)
+    print(f'Re = {system["Re"] / ASTRONOMICAL_UNIT:.4f} au, tE = {system["tE"]:.4f} days, '
+          f'piE = {system["piE"] * ASTRONOMICAL_UNIT:.4f} (1/au)')
+
+    start_time = time.perf_counter()
+    yields = simulate_population(4000000, seed=1, chunk_size=500000)
+    print(f'{yields["number_of_systems"]} systems in {time.perf_counter() - start_time:.2f} s: '
+          f'{yields["number_detected"]} detected, rate-weighted efficiency {yields["detection_efficiency"]:.4f}, '
+          f'mean tE {yields["mean_time_scale"]:.2f} days')
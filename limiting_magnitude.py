@@ -0,0 +1,85 @@
+"""
+Limiting magnitude: the faintest star that reaches a target signal to noise ratio
+The Angel and Woolf 1998 S/N of GT_for_cumlus.signal_to_noise_ratio, X = S / sqrt(S + N), is a quadratic in the
+signal S, S^2 - X^2 S - X^2 N = 0, with the positive root S = (X^2 + sqrt(X^4 + 4 X^2 N)) / 2. The photoelectrons of
+Liebe 2002 eqn4 (GT_for_cumlus.photoelectrons_per_exposure_cauculator) go as 2.5^-magnitude, so the magnitude follows
+with a logarithm. Everything is closed form and broadcasts over arrays of configurations.
+"""
+import numpy as np
+
+from cumlus.GT_for_cumlus import radiant_flux_calculator, total_number_of_incident_photon_per_second_per_area, \
+    photoelectrons_per_exposure_cauculator
+
+
+def signal_for_signal_to_noise_ratio(signal_to_noise_ratio_, noise_):
+    """
+    Inverse of GT_for_cumlus.signal_to_noise_ratio: the signal S with S / sqrt(S + noise_) = signal_to_noise_ratio_
+    :param signal_to_noise_ratio_: target signal to noise ratio
+    :param noise_: dark_current_noise + read_out_noise + diffuse_background
+    :return: photoelectrons (same units as noise_)
+    """
+    snr_squared = np.square(signal_to_noise_ratio_)
+    return (snr_squared + np.sqrt(snr_squared ** 2 + 4 * snr_squared * noise_)) / 2
+
+
+def magnitude_for_photoelectrons(photoelectrons_, E_range_pe_smm2_, exposuretime_sec_, diameter_telescope_mm2_):
+    """
+    Inverse of GT_for_cumlus.photoelectrons_per_exposure_cauculator: the magnitude of the star that gives photoelectrons_
+    :param photoelectrons_:
+    :param E_range_pe_smm2_:
+    :param exposuretime_sec_:
+    :param diameter_telescope_mm2_:
+    :return: magnitude
+    """
+    magnitude_zero_photoelectrons = photoelectrons_per_exposure_cauculator(E_range_pe_smm2_, 0.0, exposuretime_sec_,
+                                                                           diameter_telescope_mm2_)
+    return np.log(magnitude_zero_photoelectrons / photoelectrons_) / np.log(2.5)
+
+
+def limiting_magnitude(signal_to_noise_ratio_, temperature, diameter, lambda_interval_bottom, lambda_interval_top,
+                       exposure, flux_sun=1361, quantum_efficiency=0.45, dark_current=0.05, read_out=0.3,
+                       diffuse_background=9.11, integration_method='series'):
+    """
+    Faintest magnitude with a signal to noise ratio of at least signal_to_noise_ratio_. The inputs can be anything that
+    numpy broadcasts together (e.g. the output of snr_sweep.sweep_grid without the magnitude). Same steps and units as
+    snr_sweep.signal_to_noise_ratio_sweep, which it inverts.
+    :param signal_to_noise_ratio_: target signal to noise ratio
+    :param temperature: in kelvin
+    :param diameter: in mm
+    :param lambda_interval_bottom: in nm
+    :param lambda_interval_top: in nm
+    :param exposure: in seconds
+    :param flux_sun: in W/m^2
+    :param quantum_efficiency:
+    :param dark_current: electrons/second
+    :param read_out: electrons/second
+    :param diffuse_background: photons/second
+    :param integration_method: 'series', or 'table' to use the precomputed tables of band_flux_table.py
+    :return: limiting magnitude
+    """
+    radiant_flux, _ = radiant_flux_calculator(flux_sun_=flux_sun, lambda_interval_bottom_=lambda_interval_bottom,
+                                              lambda_interval_top_=lambda_interval_top, temperature_=temperature,
+                                              method_=integration_method)
+    E_range, _ = total_number_of_incident_photon_per_second_per_area(
+        lambda_interval_bottom_=np.asarray(lambda_interval_bottom) * 1e-9,
+        lambda_interval_top_=np.asarray(lambda_interval_top) * 1e-9,
+        radiant_flux_=radiant_flux, quantum_efficiency_=quantum_efficiency)
+    photoelectrons = signal_for_signal_to_noise_ratio(signal_to_noise_ratio_,
+                                                      dark_current + read_out + diffuse_background)
+    return magnitude_for_photoelectrons(photoelectrons, E_range, exposure, diameter)
+
+
+if __name__ == '__main__':
+    from cumlus.snr_sweep import signal_to_noise_ratio_sweep
+
+    # Same assumptions as GT_for_cumlus.py: M5 star, 185 mm, H band, 1 s
+    print(f'Limiting magnitude for S/N = 5: {limiting_magnitude(5.0, 2800, 185, 1300, 1900, 1.0):.4f}')
+
+    # Limiting magnitude for S/N = 10, for temperature x diameter x exposure, in one pass
+    temperature = np.linspace(2500, 6000, 351).reshape(-1, 1, 1)
+    diameter = np.linspace(100, 300, 201).reshape(1, -1, 1)
+    exposure = np.array([1.0, 10.0, 60.0]).reshape(1, 1, -1)
+    magnitudes = limiting_magnitude(10.0, temperature, diameter, 1300, 1900, exposure)
+    snr = signal_to_noise_ratio_sweep(temperature, magnitudes, diameter, 1300, 1900, exposure)['snr']
+    print(f'{magnitudes.size} limiting magnitudes, from {magnitudes.min():.2f} to {magnitudes.max():.2f}, '
+          f'S/N at the limit between {snr.min():.12f} and {snr.max():.12f}')
@@ -0,0 +1,130 @@
+"""
+Geometry of the space parallax between observatories, for arrays of source directions and epochs
+Vectorized versions of vectorTowardsSourceStar, vectorTowardsObservatory, projectVectorPlane, projectVectorCoords and
+computeTau of notebooks/nasa-cumulus-nick.ipynb: plain floats (degrees, meters) instead of astropy quantities and
+lists, and 3-vectors along the last axis, so one call handles any number of directions and observer positions (e.g.
+from ephemeris.observer_positions). As in the notebook, heliocentric and geocentric equatorial coordinates are the same.
+"""
+import numpy as np
+from astropy import constants as const
+
+from cumlus.ephemeris import observer_positions
+
+ASTRONOMICAL_UNIT = const.au.si.value
+
+
+def vector_towards_source_star(ra_deg, dec_deg):
+    """
+    Unit vector from the Sun towards the source star
+    :param ra_deg: right ascension in degrees (array)
+    :param dec_deg: declination in degrees (array)
+    :return: array (ra/dec broadcast shape + (3,))
+    """
+    ra_rad, dec_rad = np.radians(ra_deg), np.radians(dec_deg)
+    return np.stack(np.broadcast_arrays(np.cos(ra_rad) * np.cos(dec_rad), np.sin(ra_rad) * np.cos(dec_rad),
+                                        np.sin(dec_rad)), axis=-1)
+
+
+def vector_towards_observatory(ra_deg, dec_deg, r):
+    """
+    Heliocentric vector of an observatory from its heliocentric RA/Dec and range
+    :param ra_deg: in degrees
+    :param dec_deg: in degrees
+    :param r: heliocentric distance in meters
+    :return: array (... + (3,)) in meters
+    """
+    return vector_towards_source_star(ra_deg, dec_deg) * np.asarray(r, dtype=float)[..., np.newaxis]
+
+
+def project_vector_plane(u, n):
+    """
+    Projection of the 3-vectors u on the planes of normals n (the observer plane when n points to the source star)
+    :param u: array (..., 3)
+    :param n: array (..., 3), not necessarily unit vectors
+    :return: array (..., 3)
+    """
+    u = np.asarray(u, dtype=float)
+    n = np.asarray(n, dtype=float)
+    return u - (np.sum(u * n, axis=-1) / np.sum(n * n, axis=-1))[..., np.newaxis] * n
+
+
+def observer_plane_basis(ra_deg, dec_deg):
+    """
+    Orthogonal unit vectors of the observer plane of the source at ra_deg, dec_deg (n1 towards the east, n2 towards
+    the north)
+    :param ra_deg: in degrees
+    :param dec_deg: in degrees
+    :return: n1, n2, arrays (... + (3,))
+    """
+    ra_rad, dec_rad = np.radians(ra_deg), np.radians(dec_deg)
+    zero = np.zeros(np.broadcast(ra_rad, dec_rad).shape)
+    n1 = np.stack(np.broadcast_arrays(-np.sin(ra_rad), np.cos(ra_rad), zero), axis=-1)
+    n2 = np.stack(np.broadcast_arrays(-np.cos(ra_rad) * np.sin(dec_rad), -np.sin(ra_rad) * np.sin(dec_rad),
+                                      np.cos(dec_rad)), axis=-1)
+    return n1, n2
+
+
+def project_vector_coords(ra_deg, dec_deg, u_obs):
+    """
+    Coordinates of observer positions in the observer plane of the source at ra_deg, dec_deg
+    :param ra_deg: in degrees
+    :param dec_deg: in degrees
+    :param u_obs: heliocentric positions of the observer, array (..., 3) (broadcast with ra/dec)
+    :return: u1, u2 (positions along n1 and n2, in the units of u_obs), n1, n2
+    """
+    n1, n2 = observer_plane_basis(ra_deg, dec_deg)
+    u_obs = np.asarray(u_obs, dtype=float)
+    return np.sum(u_obs * n1, axis=-1), np.sum(u_obs * n2, axis=-1), n1, n2
+
+
+def compute_tau(delta_x, delta_y, piE, chi_deg):
+    """
+    Difference of the peak times seen by two observers, in units of tE (equation 3 of Calchi Novati and Scarpetta), as
+    computeTau of the notebook
+    :param delta_x: difference of the observer positions along n1, projected on the lens plane, in meters
+    :param delta_y: difference of the observer positions along n2, projected on the lens plane, in meters
+    :param piE: magnitude of the parallax in 1/m (lens_population.lens_system)
+    :param chi_deg: angle of the lens direction of motion in degrees
+    :return: tau (all the inputs broadcast together)
+    """
+    chi_rad = np.radians(chi_deg)
+    return piE * (np.cos(chi_rad) * delta_y - np.sin(chi_rad) * delta_x)
+
+
+def projected_observer_coords(observer, jd, ra_deg, dec_deg, fetch=False):
+    """
+    Coordinates in the observer plane of an observatory at many epochs, with the positions of ephemeris.py
+    :param observer: Horizons identifier, e.g. '399' (Earth) or 'spitzer'
+    :param jd: array of Julian dates
+    :param ra_deg: right ascension of the source in degrees (broadcast with jd)
+    :param dec_deg: declination of the source in degrees (broadcast with jd)
+    :param fetch: query Horizons if there is no table for these epochs (see ephemeris.observer_positions)
+    :return: u1, u2 in meters
+    """
+    positions, _ = observer_positions(observer, jd, fetch)
+    u1, u2, _, _ = project_vector_coords(ra_deg, dec_deg, positions * ASTRONOMICAL_UNIT)
+    return u1, u2
+
+
+if __name__ == '__main__':
+    from astropy.time import Time
+
+    # Checks of the notebook, for 10000 random directions at once
+    rng = np.random.default_rng(0)
+    ra, dec = rng.uniform(0, 360, 10000), np.degrees(np.arcsin(rng.uniform(-1, 1, 10000)))
+    n_hat = vector_towards_source_star(ra, dec)
+    u_obs = vector_towards_observatory(ra[::-1], dec[::-1], 4e6)
+    u1, u2, n1, n2 = project_vector_coords(ra, dec, u_obs)
+    u_proj = project_vector_plane(u_obs, n_hat)
+    print(f'|n_hat| - 1: {np.max(np.abs(np.linalg.norm(n_hat, axis=-1) - 1)):.1e}, '
+          f'n1.n2: {np.max(np.abs(np.sum(n1 * n2, axis=-1))):.1e}, '
+          f'n1.n_hat: {np.max(np.abs(np.sum(n1 * n_hat, axis=-1))):.1e}, '
+          f'n2.n_hat: {np.max(np.abs(np.sum(n2 * n_hat, axis=-1))):.1e}')
+    print(f'u_proj.n1 - u1: {np.max(np.abs(np.sum(u_proj * n1, axis=-1) - u1)):.1e} m, '
+          f'u_proj.n2 - u2: {np.max(np.abs(np.sum(u_proj * n2, axis=-1) - u2)):.1e} m')
+
+    # The Earth in the observer plane of the notebook source (RA = 175, Dec = 50) during one year
+    jd = Time('2021-04-11T00:00:00', scale='utc').jd + np.arange(0, 365, 0.25)
+    u1, u2 = projected_observer_coords('399', jd, 175, 50)
+    print(f'{jd.size} epochs, projected Earth orbit from {np.min(np.hypot(u1, u2)) / ASTRONOMICAL_UNIT:.3f} to '
+          f'{np.max(np.hypot(u1, u2)) / ASTRONOMICAL_UNIT:.3f} au')
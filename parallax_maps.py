@@ -0,0 +1,157 @@
+"""
+Full-sky, multi-epoch maps of the space parallax between two observatories
+For every source direction x epoch, the baseline between the observatories is projected on the observer plane
+(parallax.project_vector_coords), and for every set of lens parameters (x = Dl/Ds, piE, chi) it gives the difference
+of the peak times in units of tE (parallax.compute_tau), as the last cells of notebooks/nasa-cumulus-nick.ipynb do for
+one direction, one epoch and one lens. The observer plane bases of a chunk of directions are multiplied by the
+baselines of all the epochs at once (a matrix product), and tau broadcasts over the lens parameters.
+The maps are written chunk by chunk into .npy files of the output directory (memory mapped), then the axes (.npy
+files too), and the description of the map (hashes of the axes and of the positions of the observers) is written last.
+Asking for the same map in the same directory loads it instead of computing it again.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cumlus.caching import save_json
+from cumlus.ephemeris import observer_positions
+from cumlus.parallax import ASTRONOMICAL_UNIT, observer_plane_basis, compute_tau
+
+SPEC_FILENAME = 'tau_map.json'
+MAP_NAMES = ('baseline_x', 'baseline_y', 'tau')
+# Axes of the maps, saved as .npy files next to them (the spec only has their hashes)
+AXIS_NAMES = ('ra_deg', 'dec_deg', 'jd', 'x', 'piE', 'chi_deg')
+
+
+def sky_grid(number_of_ra, number_of_dec):
+    """
+    Directions in the middle of number_of_ra x number_of_dec cells of equal area (uniform in RA and in sin(Dec))
+    :param number_of_ra:
+    :param number_of_dec:
+    :return: ra_deg, dec_deg, flat arrays (RA varies fastest)
+    """
+    ra = (np.arange(number_of_ra) + 0.5) * 360 / number_of_ra
+    dec = np.degrees(np.arcsin((np.arange(number_of_dec) + 0.5) * 2 / number_of_dec - 1))
+    dec_deg, ra_deg = np.meshgrid(dec, ra, indexing='ij')
+    return ra_deg.ravel(), dec_deg.ravel()
+
+
+def _array_hash(values):
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=float).tobytes()).hexdigest()[:32]
+
+
+def _positions(observer, jd, fetch):
+    # an identifier for ephemeris.py, or the positions themselves (jd.shape + (3,), au)
+    if isinstance(observer, str):
+        return observer_positions(observer, jd, fetch)[0]
+    return np.asarray(observer, dtype=float)
+
+
+def _read_spec(directory):
+    with open(os.path.join(directory, SPEC_FILENAME)) as file:
+        return json.load(file)
+
+
+def tau_map(directory, ra_deg, dec_deg, jd, x, piE, chi_deg, observers=('399', 'spitzer'), chunk_size=4096,
+            dtype='float32', fetch=False):
+    """
+    Compute (or load, if this map is already in directory) the projected baselines and tau for every direction,
+    epoch and set of lens parameters
+    :param directory: where the maps are saved
+    :param ra_deg: 1D array of right ascensions of the sources in degrees (e.g. from sky_grid)
+    :param dec_deg: 1D array of declinations in degrees
+    :param jd: 1D array of Julian dates
+    :param x: Dl/Ds of the lenses (x, piE and chi_deg are broadcast together into one axis)
+    :param piE: magnitude of the parallax in 1/m (lens_population.lens_system)
+    :param chi_deg: angle of the lens direction of motion in degrees
+    :param observers: the two observatories, Horizons identifiers (see ephemeris.observer_positions) or arrays of
+                      positions (jd.shape + (3,), heliocentric equatorial, au)
+    :param chunk_size: number of directions computed at once
+    :param dtype: dtype of the tau map
+    :param fetch: query Horizons if there is no ephemeris for these epochs
+    :return: dictionary like load_tau_map
+    """
+    ra_deg, dec_deg, jd = (np.atleast_1d(np.asarray(values, dtype=float)) for values in (ra_deg, dec_deg, jd))
+    x, piE, chi_deg = (values.ravel() for values in np.broadcast_arrays(*(np.asarray(values, dtype=float)
+                                                                          for values in (x, piE, chi_deg))))
+    if ra_deg.shape != dec_deg.shape or ra_deg.ndim != 1:
+        raise ValueError(f'ra_deg and dec_deg have to be 1D arrays of the same length, not {ra_deg.shape} and '
+                         f'{dec_deg.shape}.')
+    # the positions are resolved first: a map of the analytic Earth is not the map of a Horizons table of the Earth
+    positions = [_positions(observer, jd, fetch) for observer in observers]
+    axes = dict(zip(AXIS_NAMES, (ra_deg, dec_deg, jd, x, piE, chi_deg)))
+    spec = {'axes': {name: {'length': len(values), 'hash': _array_hash(values)} for name, values in axes.items()},
+            'observers': [{'name': observer if isinstance(observer, str) else None,
+                           'positions': _array_hash(resolved)}
+                          for observer, resolved in zip(observers, positions)],
+            'dtype': np.dtype(dtype).str}
+    if os.path.exists(os.path.join(directory, SPEC_FILENAME)) and \
+            _read_spec(directory) == json.loads(json.dumps(spec)):
+        return load_tau_map(directory)
+
+    # baseline between the observatories at every epoch, in meters
+    baseline = (positions[0] - positions[1]) * ASTRONOMICAL_UNIT
+    os.makedirs(directory, exist_ok=True)
+    # an unfinished map is never mistaken for a finished one
+    if os.path.exists(os.path.join(directory, SPEC_FILENAME)):
+        os.remove(os.path.join(directory, SPEC_FILENAME))
+    shapes = {'baseline_x': (len(ra_deg), len(jd)), 'baseline_y': (len(ra_deg), len(jd)),
+              'tau': (len(ra_deg), len(jd), len(x))}
+    maps = {name: np.lib.format.open_memmap(os.path.join(directory, f'{name}.npy'), mode='w+',
+                                            dtype=dtype if name == 'tau' else np.float64, shape=shapes[name])
+            for name in MAP_NAMES}
+    for start in range(0, len(ra_deg), chunk_size):
+        n1, n2 = observer_plane_basis(ra_deg[start:start + chunk_size], dec_deg[start:start + chunk_size])
+        delta_x = n1 @ baseline.T
+        delta_y = n2 @ baseline.T
+        maps['baseline_x'][start:start + chunk_size] = delta_x
+        maps['baseline_y'][start:start + chunk_size] = delta_y
+        # projected on the lens plane
+        maps['tau'][start:start + chunk_size] = compute_tau(delta_x[..., np.newaxis] * (1 - x),
+                                                            delta_y[..., np.newaxis] * (1 - x), piE, chi_deg)
+    for array in maps.values():
+        array.flush()
+    del maps
+    for name, values in axes.items():
+        np.save(os.path.join(directory, f'{name}.npy'), values)
+    save_json(os.path.join(directory, SPEC_FILENAME), spec)
+    return load_tau_map(directory)
+
+
+def load_tau_map(directory):
+    """
+    Maps of a directory, memory mapped (read only)
+    :param directory:
+    :return: dictionary with baseline_x, baseline_y (directions, epochs) in meters, in the observer plane,
+             tau (directions, epochs, lens parameters), and the axes: ra_deg, dec_deg, jd, x, piE, chi_deg
+    """
+    if not os.path.exists(os.path.join(directory, SPEC_FILENAME)):
+        raise ValueError(f'There is no finished tau map in {directory}.')
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in MAP_NAMES + AXIS_NAMES}
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    from astropy.time import Time
+
+    from cumlus.ephemeris import earth_position_analytic
+    from cumlus.lens_population import lens_system
+
+    # The Earth and a spacecraft trailing the Earth by 60 days on its orbit (as Spitzer did), during one year, for the
+    # lens of lensingsystem() and 8 directions of motion
+    jd = Time('2021-04-11T00:00:00', scale='utc').jd + np.arange(0, 365, 1.0)
+    ra, dec = sky_grid(72, 36)
+    lens = lens_system(8000, 6000, 0.3, 200)
+    chi = np.arange(0, 360, 45)
+    with tempfile.TemporaryDirectory() as directory:
+        for attempt in ('computed', 'loaded'):
+            start_time = time.perf_counter()
+            tau = tau_map(directory, ra, dec, jd, lens['x'], lens['piE'], chi,
+                          observers=('399', earth_position_analytic(jd - 60)))
+            print(f'tau map {tau["tau"].shape} {attempt} in {time.perf_counter() - start_time:.2f} s, '
+                  f'|tau| up to {np.max(np.abs(tau["tau"])):.3f}')
+        del tau
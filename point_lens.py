@@ -0,0 +1,103 @@
+"""
+Point-source point-lens (PSPL) light curves for many events at once, with numpy only
+Same model as MagnificationSignal.generating_magnification_PSPL of notebooks/simulating_the_lightcurve.ipynb (no
+parallax), without muLAn and pandas:
+    u(t) = sqrt(u0^2 + ((t - t0) / tE)^2),    A(u) = (u^2 + 2) / (u sqrt(u^2 + 4))
+The events either share one time grid (the result is (number of events, number of times)), or each event has its own
+times (ragged): all the times in one flat array and the offsets where every event starts, as in a CSR matrix.
+"""
+import numpy as np
+
+
+def pspl_magnification(u, dtype=np.float64):
+    """
+    Paczynski magnification of a point source by a point lens
+    :param u: source-lens separation in Einstein radii
+    :param dtype: np.float64 or np.float32
+    :return: magnification (infinite at u = 0)
+    """
+    u = np.asarray(u, dtype=dtype)
+    u_squared = u * u
+    with np.errstate(divide='ignore'):
+        return (u_squared + 2) / (u * np.sqrt(u_squared + 4))
+
+
+def impact_parameter(times, t0, u0, tE, dtype=np.float64):
+    """
+    Source-lens separation in Einstein radii for a straight trajectory
+    :param times: in days
+    :param t0: time of the peak in days
+    :param u0: impact parameter in Einstein radii
+    :param tE: Einstein radius crossing time in days
+    :param dtype: np.float64 or np.float32
+    :return: u (times, t0, u0 and tE broadcast together)
+    """
+    tau = (np.asarray(times, dtype=dtype) - np.asarray(t0, dtype=dtype)) / np.asarray(tE, dtype=dtype)
+    return np.sqrt(tau * tau + np.square(np.asarray(u0, dtype=dtype)))
+
+
+def ragged_event_index(offsets):
+    """
+    Event of every time in a ragged set of light curves
+    :param offsets: array of number of events + 1 positions, event i has the times offsets[i]:offsets[i + 1]
+    :return: array with the index of the event of each time
+    """
+    offsets = np.asarray(offsets)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def ragged_offsets(lengths):
+    """
+    :param lengths: number of times of every event
+    :return: offsets (number of events + 1), as used by pspl_light_curves
+    """
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def pspl_light_curves(times, t0, u0, tE, offsets=None, dtype=np.float64):
+    """
+    Magnification of many PSPL events in one pass
+    :param times: one time grid shared by all the events, or (with offsets) the times of all the events one after the
+                  other, in days
+    :param t0: array of times of the peak in days, one per event
+    :param u0: array of impact parameters, one per event
+    :param tE: array of Einstein radius crossing times in days, one per event
+    :param offsets: None for a shared grid, or the start of every event in times (number of events + 1 positions)
+    :param dtype: np.float64 or np.float32 (half the memory, ~1e-7 relative precision)
+    :return: array (number of events, number of times) for a shared grid, or flat array like times for ragged times
+    """
+    t0, u0, tE = (np.atleast_1d(np.asarray(parameter, dtype=dtype)) for parameter in (t0, u0, tE))
+    if offsets is None:
+        u = impact_parameter(np.asarray(times, dtype=dtype)[np.newaxis, :], t0[:, np.newaxis], u0[:, np.newaxis],
+                             tE[:, np.newaxis], dtype)
+    else:
+        event = ragged_event_index(offsets)
+        if len(event) != len(times):
+            raise ValueError(f'The offsets describe {len(event)} times, but there are {len(times)} times.')
+        u = impact_parameter(times, t0[event], u0[event], tE[event], dtype)
+    return pspl_magnification(u, dtype)
+
+
+if __name__ == '__main__':
+    import time
+
+    # PSPL example of the notebook: t0 = 0, u0 = 0.1, tE = 15 days, 30 points from -30 to 30 days
+    print(pspl_light_curves(np.linspace(-30, 30, 30), 0.0, 0.1, 15.0)[0])
+
+    # One million events on a shared grid of 100 times, in float32
+    rng = np.random.default_rng(0)
+    number_of_events = 1000000
+    t0 = rng.uniform(-10, 10, number_of_events)
+    u0 = rng.uniform(0.01, 1.0, number_of_events)
+    tE = rng.lognormal(np.log(20), 0.5, number_of_events)
+    start_time = time.perf_counter()
+    magnification = pspl_light_curves(np.linspace(-30, 30, 100), t0, u0, tE, dtype=np.float32)
+    print(f'{magnification.shape} magnifications in {time.perf_counter() - start_time:.2f} s')
+
+    # Ragged times: every event has its own number of observations
+    lengths = rng.integers(10, 200, 100000)
+    offsets = ragged_offsets(lengths)
+    times = rng.uniform(-30, 30, offsets[-1])
+    start_time = time.perf_counter()
+    magnification = pspl_light_curves(times, t0[:100000], u0[:100000], tE[:100000], offsets=offsets)
+    print(f'{magnification.size} ragged magnifications in {time.perf_counter() - start_time:.2f} s')
@@ -0,0 +1,114 @@
+"""
+Photon counts with a quantum efficiency that depends on the wavelength
+The QE curves of detector_registry.py (or of reading_plots/qe_values.csv, made by reading_plots/QE_values.py) are put
+once on a fixed wavelength grid of the band. The photon-count integral then becomes a weighted sum over that grid, and
+many stars x detectors are done with one matrix product, instead of quad over an interpolated QE called point by point.
+"""
+import os
+
+import numpy as np
+
+from cumlus.GT_for_cumlus import planck_constant, speed_of_light, radiative_spectral_emittance
+from cumlus.detector_registry import quantum_efficiency_curves
+
+QE_VALUES_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reading_plots', 'qe_values.csv')
+# detector name: (wavelength column [nm], quantum efficiency column [0-1]) in qe_values.csv
+DETECTOR_COLUMNS = {'goldeye_g130': ('wavelength_commercial', 'qe_commercial'),
+                    'h2rg_184': ('wavelength_184', 'qe_184'),
+                    'h2rg_211': ('wavelength_211', 'qe_211'),
+                    'h2rg_212': ('wavelength_212', 'qe_212')}
+
+
+def load_quantum_efficiency_curves(filepath=None):
+    """
+    Read the QE curves of the detectors
+    :param filepath: csv with the columns of DETECTOR_COLUMNS (e.g. QE_VALUES_FILEPATH), default: the curves of
+                     detector_registry.py
+    :return: dictionary detector name: (wavelength in nm, quantum efficiency)
+    """
+    if filepath is None:
+        return quantum_efficiency_curves()
+    with open(filepath) as file:
+        header = file.readline().strip().split(',')
+    values = np.loadtxt(filepath, delimiter=',', skiprows=1)
+    curves = {}
+    for detector, (wavelength_column, qe_column) in DETECTOR_COLUMNS.items():
+        curves[detector] = (values[:, header.index(wavelength_column)], values[:, header.index(qe_column)])
+    return curves
+
+
+def wavelength_grid(lambda_interval_bottom_, lambda_interval_top_, number_of_points=512):
+    """
+    Uniform wavelength grid of the band, with the weights of the trapezoidal rule
+    :param lambda_interval_bottom_: in m
+    :param lambda_interval_top_: in m
+    :param number_of_points:
+    :return: wavelength, weights
+    """
+    wavelength = np.linspace(lambda_interval_bottom_, lambda_interval_top_, number_of_points)
+    weights = np.full(number_of_points, wavelength[1] - wavelength[0])
+    weights[[0, -1]] /= 2
+    return wavelength, weights
+
+
+def quantum_efficiency_matrix(curves, wavelength):
+    """
+    QE of every detector on the wavelength grid (zero outside of the measured curve)
+    :param curves: dictionary detector name: (wavelength in nm, quantum efficiency)
+    :param wavelength: grid in m
+    :return: detector names, array (number of detectors, number of wavelengths)
+    """
+    detectors = list(curves)
+    matrix = np.array([np.interp(wavelength, curves[detector][0] * 1e-9, curves[detector][1], left=0.0, right=0.0)
+                       for detector in detectors])
+    return detectors, matrix
+
+
+def photon_count_response(wavelength, weights, quantum_efficiency):
+    """
+    Weights of the photon-count integral on the grid: quadrature weight * QE / planck_einstein_relation
+    :param wavelength: grid in m
+    :param weights: quadrature weights of the grid
+    :param quantum_efficiency: array (number of detectors, number of wavelengths), or a number
+    :return: array (number of wavelengths, number of detectors)
+    """
+    quantum_efficiency = np.atleast_2d(quantum_efficiency) * np.ones_like(wavelength)
+    return (weights * wavelength / (planck_constant * speed_of_light) * quantum_efficiency).T
+
+
+def total_number_of_incident_photon_per_second_per_area_qe(radiant_flux_, response_):
+    """
+    Same as GT_for_cumlus.total_number_of_incident_photon_per_second_per_area (Gabor Eqn 2.11), with the QE of
+    each detector as a function of the wavelength
+    :param radiant_flux_: array of radiant fluxes (e.g. one per star)
+    :param response_: output of photon_count_response
+    :return: array (radiant_flux_.shape + (number of detectors,))
+    """
+    return np.multiply.outer(np.asarray(radiant_flux_, dtype=float), response_.sum(axis=0))
+
+
+def blackbody_photon_count(temperature_, wavelength, response_):
+    """
+    Number of photons per second per area detected from a black body (Planck law / planck_einstein_relation,
+    integrated with the QE of each detector) for many stars and detectors at once
+    :param temperature_: array of temperatures in kelvin
+    :param wavelength: grid in m
+    :param response_: output of photon_count_response
+    :return: array (temperature_.shape + (number of detectors,))
+    """
+    temperature_ = np.asarray(temperature_, dtype=float)
+    spectrum = radiative_spectral_emittance(wavelength, temperature_.reshape(-1, 1))
+    return (spectrum @ response_).reshape(temperature_.shape + (response_.shape[1],))
+
+
+if __name__ == '__main__':
+    # H band, as in GT_for_cumlus.py
+    wavelength, weights = wavelength_grid(1300e-9, 1900e-9)
+    detectors, quantum_efficiency = quantum_efficiency_matrix(load_quantum_efficiency_curves(), wavelength)
+    response = photon_count_response(wavelength, weights, quantum_efficiency)
+
+    temperature = np.linspace(2500, 10000, 100000)
+    photons = blackbody_photon_count(temperature, wavelength, response)
+    for detector, photons_per_detector in zip(detectors, photons.T):
+        print(f'{detector}: {photons_per_detector[0]:.4e} - {photons_per_detector[-1]:.4e} photoelectrons/(s m^2) '
+              f'from {temperature[0]} to {temperature[-1]} K')
@@ -1,11 +1,17 @@
 # this didn't work
 # import cumlus.FigureData.FigureData as FigureData
 # FigureData.go(figure_file='commercial_camera_QE.png', output_file='myfigure.data')
+# detector_registry.py builds the same curves once and caches them, without pandas
+import os
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.interpolate import interp1d
 
+# the csv files are next to this file, wherever it is run from
+READING_PLOTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
 
 def cleaning_data(dataframe, qe_initial, qe_final, wavelength_initial, wavelength_final):
     """
@@ -57,7 +63,7 @@ def get_quantum_efficiency_commercial_camera():
     smooth_wavelength - the array with the wavelength range defined in the function
     smooth_qe - the array QE in function of wavelength that we interpolated
     """
-    quantum_efficiency_df = pd.read_csv('commercial_camera_QE.csv')
+    quantum_efficiency_df = pd.read_csv(os.path.join(READING_PLOTS_DIRECTORY, 'commercial_camera_QE.csv'))
 
     # wavelength, quantum_efficiency
     clean_wave_df = cleaning_data(dataframe=quantum_efficiency_df,
@@ -77,9 +83,9 @@ def get_quantum_efficiency_h2rg():
     wavelength_number - the array with the wavelength range defined in the function
     qe_number - the array QE in function of wavelength that we interpolated
     """
-    quantum_efficiency_df_184 = pd.read_csv('H2RG_QE_red.csv')
-    quantum_efficiency_df_211 = pd.read_csv('H2RG_QE_blue.csv')
-    quantum_efficiency_df_212 = pd.read_csv('H2RG_QE_black.csv')
+    quantum_efficiency_df_184 = pd.read_csv(os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_red.csv'))
+    quantum_efficiency_df_211 = pd.read_csv(os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_blue.csv'))
+    quantum_efficiency_df_212 = pd.read_csv(os.path.join(READING_PLOTS_DIRECTORY, 'H2RG_QE_black.csv'))
     # wavelength, quantum_efficiency
     clean_wave_df_184 = cleaning_data(dataframe=quantum_efficiency_df_184,
                                       qe_initial=0.0, qe_final=1.1,
@@ -143,6 +149,6 @@ if __name__ == '__main__':
     # xtinct_redden_df = pd.DataFrame(list(dictionary.items()), columns=['Parameters', 'Values'])
     # extinct_redden_df.to_csv('/Users/sishitan/Documents/Analysis_MOA-2020-BLG-135/for_paper/extinction_reddening.csv')
     qe_dataframe = pd.DataFrame(dictionary)
-    qe_dataframe.to_csv('/Users/sishitan/Documents/Cumlus/cumlus/reading_plots/qe_values.csv')
+    qe_dataframe.to_csv(os.path.join(READING_PLOTS_DIRECTORY, 'qe_values.csv'))
     print("")
 
@@ -5,16 +5,20 @@ This is a script to calculate the sensitivity of a telescope to detect microlens
 import numpy as np
 from astropy import constants as const
 from astropy import units as u
-from bokeh.io import output_file
-from bokeh.plotting import figure, show
 
-from cumlus.simple_plot import plotter
+from cumlus.instrumentation import instrumented, instrumented_block
+
+# "photons" unit definition
+photons = u.def_unit('photons')
+# "photoelectrons" unit definition
+photoelectrons = u.def_unit('photoelectrons')
 
 
 def print_cyan(to_be_printed):
     print("\033[96m {}\033[00m".format(to_be_printed))
 
 
+@instrumented
 def planck_einstein_relation(wavelength):
     """
     This function calculates the energy of a photon in a specific wavelength
@@ -27,6 +31,7 @@ def planck_einstein_relation(wavelength):
     return energy_photon
 
 
+@instrumented
 def photons_emitted_by_a_star_per_second(luminosity, energy_photon):
     """
     This function calculates how many photons are emitted from a star according to its luminosity
@@ -38,6 +43,7 @@ def photons_emitted_by_a_star_per_second(luminosity, energy_photon):
     return number_photons * photons
 
 
+@instrumented
 def photons_arriving_to_a_certain_distance(number_photons, distance):
     """
     how many photons will arrive to this region far from the star
@@ -49,6 +55,7 @@ def photons_arriving_to_a_certain_distance(number_photons, distance):
     return photons_arriving
 
 
+@instrumented
 def photons_after_telescope_aperture(number_photons_per_area, aperture, type='round'):
     """
 
@@ -64,6 +71,7 @@ def photons_after_telescope_aperture(number_photons_per_area, aperture, type='ro
     return number_photons
 
 
+@instrumented
 def photoelectrons_no_amplification(photons_getting_in, quantum_efficiency, etenue):
     """
     This function consider the quantum efficiency and the etenue to see how many photoelectrons are generated when
@@ -77,6 +85,7 @@ def photoelectrons_no_amplification(photons_getting_in, quantum_efficiency, eten
     return number_photoelectrons * photoelectrons
 
 
+@instrumented
 def photoelectrons_with_amplification(number_photoelectrons, amplification):
     """
     Gravitational microlensing works like a lens. The lens star curves the space-time, bending the light from the
@@ -89,6 +98,7 @@ def photoelectrons_with_amplification(number_photoelectrons, amplification):
     return more_photoelecrons
 
 
+@instrumented
 def signal_to_noise_ratio(photoelectrons_per_second_signal, dark_current_noise, read_out_noise, diffuse_background):
     """
     This function calculated the signal to noise, using as input the count of photoelectrons per second for all of these
@@ -109,6 +119,7 @@ def signal_to_noise_ratio(photoelectrons_per_second_signal, dark_current_noise,
     return snr
 
 
+@instrumented
 def relative_signal_to_noise_ratio_calculator(snr_base, snr_detection):
     """
     this function calculates the relative signal to noise ratio
@@ -120,13 +131,16 @@ def relative_signal_to_noise_ratio_calculator(snr_base, snr_detection):
     return relative_snr
 
 
+@instrumented
 def command_to_return_relative_signal_to_noise_ratio(wavelength_star_peak, luminosity_of_the_star,
                                                      distance_from_observer, telescope_diameter,
                                                      quantum_efficiency_value, etenue_value, dark_current,
                                                      read_out, diffuse_background,
-                                                     magnification):
+                                                     magnification, verbose=False):
     """
     This function commands the other functions to give us the relative signal to noise ratio
+    For many evaluations use compile_relative_signal_to_noise_ratio_plan and relative_signal_to_noise_ratio_from_plan,
+    which do the same without carrying the units through every step
     :param wavelength_star_peak:
     :param luminosity_of_the_star:
     :param distance_from_observer:
@@ -137,6 +151,7 @@ def command_to_return_relative_signal_to_noise_ratio(wavelength_star_peak, lumin
     :param read_out:
     :param diffuse_background:
     :param magnification:
+    :param verbose: print the intermediary steps
     :return: relative signal to noise ratio
     """
 
@@ -167,39 +182,135 @@ def command_to_return_relative_signal_to_noise_ratio(wavelength_star_peak, lumin
     # ==================================================================================================================
     #                          PRINTING INTERMEDIARY STEPS JUST TO FOLLOW WHAT IS GOING ON
     # ==================================================================================================================
-    print(f"\nNumber of emitted photons by a star of \nluminosity {luminosity_of_the_star} and \nwavelength peak "
-          f"{wavelength_star_peak} \nper second:")
-    print_cyan(number_emitted_photons_per_second.to(photons / u.s))
-    print(f"\nNumber of photons arriving to an observer {distance_from_observer} away per area and second: ")
-    print_cyan(photons_from_a_certain_distance.to(photons / (u.cm ** 2 * u.s)))
-
-    print(f"\nNumber of photons getting in the telescope of aperture {telescope_diameter} in diameter: ")
-    print_cyan(number_photons_getting_in.to(photons / u.s))
-
-    print(f"\nNumber of photoelectrons generated when the quantum efficiency is {quantum_efficiency_value}"
-          f"and the etenue is {etenue_value}: ")
-    print_cyan(generated_photoelectrons.to(photoelectrons / u.s))
-
-    print(f"\nNumber of photoelectrons generated when there is an amplification of {magnification}")
-    print_cyan(photoelectrons_when_lensed.to(photoelectrons / u.s))
-
-    print(
-        f"\nAssuming dar current of {dark_current}, read noise of {read_out} and background count of {diffuse_background}")
-    # print(f"Signal to Noise ratio without microlensing")
-    # print_cyan((signal_to_noise_ratio_no_microlensing.to((photoelectrons / u.s) ** (1 / 2))).value)
-    # print(f"Signal to Noise ratio with microlensing of {magnification} magnification")
-    # print_cyan((signal_to_noise_ratio_microlensing.to((photoelectrons / u.s) ** (1 / 2))).value)
-    print(f"Signal to Noise ratio without microlensing")
-    print_cyan(signal_to_noise_ratio_no_microlensing.value)
-    print(f"Signal to Noise ratio with microlensing of {magnification} magnification")
-    print_cyan(signal_to_noise_ratio_microlensing.value)
-    print("Relative signal to noise (snr_microlensing - snr_base)/snr_base")
-    print_cyan(relative_signal_to_noise_ratio)
+    if verbose:
+        print(f"\nNumber of emitted photons by a star of \nluminosity {luminosity_of_the_star} and \nwavelength peak "
+              f"{wavelength_star_peak} \nper second:")
+        print_cyan(number_emitted_photons_per_second.to(photons / u.s))
+        print(f"\nNumber of photons arriving to an observer {distance_from_observer} away per area and second: ")
+        print_cyan(photons_from_a_certain_distance.to(photons / (u.cm ** 2 * u.s)))
+
+        print(f"\nNumber of photons getting in the telescope of aperture {telescope_diameter} in diameter: ")
+        print_cyan(number_photons_getting_in.to(photons / u.s))
+
+        print(f"\nNumber of photoelectrons generated when the quantum efficiency is {quantum_efficiency_value}"
+              f"and the etenue is {etenue_value}: ")
+        print_cyan(generated_photoelectrons.to(photoelectrons / u.s))
+
+        print(f"\nNumber of photoelectrons generated when there is an amplification of {magnification}")
+        print_cyan(photoelectrons_when_lensed.to(photoelectrons / u.s))
+
+        print(
+            f"\nAssuming dar current of {dark_current}, read noise of {read_out} and background count of {diffuse_background}")
+        # print(f"Signal to Noise ratio without microlensing")
+        # print_cyan((signal_to_noise_ratio_no_microlensing.to((photoelectrons / u.s) ** (1 / 2))).value)
+        # print(f"Signal to Noise ratio with microlensing of {magnification} magnification")
+        # print_cyan((signal_to_noise_ratio_microlensing.to((photoelectrons / u.s) ** (1 / 2))).value)
+        print(f"Signal to Noise ratio without microlensing")
+        print_cyan(signal_to_noise_ratio_no_microlensing.value)
+        print(f"Signal to Noise ratio with microlensing of {magnification} magnification")
+        print_cyan(signal_to_noise_ratio_microlensing.value)
+        print("Relative signal to noise (snr_microlensing - snr_base)/snr_base")
+        print_cyan(relative_signal_to_noise_ratio)
     return signal_to_noise_ratio_no_microlensing, signal_to_noise_ratio_microlensing, relative_signal_to_noise_ratio
 
 
+# Units of the inputs of the plan, everything is converted to these once
+PLAN_UNITS = {'wavelength_star_peak': u.m,
+              'luminosity_of_the_star': u.W,
+              'distance_from_observer': u.m,
+              'telescope_diameter': u.m,
+              'quantum_efficiency_value': u.dimensionless_unscaled,
+              'etenue_value': u.dimensionless_unscaled,
+              'dark_current': photoelectrons / u.s,
+              'read_out': photoelectrons / u.s,
+              'diffuse_background': photoelectrons / u.s,
+              'magnification': u.dimensionless_unscaled}
+
+
+@instrumented
+def compile_relative_signal_to_noise_ratio_plan(wavelength_star_peak, luminosity_of_the_star,
+                                                distance_from_observer, telescope_diameter,
+                                                quantum_efficiency_value, etenue_value, dark_current,
+                                                read_out, diffuse_background,
+                                                magnification, aperture_type='round'):
+    """
+    Validate and convert the units of a batch of parameters once (same parameters as
+    command_to_return_relative_signal_to_noise_ratio). The parameters can be arrays, they are broadcast together when
+    the plan runs, e.g. distances of shape (n, 1) and diameters of shape (m,) give (n, m) results.
+    A parameter with the wrong units raises astropy's UnitConversionError here.
+    :return: plan (dictionary of float64 arrays in the units of PLAN_UNITS)
+    """
+    parameters = {'wavelength_star_peak': wavelength_star_peak, 'luminosity_of_the_star': luminosity_of_the_star,
+                  'distance_from_observer': distance_from_observer, 'telescope_diameter': telescope_diameter,
+                  'quantum_efficiency_value': quantum_efficiency_value, 'etenue_value': etenue_value,
+                  'dark_current': dark_current, 'read_out': read_out, 'diffuse_background': diffuse_background,
+                  'magnification': magnification}
+    plan = {name: np.asarray(u.Quantity(value).to_value(PLAN_UNITS[name]), dtype=np.float64)
+            for name, value in parameters.items()}
+    plan['aperture_type'] = aperture_type
+    return plan
+
+
+@instrumented
+def relative_signal_to_noise_ratio_from_plan(plan, verbose=False):
+    """
+    Same steps as command_to_return_relative_signal_to_noise_ratio, on the raw float64 arrays of a plan.
+    The units are attached again only to the outputs.
+    :param plan: output of compile_relative_signal_to_noise_ratio_plan
+    :param verbose: print the intermediary steps
+    :return: signal to noise ratio without and with microlensing, relative signal to noise ratio
+    """
+    with instrumented_block('sensitivity_equations.planck_einstein_relation', np.size(plan['wavelength_star_peak'])):
+        energy_of_a_photon = const.h.si.value * const.c.si.value / plan['wavelength_star_peak']
+    with instrumented_block('sensitivity_equations.photons_emitted_by_a_star_per_second', np.size(energy_of_a_photon)):
+        number_emitted_photons_per_second = plan['luminosity_of_the_star'] / energy_of_a_photon
+
+    photons_from_a_certain_distance = photons_arriving_to_a_certain_distance(number_emitted_photons_per_second,
+                                                                             plan['distance_from_observer'])
+
+    number_photons_getting_in = photons_after_telescope_aperture(photons_from_a_certain_distance,
+                                                                 plan['telescope_diameter'], plan['aperture_type'])
+
+    with instrumented_block('sensitivity_equations.photoelectrons_no_amplification',
+                            np.size(number_photons_getting_in)):
+        generated_photoelectrons = number_photons_getting_in * plan['quantum_efficiency_value'] * plan['etenue_value']
+
+    photoelectrons_when_lensed = photoelectrons_with_amplification(generated_photoelectrons, plan['magnification'])
+
+    signal_to_noise_ratio_no_microlensing = signal_to_noise_ratio(generated_photoelectrons, plan['dark_current'],
+                                                                  plan['read_out'], plan['diffuse_background'])
+
+    signal_to_noise_ratio_microlensing = signal_to_noise_ratio(photoelectrons_when_lensed, plan['dark_current'],
+                                                               plan['read_out'], plan['diffuse_background'])
+
+    relative_signal_to_noise_ratio = relative_signal_to_noise_ratio_calculator(signal_to_noise_ratio_no_microlensing,
+                                                                               signal_to_noise_ratio_microlensing)
+    if verbose:
+        print("\nNumber of emitted photons per second:")
+        print_cyan(number_emitted_photons_per_second * photons / u.s)
+        print("\nNumber of photons arriving to the observer per area and second: ")
+        print_cyan((photons_from_a_certain_distance * photons / (u.m ** 2 * u.s)).to(photons / (u.cm ** 2 * u.s)))
+        print("\nNumber of photons getting in the telescope: ")
+        print_cyan(number_photons_getting_in * photons / u.s)
+        print("\nNumber of photoelectrons generated: ")
+        print_cyan(generated_photoelectrons * photoelectrons / u.s)
+        print("\nNumber of photoelectrons generated with amplification")
+        print_cyan(photoelectrons_when_lensed * photoelectrons / u.s)
+        print("Signal to Noise ratio without microlensing")
+        print_cyan(signal_to_noise_ratio_no_microlensing)
+        print("Signal to Noise ratio with microlensing")
+        print_cyan(signal_to_noise_ratio_microlensing)
+        print("Relative signal to noise (snr_microlensing - snr_base)/snr_base")
+        print_cyan(relative_signal_to_noise_ratio)
+    return (signal_to_noise_ratio_no_microlensing * u.dimensionless_unscaled,
+            signal_to_noise_ratio_microlensing * u.dimensionless_unscaled,
+            relative_signal_to_noise_ratio * u.dimensionless_unscaled)
+
+
 def plot_relative_signal_to_noise_ratio_in_function_of(in_function_of, relative_snr, string_in_function_of,
                                                        fixed_param, color, p1):
+    # bokeh is only loaded to plot, not to compute
+    from cumlus.simple_plot import plotter
 
     ## PLotting model
     p1 = plotter(in_function_of, relative_snr, [], p1, legend_label=f'{fixed_param}',
@@ -210,14 +321,10 @@ def plot_relative_signal_to_noise_ratio_in_function_of(in_function_of, relative_
 
 
 if __name__ == '__main__':
-    # ==================================================================================================================
-    #                              SETTING SOME PHOTONS AND PHOTOELECTRONS AS UNIT
-    # ==================================================================================================================
-    # "photons" unit definition
-    photons = u.def_unit('photons')
-    # "photoelectrons" unit definition
-    photoelectrons = u.def_unit('photoelectrons')
+    from bokeh.io import output_file
+    from bokeh.plotting import figure, show
 
+    from cumlus.simple_plot import plot_series
 
     # ==================================================================================================================
     #                                            SET YOUR PARAMETERS HERE
@@ -258,15 +365,21 @@ if __name__ == '__main__':
     p1 = figure(title=f"Relative signal to noise ratio in function of telescope diameter",
                 plot_width=900, plot_height=500)
 
-    for distance_from_observer, color in zip(distance_from_observer_s, colors):
-        signal_to_noise_ratio_no_microlensing, signal_to_noise_ratio_microlensing, relative_signal_to_noise_ratio = command_to_return_relative_signal_to_noise_ratio(wavelength_star_peak, luminosity_of_the_star,
-                                                         distance_from_observer, telescope_diameter,
-                                                         quantum_efficiency_value, etenue_value, dark_current,
-                                                         read_out, diffuse_background,
-                                                         magnification)
-
-        p1 = plot_relative_signal_to_noise_ratio_in_function_of(telescope_diameter.value, signal_to_noise_ratio_no_microlensing,
-                                                           'Telescope Diameter', f'Observer {distance_from_observer} away',
-                                                           color, p1)
+    # All the distances x diameters in one batch: units are checked once, the rest runs on float arrays
+    plan = compile_relative_signal_to_noise_ratio_plan(wavelength_star_peak, luminosity_of_the_star,
+                                                       u.Quantity(distance_from_observer_s)[:, np.newaxis],
+                                                       telescope_diameter,
+                                                       quantum_efficiency_value, etenue_value, dark_current,
+                                                       read_out, diffuse_background,
+                                                       magnification)
+    signal_to_noise_ratio_no_microlensing, signal_to_noise_ratio_microlensing, relative_signal_to_noise_ratio = \
+        relative_signal_to_noise_ratio_from_plan(plan)
+
+    # All the curves in one shared (downsampled) source
+    legend_labels = [f'Observer {distance_from_observer} away' for distance_from_observer in distance_from_observer_s]
+    p1, _ = plot_series(p1, [telescope_diameter.value] * len(distance_from_observer_s),
+                        list(signal_to_noise_ratio_no_microlensing.value), legend_labels, colors,
+                        x_label_name='Diameter aperture', y_label_name='Signal to Noise Ratio',
+                        legend_location="top_left")
     show(p1)
 
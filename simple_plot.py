@@ -1,8 +1,38 @@
-from bokeh.models import Whisker, ColumnDataSource, Span, BoxAnnotation
-from bokeh.plotting import figure, show
+import os
+
+import numpy as np
+from bokeh.models import Whisker, ColumnDataSource, Span, BoxAnnotation, CustomJS
+from bokeh.plotting import figure
 
 #from visualization.data_reader import data_collector
 
+# Points kept per series by plot_series, a few per pixel of a wide plot
+MAX_POINTS_PER_SERIES = 2000
+# Largest number of epochs drawn at once by plot_light_curve
+MAX_POINTS_PER_VIEW = 5000
+# Shows the finest level of detail of plot_light_curve with at most max_points epochs in the visible range
+LEVEL_OF_DETAIL_CODE = """
+function first_index(x, value) {
+    let low = 0, high = x.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        if (x[middle] < value) { low = middle + 1; } else { high = middle; }
+    }
+    return low;
+}
+for (let level = 0; level < levels.length; level++) {
+    const data = levels[level].data;
+    const start = Math.max(first_index(data.x, x_range.start) - 1, 0);
+    const end = Math.min(first_index(data.x, x_range.end) + 1, data.x.length);
+    if (end - start <= max_points || level === levels.length - 1) {
+        const visible = {};
+        for (const name of ['x', 'y', 'lower', 'upper']) { visible[name] = data[name].slice(start, end); }
+        source.data = visible;
+        break;
+    }
+}
+"""
+
 
 def plotter(x_axis, y_axis, y_error, p, legend_label='', x_label_name='Days', y_label_name='Magnification', color='purple',
             plot_errorbar=False, t0_error_plot=False, t0=None, t0_error=None, type_plot='circle',
@@ -22,8 +52,8 @@ def plotter(x_axis, y_axis, y_error, p, legend_label='', x_label_name='Days', y_
         p.circle(x_axis, y_axis, fill_alpha=0.7, size=5, legend_label=legend_label, color=color)
 
     if plot_errorbar:
-        upper = [x + e for x, e in zip(y_axis, y_error)]
-        lower = [x - e for x, e in zip(y_axis, y_error)]
+        upper = np.asarray(y_axis, dtype=float) + np.asarray(y_error, dtype=float)
+        lower = np.asarray(y_axis, dtype=float) - np.asarray(y_error, dtype=float)
         source = ColumnDataSource(data=dict(groups=x_axis, counts=y_axis, upper=upper, lower=lower))
         whisker_errorbar = Whisker(source=source, base="groups", upper="upper", lower="lower",
                                    line_width=1.0, line_color=color) #level="overlay",
@@ -57,9 +87,186 @@ def plotter(x_axis, y_axis, y_error, p, legend_label='', x_label_name='Days', y_
     return p
 
 
+def largest_triangle_three_buckets(x_axis, y_axis, number_of_points):
+    """
+    Downsample a series keeping its shape (Largest Triangle Three Buckets, Steinarsson 2013): the first and last
+    points, and in each of the number_of_points - 2 buckets in between the point that makes the largest triangle with
+    the point kept in the previous bucket and the mean of the next bucket
+    :param x_axis: array sorted in increasing order
+    :param y_axis: array
+    :param number_of_points: number of points kept, at least 2 (the first and the last points)
+    :return: indices of the points kept (all of them if there are not more than number_of_points)
+    """
+    if number_of_points < 2:
+        raise ValueError(f'The first and last points are always kept, number_of_points must be at least 2, not '
+                         f'{number_of_points}.')
+    x_axis = np.asarray(x_axis, dtype=float)
+    y_axis = np.asarray(y_axis, dtype=float)
+    if x_axis.size <= number_of_points:
+        return np.arange(x_axis.size)
+    if number_of_points == 2:
+        return np.array([0, x_axis.size - 1])
+    # bucket edges of the points between the first and the last one
+    edges = np.linspace(1, x_axis.size - 1, number_of_points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    x_means = np.add.reduceat(x_axis[1:-1], edges[:-1] - 1) / counts
+    y_means = np.add.reduceat(y_axis[1:-1], edges[:-1] - 1) / counts
+    x_means, y_means = np.append(x_means, x_axis[-1]), np.append(y_means, y_axis[-1])
+    indices = np.empty(len(edges) + 1, dtype=np.int64)
+    indices[0], indices[-1] = 0, x_axis.size - 1
+    for bucket in range(len(edges) - 1):
+        previous = indices[bucket]
+        x_bucket, y_bucket = x_axis[edges[bucket]:edges[bucket + 1]], y_axis[edges[bucket]:edges[bucket + 1]]
+        # twice the area of the triangles
+        area = np.abs((x_axis[previous] - x_means[bucket + 1]) * (y_bucket - y_axis[previous]) -
+                      (x_axis[previous] - x_bucket) * (y_means[bucket + 1] - y_axis[previous]))
+        indices[bucket + 1] = edges[bucket] + np.argmax(area)
+    return indices
+
+
+def plot_series(p, x_series, y_series, legend_labels, colors, max_points=MAX_POINTS_PER_SERIES, type_plot='line',
+                x_label_name='Days', y_label_name='Magnification', legend_location="bottom_center"):
+    """
+    Plot many series (e.g. the curves of a sweep) that stay small in the html whatever their length: every series is
+    downsampled to max_points with largest_triangle_three_buckets, all of them go in one ColumnDataSource of numpy
+    columns (x0, y0, x1, y1, ..., the shorter ones padded with NaN), that bokeh embeds as binary, and the plot is drawn
+    with WebGL. The y columns are float32; the x columns stay float64, float32 would round times in Julian days
+    (~2.46e6) to a quarter of a day
+    :param p: bokeh figure
+    :param x_series: list of x arrays (sorted)
+    :param y_series: list of y arrays
+    :param legend_labels: list of labels
+    :param colors: list of colors
+    :param max_points: points kept per series
+    :param type_plot: 'line' or 'circle'
+    :return: p, source
+    """
+    kept = [largest_triangle_three_buckets(x_axis, y_axis, max_points) for x_axis, y_axis in zip(x_series, y_series)]
+    length = max(len(indices) for indices in kept)
+    columns = {}
+    for series, (x_axis, y_axis, indices) in enumerate(zip(x_series, y_series, kept)):
+        for name, values, dtype in ((f'x{series}', x_axis, np.float64), (f'y{series}', y_axis, np.float32)):
+            columns[name] = np.full(length, np.nan, dtype=dtype)
+            columns[name][:len(indices)] = np.asarray(values, dtype=float)[indices]
+    source = ColumnDataSource(data=columns)
+
+    p.output_backend = 'webgl'
+    p.xaxis.axis_label = x_label_name
+    p.yaxis.axis_label = y_label_name
+    for series, (legend_label, color) in enumerate(zip(legend_labels, colors)):
+        if type_plot == 'line':
+            p.line(f'x{series}', f'y{series}', source=source, line_width=2, line_alpha=1.0, legend_label=legend_label,
+                   color=color)
+        else:
+            p.scatter(f'x{series}', f'y{series}', source=source, fill_alpha=0.7, size=5, legend_label=legend_label,
+                      color=color)
+
+    p.legend.background_fill_alpha = 0.0
+    p.legend.location = legend_location
+    p.legend.label_text_font_size = '8pt'
+    return p, source
+
+
+def bin_light_curve(times, values, errors, bin_width):
+    """
+    Inverse variance weighted means of a light curve in bins of time
+    :param times: array sorted in increasing order
+    :param values: array (e.g. magnitudes)
+    :param errors: array of the errors of the values
+    :param bin_width: in the units of times
+    :return: times, values, errors of the bins that have epochs (mean time, weighted mean, error of the mean)
+    """
+    bins = np.floor((times - times[0]) / bin_width).astype(np.int64)
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    weights = 1 / errors ** 2
+    sum_of_weights = np.add.reduceat(weights, starts)
+    return (np.add.reduceat(times, starts) / np.diff(starts, append=times.size),
+            np.add.reduceat(weights * values, starts) / sum_of_weights,
+            1 / np.sqrt(sum_of_weights))
+
+
+def light_curve_levels(times, values, errors, max_points=MAX_POINTS_PER_VIEW):
+    """
+    Levels of detail of a light curve: the epochs themselves, then bin_light_curve with bins twice as wide at every
+    level, until the whole light curve has at most max_points bins
+    :param times: array
+    :param values: array
+    :param errors: array
+    :param max_points: largest number of bins of the last level
+    :return: list of (times, values, errors) from the finest to the coarsest level
+    """
+    order = np.argsort(times, kind='stable')
+    levels = [tuple(np.asarray(array, dtype=float)[order] for array in (times, values, errors))]
+    span = levels[0][0][-1] - levels[0][0][0] if len(order) else 0.0
+    if len(order) <= max_points or span == 0:
+        return levels
+    bin_width = span / (max_points - 1)
+    coarse_levels = [bin_light_curve(*levels[0], bin_width)]
+    # finer levels, as long as they are at least twice smaller than the epochs
+    while 2 * len(coarse_levels[-1][0]) < len(order):
+        bin_width /= 2
+        finer = bin_light_curve(*levels[0], bin_width)
+        if 2 * len(finer[0]) > len(order):
+            break
+        coarse_levels.append(finer)
+    return levels + coarse_levels[::-1]
+
+
+def plot_light_curve(p, times, values, errors, legend_label='', color='purple', max_points=MAX_POINTS_PER_VIEW,
+                     x_label_name='Days', y_label_name='Magnitude', legend_location="bottom_center"):
+    """
+    Plot a long light curve (e.g. a full season of survey photometry) with error bars. The bounds of the error bars are
+    computed with numpy and drawn by one segment glyph that shares the source of the points. When the light curve has
+    more than max_points epochs, the levels of light_curve_levels are embedded (as binary columns) and a callback
+    shows the finest level with at most max_points epochs in the visible range: weighted means when zoomed out, the
+    epochs themselves when zoomed in
+    :param p: bokeh figure
+    :param times: array
+    :param values: array (e.g. magnitudes)
+    :param errors: array
+    :param legend_label:
+    :param color:
+    :param max_points: largest number of epochs drawn at once
+    :return: p, source (the data drawn)
+    """
+    levels = [ColumnDataSource(data={'x': level_times, 'y': level_values.astype(np.float32),
+                                     'lower': (level_values - level_errors).astype(np.float32),
+                                     'upper': (level_values + level_errors).astype(np.float32)})
+              for level_times, level_values, level_errors in light_curve_levels(times, values, errors, max_points)]
+    source = ColumnDataSource(data=dict(levels[-1].data))
+
+    p.output_backend = 'webgl'
+    p.xaxis.axis_label = x_label_name
+    p.yaxis.axis_label = y_label_name
+    p.segment(x0='x', y0='lower', x1='x', y1='upper', source=source, line_width=1.0, line_color=color)
+    p.scatter('x', 'y', source=source, fill_alpha=0.7, size=4, legend_label=legend_label, color=color)
+    if len(levels) > 1:
+        callback = CustomJS(args={'source': source, 'levels': levels, 'x_range': p.x_range, 'max_points': max_points},
+                            code=LEVEL_OF_DETAIL_CODE)
+        p.x_range.js_on_change('start', callback)
+        p.x_range.js_on_change('end', callback)
+
+    p.legend.background_fill_alpha = 0.0
+    p.legend.location = legend_location
+    p.legend.label_text_font_size = '8pt'
+    return p, source
+
+
 if __name__ == '__main__':
-    data_filepath = "/Users/sishitan/Documents/Analysis_MOA2020-135/data/KB200579_i_CFHT.dat"
+    from bokeh.io import output_file, save
+
+    from cumlus.point_lens import impact_parameter, pspl_magnification
+    from cumlus.synthetic_photometry import synthetic_photometry
+
+    # data_filepath = "/Users/sishitan/Documents/Analysis_MOA2020-135/data/KB200579_i_CFHT.dat"
     # times, magnitudes, magnitudes_err = data_collector(data_filepath, 'CFHT')
-    p = figure(title="Lightcurve CFHT", plot_width=900, plot_height=300)
-    p = plotter(times, magnitudes, magnitudes_err, p, 'CFHT', 'Magnitude')
-    show(p)
+    # A season of photometry every minute instead (200000 epochs), with a point lens event
+    times = 2459000 + np.sort(np.random.default_rng(0).uniform(0, 180, 200000))
+    photometry = synthetic_photometry(pspl_magnification(impact_parameter(times, 2459090, 0.1, 20)),
+                                      0, np.arange(times.size), 16.0)
+    p = figure(title="Lightcurve", width=900, height=300)
+    p.y_range.flipped = True
+    p, source = plot_light_curve(p, times, photometry['magnitude'], photometry['magnitude_error'], 'synthetic')
+    output_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plots', 'light_curve_level_of_detail.html'))
+    save(p)
+    print(f'{times.size} epochs, {len(source.data["x"])} drawn when zoomed out')
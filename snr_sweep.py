@@ -0,0 +1,96 @@
+"""
+Vectorized parameter sweeps over the signal to noise chain of GT_for_cumlus.py
+The whole grid (temperature x magnitude x aperture x band x exposure) is evaluated in one numpy broadcast pass,
+instead of calling the scalar functions (and quad) once per point. The band integrals use the series of
+blackbody_band.py and the closed form of total_number_of_incident_photon_per_second_per_area.
+"""
+import numpy as np
+
+from cumlus.GT_for_cumlus import radiant_flux_calculator, total_number_of_incident_photon_per_second_per_area, \
+    photoelectrons_per_exposure_cauculator, signal_to_noise_ratio
+
+# Order of the axes in the grid built by sweep_grid
+GRID_AXES = ('temperature', 'magnitude', 'diameter', 'band', 'exposure')
+
+
+def sweep_grid(temperature, magnitude, diameter, band, exposure):
+    """
+    Build the grid of a sweep. Every parameter gets its own axis (in the order of GRID_AXES), and the arrays are
+    reshaped so they broadcast against each other. Nothing is repeated in memory, the full cube only appears at the
+    end of the chain.
+    :param temperature: star temperatures in kelvin
+    :param magnitude: star magnitudes
+    :param diameter: telescope diameters in mm
+    :param band: list of (lambda_interval_bottom, lambda_interval_top) in nm
+    :param exposure: exposure times in seconds
+    :return: dictionary with the keyword arguments of signal_to_noise_ratio_sweep
+    """
+    band = np.atleast_2d(np.asarray(band, dtype=float))
+    axes = {'temperature': temperature, 'magnitude': magnitude, 'diameter': diameter,
+            'band': np.arange(len(band)), 'exposure': exposure}
+    grid = {}
+    for position, name in enumerate(GRID_AXES):
+        shape = [1] * len(GRID_AXES)
+        shape[position] = -1
+        grid[name] = np.asarray(axes[name], dtype=float).reshape(shape)
+    band_index = grid.pop('band').astype(int)
+    grid['lambda_interval_bottom'] = band[band_index, 0]
+    grid['lambda_interval_top'] = band[band_index, 1]
+    return grid
+
+
+def signal_to_noise_ratio_sweep(temperature, magnitude, diameter, lambda_interval_bottom, lambda_interval_top,
+                                exposure, flux_sun=1361, quantum_efficiency=0.45, dark_current=0.05, read_out=0.3,
+                                diffuse_background=9.11, integration_method='series'):
+    """
+    Signal to noise ratio for arrays of parameters. The inputs can be anything that numpy broadcasts together
+    (e.g. the output of sweep_grid). It follows the same steps (and units) as the __main__ of GT_for_cumlus.py:
+    band limits in nm, diameter in mm, and noise terms in electrons/second.
+    The integrals only depend on temperature and band, so they are done on that (small) shape.
+    :param temperature: in kelvin
+    :param magnitude:
+    :param diameter: in mm
+    :param lambda_interval_bottom: in nm
+    :param lambda_interval_top: in nm
+    :param exposure: in seconds
+    :param flux_sun: in W/m^2
+    :param quantum_efficiency:
+    :param dark_current: electrons/second
+    :param read_out: electrons/second
+    :param diffuse_background: photons/second
+    :param integration_method: 'series', or 'table' to use the precomputed tables of band_flux_table.py
+    :return: dictionary with the intermediate steps and the signal to noise ratio
+    """
+    radiant_flux, radiant_flux_error = radiant_flux_calculator(flux_sun_=flux_sun,
+                                                               lambda_interval_bottom_=lambda_interval_bottom,
+                                                               lambda_interval_top_=lambda_interval_top,
+                                                               temperature_=temperature,
+                                                               method_=integration_method)
+
+    E_range, E_range_error = total_number_of_incident_photon_per_second_per_area(
+        lambda_interval_bottom_=np.asarray(lambda_interval_bottom) * 1e-9,
+        lambda_interval_top_=np.asarray(lambda_interval_top) * 1e-9,
+        radiant_flux_=radiant_flux, quantum_efficiency_=quantum_efficiency)
+
+    photoelectrons = photoelectrons_per_exposure_cauculator(E_range, magnitude, exposure, diameter)
+    snr = signal_to_noise_ratio(photoelectrons_per_second_signal=photoelectrons, dark_current_noise=dark_current,
+                                read_out_noise=read_out, diffuse_background=diffuse_background)
+    return {'radiant_flux': radiant_flux,
+            'radiant_flux_error': radiant_flux_error,
+            'E_range': E_range,
+            'E_range_error': E_range_error,
+            'photoelectrons': photoelectrons,
+            'snr': snr}
+
+
+if __name__ == '__main__':
+    # Same assumptions as GT_for_cumlus.py, but for ranges of values
+    grid = sweep_grid(temperature=np.linspace(2500, 6000, 36),
+                      magnitude=np.linspace(10, 22, 121),
+                      diameter=np.linspace(100, 300, 21),
+                      band=[(1300, 1900), (900, 1300), (1900, 2500)],
+                      exposure=[1.0, 10.0, 60.0])
+    results = signal_to_noise_ratio_sweep(**grid)
+    print(f'S/N cube of shape {results["snr"].shape} ({GRID_AXES})')
+    print(f'M5 star (2800 K), mag 18, 185 mm, H band, 1s: '
+          f'S/N = {signal_to_noise_ratio_sweep(2800, 18.0, 185, 1300, 1900, 1.0)["snr"]}')
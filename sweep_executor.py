@@ -0,0 +1,167 @@
+"""
+Run large parameter sweeps in a pool of processes
+The grid (e.g. temperature x magnitude x diameter x band x exposure) is flattened and split in chunks of
+consecutive points. Every chunk is evaluated in a worker process, which writes its results straight into .npy files
+that all the processes map in memory (np.lib.format.open_memmap), so nothing is sent back through pipes and every
+point always ends in the same place, whatever the order in which the chunks finish.
+The finished chunks are marked in progress.npy, so running the same sweep again in the same directory only computes
+the chunks that are missing (e.g. after an interrupted run).
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from cumlus.snr_sweep import GRID_AXES, signal_to_noise_ratio_sweep
+
+SPEC_FILENAME = 'sweep.json'
+PROGRESS_FILENAME = 'progress.npy'
+
+
+def grid_points(axes, start, stop):
+    """
+    Parameters of the points start..stop of the flattened grid, as 1D arrays
+    :param axes: dictionary axis name: values (in the order of the grid). The axis 'band' has (bottom, top) pairs
+    :param start: first flat index
+    :param stop: last flat index (not included)
+    :return: dictionary parameter name: array of length stop - start
+    """
+    shape = [len(values) for values in axes.values()]
+    indices = np.unravel_index(np.arange(start, stop), shape)
+    points = {}
+    for (name, values), index in zip(axes.items(), indices):
+        values = np.asarray(values, dtype=float)
+        if name == 'band':
+            points['lambda_interval_bottom'] = values[index, 0]
+            points['lambda_interval_top'] = values[index, 1]
+        else:
+            points[name] = values[index]
+    return points
+
+
+def evaluate_points(function, points, fixed_parameters, vectorized):
+    """
+    Evaluate the function on the points
+    :param function: function that returns a dictionary of results
+    :param points: dictionary parameter name: 1D array
+    :param fixed_parameters: other keyword arguments of function
+    :param vectorized: if False, the function is called once per point (e.g. for integrals with quad)
+    :return: dictionary result name: 1D array
+    """
+    if vectorized:
+        results = function(**points, **fixed_parameters)
+        size = len(next(iter(points.values())))
+        return {name: np.broadcast_to(value, (size,)) for name, value in results.items()}
+    names = list(points)
+    results = [function(**dict(zip(names, point)), **fixed_parameters) for point in zip(*points.values())]
+    return {name: np.array([result[name] for result in results]) for name in results[0]}
+
+
+def _read_spec(output_directory):
+    with open(os.path.join(output_directory, SPEC_FILENAME)) as file:
+        return json.load(file)
+
+
+def _run_chunk(output_directory, function, chunk_index):
+    """
+    Evaluate one chunk and write it into the output files (runs in the worker processes)
+    """
+    spec = _read_spec(output_directory)
+    start = chunk_index * spec['chunk_size']
+    stop = min(start + spec['chunk_size'], spec['number_of_points'])
+    points = grid_points(spec['axes'], start, stop)
+    results = evaluate_points(function, points, spec['fixed_parameters'], spec['vectorized'])
+    for name in spec['outputs']:
+        output = np.load(os.path.join(output_directory, f'{name}.npy'), mmap_mode='r+')
+        output.reshape(-1)[start:stop] = results[name]
+        output.flush()
+        del output
+    return chunk_index
+
+
+def _function_name(function):
+    return f'{function.__module__}.{function.__qualname__}'
+
+
+def run_sweep(output_directory, axes, function=signal_to_noise_ratio_sweep, fixed_parameters=None,
+              chunk_size=100000, number_of_workers=None, vectorized=True):
+    """
+    Evaluate function on every point of the grid, in chunks, in a pool of processes
+    :param output_directory: where the results (one .npy per output of function) and the progress are saved
+    :param axes: dictionary axis name: values, e.g. {'temperature': [...], 'magnitude': [...], 'diameter': [...],
+                 'band': [(1300, 1900), ...], 'exposure': [...]}. The grid has one axis per entry, in this order
+    :param function: function of the parameters of the points (and fixed_parameters) that returns a dictionary of
+                     arrays. It has to be defined at module level, so the worker processes can import it
+    :param fixed_parameters: other keyword arguments of function, the same for all points
+    :param chunk_size: number of points per chunk
+    :param number_of_workers: number of processes (default: all the cpus). With 1 everything runs in this process
+    :param vectorized: if False, function is called once per point (e.g. with integration method 'quad')
+    :return: dictionary output name: memory mapped array with the shape of the grid
+    """
+    fixed_parameters = fixed_parameters or {}
+    axes = {name: np.asarray(values, dtype=float).tolist() for name, values in axes.items()}
+    shape = [len(values) for values in axes.values()]
+    number_of_points = int(np.prod(shape))
+    number_of_chunks = -(-number_of_points // chunk_size)
+    os.makedirs(output_directory, exist_ok=True)
+
+    # The outputs and their dtype, from the first point
+    first_point = evaluate_points(function, grid_points(axes, 0, 1), fixed_parameters, vectorized)
+    spec = {'axes': axes, 'shape': shape, 'number_of_points': number_of_points, 'chunk_size': chunk_size,
+            'function': _function_name(function), 'fixed_parameters': fixed_parameters, 'vectorized': vectorized,
+            'outputs': {name: np.asarray(value).dtype.str for name, value in first_point.items()}}
+    spec_filepath = os.path.join(output_directory, SPEC_FILENAME)
+    progress_filepath = os.path.join(output_directory, PROGRESS_FILENAME)
+    if os.path.exists(spec_filepath) and os.path.exists(progress_filepath):
+        if _read_spec(output_directory) != json.loads(json.dumps(spec)):
+            raise ValueError(f'{output_directory} has the results of a different sweep. Use another directory.')
+        progress = np.load(progress_filepath, mmap_mode='r+')
+    else:
+        for name, dtype in spec['outputs'].items():
+            np.lib.format.open_memmap(os.path.join(output_directory, f'{name}.npy'), mode='w+', dtype=dtype,
+                                      shape=tuple(shape)).flush()
+        progress = np.lib.format.open_memmap(progress_filepath, mode='w+', dtype=bool, shape=(number_of_chunks,))
+        with open(spec_filepath, 'w') as file:
+            json.dump(spec, file)
+
+    missing_chunks = np.flatnonzero(~progress).tolist()
+    if number_of_workers == 1:
+        for chunk_index in missing_chunks:
+            progress[_run_chunk(output_directory, function, chunk_index)] = True
+            progress.flush()
+    else:
+        with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+            futures = [executor.submit(_run_chunk, output_directory, function, chunk_index)
+                       for chunk_index in missing_chunks]
+            for future in as_completed(futures):
+                progress[future.result()] = True
+                progress.flush()
+    return load_sweep(output_directory)
+
+
+def load_sweep(output_directory):
+    """
+    Results of a sweep, memory mapped (read only)
+    :param output_directory:
+    :return: dictionary output name: array with the shape of the grid
+    """
+    spec = _read_spec(output_directory)
+    return {name: np.load(os.path.join(output_directory, f'{name}.npy'), mmap_mode='r') for name in spec['outputs']}
+
+
+def sweep_is_complete(output_directory):
+    """
+    :param output_directory:
+    :return: True if all the chunks of the sweep are done
+    """
+    return bool(np.all(np.load(os.path.join(output_directory, PROGRESS_FILENAME))))
+
+
+if __name__ == '__main__':
+    # Same ranges as the __main__ of snr_sweep.py
+    sweep_axes = dict(zip(GRID_AXES, [np.linspace(2500, 6000, 36), np.linspace(10, 22, 121),
+                                      np.linspace(100, 300, 21), [(1300, 1900), (900, 1300), (1900, 2500)],
+                                      [1.0, 10.0, 60.0]]))
+    sweep_results = run_sweep('sweep_output', sweep_axes, chunk_size=50000)
+    print(f'S/N cube of shape {sweep_results["snr"].shape} in sweep_output/')
@@ -0,0 +1,232 @@
+"""
+Stream sweep results to columnar files, with a memory use bounded by the chunk size
+The grid is evaluated chunk by chunk (a generator), and each chunk (input parameters and results) is appended to one
+file per column and then dropped. The columns are .npy files, so the analysis and the plots can memory map them
+(open_columns) without loading the whole sweep. Parquet (one row group per chunk) is also possible if pyarrow is
+installed.
+"""
+import json
+import os
+
+import numpy as np
+
+from cumlus.snr_sweep import GRID_AXES, signal_to_noise_ratio_sweep
+from cumlus.sweep_executor import grid_points, evaluate_points
+
+METADATA_FILENAME = 'columns.json'
+# Bytes reserved for the .npy header, so it can be rewritten with the final length without moving the data
+NPY_HEADER_SIZE = 128
+
+
+def iterate_sweep_chunks(axes, function=signal_to_noise_ratio_sweep, fixed_parameters=None, chunk_size=100000,
+                         vectorized=True):
+    """
+    Evaluate a grid chunk by chunk
+    :param axes: dictionary axis name: values, as in sweep_executor.run_sweep
+    :param function: function of the parameters of the points that returns a dictionary of arrays
+    :param fixed_parameters: other keyword arguments of function
+    :param chunk_size: number of points per chunk
+    :param vectorized: if False, function is called once per point
+    :return: generator of dictionaries column name: 1D array (parameters of the points and results)
+    """
+    fixed_parameters = fixed_parameters or {}
+    number_of_points = int(np.prod([len(values) for values in axes.values()]))
+    for start in range(0, number_of_points, chunk_size):
+        points = grid_points(axes, start, min(start + chunk_size, number_of_points))
+        results = evaluate_points(function, points, fixed_parameters, vectorized)
+        yield dict(points, **results)
+
+
+def npy_header(dtype, length):
+    """
+    Header of a 1D .npy file (format 1.0), padded to NPY_HEADER_SIZE bytes
+    :param dtype:
+    :param length: number of elements
+    :return: bytes
+    """
+    dictionary = f"{{'descr': '{np.dtype(dtype).str}', 'fortran_order': False, 'shape': ({length},), }}"
+    preamble = b'\x93NUMPY\x01\x00' + (NPY_HEADER_SIZE - 10).to_bytes(2, 'little')
+    return preamble + dictionary.ljust(NPY_HEADER_SIZE - 11).encode('latin1') + b'\n'
+
+
+class ColumnarWriter:
+    """
+    Append chunks of columns to one .npy file per column
+    """
+
+    def __init__(self, directory, metadata=None):
+        """
+        :param directory: where the columns are written
+        :param metadata: json serializable dictionary saved with the columns (e.g. the grid of the sweep)
+        """
+        self.directory = directory
+        self.metadata = metadata or {}
+        self.files = {}
+        self.dtypes = {}
+        self.number_of_rows = 0
+        os.makedirs(directory, exist_ok=True)
+        # the metadata of an earlier run is only written again when this one is complete
+        if os.path.exists(os.path.join(directory, METADATA_FILENAME)):
+            os.remove(os.path.join(directory, METADATA_FILENAME))
+
+    def append(self, chunk):
+        """
+        :param chunk: dictionary column name: 1D array (all of the same length)
+        :return: None
+        """
+        if not self.files:
+            for name, column in chunk.items():
+                self.dtypes[name] = np.asarray(column).dtype
+                self.files[name] = open(os.path.join(self.directory, f'{name}.npy'), 'wb')
+                self.files[name].write(npy_header(self.dtypes[name], 0))
+        length = None
+        for name, file in self.files.items():
+            column = np.ascontiguousarray(chunk[name], dtype=self.dtypes[name])
+            length = len(column) if length is None else length
+            if len(column) != length:
+                raise ValueError(f'Column {name} has {len(column)} rows in a chunk of {length} rows.')
+            file.write(column.tobytes())
+        self.number_of_rows += length or 0
+
+    def close(self):
+        """
+        Write the final length in the headers and the metadata
+        :return: None
+        """
+        for name, file in self.files.items():
+            file.seek(0)
+            file.write(npy_header(self.dtypes[name], self.number_of_rows))
+            file.close()
+        with open(os.path.join(self.directory, METADATA_FILENAME), 'w') as file:
+            json.dump(dict(self.metadata, number_of_rows=self.number_of_rows,
+                           columns={name: dtype.str for name, dtype in self.dtypes.items()}, format='npy'), file)
+
+    def abort(self):
+        """
+        Close the files without the metadata, so a failed run is not taken for a complete one
+        :return: None
+        """
+        for file in self.files.values():
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        if exception[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ParquetWriter:
+    """
+    Same as ColumnarWriter, to a Parquet file (one row group per chunk). Needs pyarrow
+    """
+
+    def __init__(self, directory, metadata=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ModuleNotFoundError as error:
+            raise ModuleNotFoundError('Writing Parquet files requires the pyarrow package. '
+                                      'Please install separately or use the npy format.') from error
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.directory = directory
+        self.metadata = metadata or {}
+        self.writer = None
+        self.number_of_rows = 0
+        os.makedirs(directory, exist_ok=True)
+        # the metadata of an earlier run is only written again when this one is complete
+        if os.path.exists(os.path.join(directory, METADATA_FILENAME)):
+            os.remove(os.path.join(directory, METADATA_FILENAME))
+
+    def append(self, chunk):
+        table = self.pyarrow.table({name: np.asarray(column) for name, column in chunk.items()})
+        if self.writer is None:
+            self.writer = self.parquet.ParquetWriter(os.path.join(self.directory, 'columns.parquet'), table.schema)
+        self.writer.write_table(table)
+        self.number_of_rows += table.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        with open(os.path.join(self.directory, METADATA_FILENAME), 'w') as file:
+            json.dump(dict(self.metadata, number_of_rows=self.number_of_rows, format='parquet'), file)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        if exception[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def columnar_writer(directory, metadata=None, file_format='npy'):
+    """
+    :param directory:
+    :param metadata:
+    :param file_format: 'npy' or 'parquet'
+    :return: ColumnarWriter or ParquetWriter
+    """
+    if file_format == 'npy':
+        return ColumnarWriter(directory, metadata)
+    if file_format == 'parquet':
+        return ParquetWriter(directory, metadata)
+    raise ValueError(f'Unknown file format {file_format}. Use "npy" or "parquet".')
+
+
+def stream_sweep(directory, axes, function=signal_to_noise_ratio_sweep, fixed_parameters=None, chunk_size=100000,
+                 vectorized=True, file_format='npy'):
+    """
+    Evaluate a grid chunk by chunk and append every chunk to the columnar files
+    :param directory: where the columns are written
+    :param axes: dictionary axis name: values, as in sweep_executor.run_sweep
+    :param function: function of the parameters of the points that returns a dictionary of arrays
+    :param fixed_parameters: other keyword arguments of function
+    :param chunk_size: number of points per chunk (it sets the memory used)
+    :param vectorized: if False, function is called once per point
+    :param file_format: 'npy' or 'parquet'
+    :return: number of rows written
+    """
+    metadata = {'axes': {name: np.asarray(values, dtype=float).tolist() for name, values in axes.items()},
+                'shape': [len(values) for values in axes.values()],
+                'fixed_parameters': fixed_parameters or {}}
+    with columnar_writer(directory, metadata, file_format) as writer:
+        for chunk in iterate_sweep_chunks(axes, function, fixed_parameters, chunk_size, vectorized):
+            writer.append(chunk)
+    return writer.number_of_rows
+
+
+def open_columns(directory, grid_shape=False):
+    """
+    Memory map the columns written by ColumnarWriter
+    :param directory:
+    :param grid_shape: reshape the columns to the shape of the sweep grid (rows are in the order of the grid)
+    :return: dictionary column name: read only array
+    """
+    with open(os.path.join(directory, METADATA_FILENAME)) as file:
+        metadata = json.load(file)
+    if metadata.get('format', 'npy') != 'npy':
+        raise ValueError(f'The columns of {directory} are in {metadata["format"]} format, only npy columns can be '
+                         f'memory mapped. Read {os.path.join(directory, "columns.parquet")} with pyarrow.')
+    columns = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in metadata['columns']}
+    if grid_shape:
+        columns = {name: column.reshape(metadata['shape']) for name, column in columns.items()}
+    return columns
+
+
+if __name__ == '__main__':
+    sweep_axes = dict(zip(GRID_AXES, [np.linspace(2500, 6000, 351), np.linspace(10, 22, 241),
+                                      np.linspace(100, 300, 41), [(1300, 1900), (900, 1300), (1900, 2500)],
+                                      [1.0, 10.0, 60.0]]))
+    rows = stream_sweep('sweep_output/stream', sweep_axes, chunk_size=200000)
+    snr = open_columns('sweep_output/stream', grid_shape=True)['snr']
+    print(f'{rows} rows written, S/N cube of shape {snr.shape} memory mapped from sweep_output/stream')
@@ -0,0 +1,244 @@
+"""
+Synthetic CUMLUS photometry: noisy light curves from magnification curves and the photon/noise model
+Every sample of a light curve is an exposure of the magnified source: the photoelectrons of the source (the signal rate
+of the GT_for_cumlus.py chain times the magnification and the exposure), plus the dark current and the background,
+with Poisson noise, and the read noise of every read. The dark current and the background are subtracted again
+(their mean is known), so the flux is the source alone, as in exposure_time.coadded_signal_to_noise_ratio.
+The random numbers come from a counter-based generator: every random number is a hash of (seed, event, sample), so
+every event has its own stream, the noise of an event does not depend on the other events or on the chunks, and whole
+chunks of events are drawn with a few numpy operations. The light curves are written chunk by chunk with
+sweep_stream.ColumnarWriter (one row per sample), so the memory only depends on the chunk size.
+"""
+import numpy as np
+
+from cumlus.GT_for_cumlus import radiant_flux_calculator, total_number_of_incident_photon_per_second_per_area, \
+    photoelectrons_per_exposure_cauculator
+from cumlus.point_lens import pspl_light_curves, ragged_event_index
+from cumlus.sweep_stream import ColumnarWriter
+
+# Survey: same assumptions as GT_for_cumlus.py and exposure_time.py
+DEFAULT_SURVEY = {'temperature': 2800,  # K
+                  'diameter': 185,  # mm
+                  'lambda_interval_bottom': 1300,  # nm
+                  'lambda_interval_top': 1900,  # nm
+                  'exposure': 60.0,  # seconds
+                  'quantum_efficiency': 0.45,
+                  'dark_current': 0.05,  # electrons/second
+                  'diffuse_background': 9.11,  # photons/second
+                  'read_noise': 18.0,  # electrons rms per read
+                  'reads_per_exposure': 1}
+# Below this mean number of electrons the Poisson noise is drawn exactly (by inversion), above with a normal
+POISSON_NORMAL_LIMIT = 50.0
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x):
+    # SplitMix64 finalizer: a bijection of uint64 that scrambles all the bits
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def counter_uniform(seed, event, sample, stream=0):
+    """
+    Uniform random numbers in (0, 1) that only depend on (seed, event, sample, stream)
+    :param seed: integer
+    :param event: array of event numbers
+    :param sample: array of sample numbers inside the events (broadcast with event)
+    :param stream: integer below 256, to get independent numbers for the same sample
+    :return: array of float64
+    """
+    with np.errstate(over='ignore'):
+        state = _mix(np.uint64(seed) + _GOLDEN_GAMMA)
+        state = _mix(state ^ (np.asarray(event).astype(np.uint64) + _GOLDEN_GAMMA))
+        state = _mix(state ^ ((np.asarray(sample).astype(np.uint64) << np.uint64(8)) + np.uint64(stream) +
+                              _GOLDEN_GAMMA))
+    return ((state >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+
+
+def counter_normal(seed, event, sample, stream=0):
+    """
+    Standard normal random numbers that only depend on (seed, event, sample, stream) (Box-Muller, with the uniform
+    streams 2 stream and 2 stream + 1)
+    :return: array of float64
+    """
+    radius = np.sqrt(-2 * np.log(counter_uniform(seed, event, sample, 2 * stream)))
+    return radius * np.cos(2 * np.pi * counter_uniform(seed, event, sample, 2 * stream + 1))
+
+
+def counter_poisson(mean, seed, event, sample, stream=0):
+    """
+    Poisson random numbers that only depend on (seed, event, sample, stream): exact (inversion of the cumulative
+    distribution) below POISSON_NORMAL_LIMIT, normal approximation above. It uses the uniform streams 4 stream to
+    4 stream + 2
+    :param mean: array of means
+    :return: array of float64
+    """
+    mean, event, sample = np.broadcast_arrays(np.asarray(mean, dtype=float), event, sample)
+    counts = np.maximum(np.round(mean + np.sqrt(mean) * counter_normal(seed, event, sample, 2 * stream)), 0)
+    small = mean < POISSON_NORMAL_LIMIT
+    if np.any(small):
+        small_mean = mean[small]
+        uniform = counter_uniform(seed, event[small], sample[small], 4 * stream + 2)
+        probability = np.exp(-small_mean)
+        cumulative = probability.copy()
+        small_counts = np.zeros(small_mean.shape)
+        # at most ~mean + 10 sqrt(mean) steps
+        while True:
+            below = uniform > cumulative
+            if not np.any(below):
+                break
+            small_counts[below] += 1
+            probability[below] *= small_mean[below] / small_counts[below]
+            cumulative[below] += probability[below]
+            # the cumulative can stall just below 1 by rounding
+            uniform[below & (probability == 0)] = 0
+        counts[small] = small_counts
+    return counts
+
+
+def source_signal_rate(magnitude, temperature, diameter, lambda_interval_bottom, lambda_interval_top,
+                       quantum_efficiency=0.45, flux_sun=1361):
+    """
+    Photoelectrons/second of the unmagnified source, with the chain (and units) of GT_for_cumlus.py
+    :param magnitude:
+    :param temperature: in kelvin
+    :param diameter: in mm
+    :param lambda_interval_bottom: in nm
+    :param lambda_interval_top: in nm
+    :param quantum_efficiency:
+    :param flux_sun: in W/m^2
+    :return: array
+    """
+    radiant_flux, _ = radiant_flux_calculator(flux_sun_=flux_sun, lambda_interval_bottom_=lambda_interval_bottom,
+                                              lambda_interval_top_=lambda_interval_top, temperature_=temperature,
+                                              method_='series')
+    E_range, _ = total_number_of_incident_photon_per_second_per_area(
+        lambda_interval_bottom_=np.asarray(lambda_interval_bottom) * 1e-9,
+        lambda_interval_top_=np.asarray(lambda_interval_top) * 1e-9,
+        radiant_flux_=radiant_flux, quantum_efficiency_=quantum_efficiency)
+    return photoelectrons_per_exposure_cauculator(E_range, magnitude, 1.0, diameter)
+
+
+def synthetic_photometry(magnification, event, sample, source_magnitude, seed=0, survey=None):
+    """
+    Noisy photometry of samples of light curves
+    :param magnification: array of magnifications (one per sample)
+    :param event: event number of every sample (the noise stream), broadcast with magnification
+    :param sample: number of every sample inside its event, broadcast with magnification
+    :param source_magnitude: magnitude of the unmagnified source of every sample (broadcast with magnification)
+    :param seed: integer, the same seed gives the same noise
+    :param survey: dictionary like DEFAULT_SURVEY (missing entries take the default values); the temperature can be an
+                   array broadcast with magnification
+    :return: dictionary with flux and flux_error (electrons per exposure, the dark current and the background are
+             subtracted), magnitude and magnitude_error
+    """
+    survey = {**DEFAULT_SURVEY, **(survey or {})}
+    exposure = survey['exposure']
+    baseline = source_signal_rate(source_magnitude, survey['temperature'], survey['diameter'],
+                                  survey['lambda_interval_bottom'], survey['lambda_interval_top'],
+                                  survey['quantum_efficiency']) * exposure
+    signal = np.asarray(magnification, dtype=float) * baseline
+    sky = (survey['dark_current'] + survey['diffuse_background']) * exposure
+    read_variance = survey['reads_per_exposure'] * survey['read_noise'] ** 2
+    counts = counter_poisson(signal + sky, seed, event, sample, stream=0)
+    flux = counts + np.sqrt(read_variance) * counter_normal(seed, event, sample, stream=2) - sky
+    flux_error = np.sqrt(signal + sky + read_variance)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = source_magnitude - 2.5 * np.log10(flux / baseline)
+    return {'flux': flux,
+            'flux_error': flux_error,
+            'magnitude': magnitude,
+            'magnitude_error': 2.5 / np.log(10) * flux_error / np.abs(flux)}
+
+
+def simulate_pspl_photometry(directory, number_of_events, times, seed=0, chunk_size=10000, survey=None,
+                             source_magnitude_range=(14.0, 20.0), maximum_impact_parameter=1.0,
+                             time_scale_range=(1.0, 100.0)):
+    """
+    Draw PSPL events, compute their light curves on a shared time grid (point_lens.pspl_light_curves) and write their
+    synthetic photometry, chunk by chunk
+    :param directory: where the columns are written (one row per sample: event, time, magnification, flux, ...)
+    :param number_of_events:
+    :param times: time grid in days
+    :param seed: the events of a chunk come from SeedSequence(seed) spawned per chunk, the noise from the
+                 counter-based generator
+    :param chunk_size: number of events per chunk (it sets the memory used)
+    :param survey: dictionary like DEFAULT_SURVEY
+    :param source_magnitude_range: the source magnitudes are uniform in this range
+    :param maximum_impact_parameter: u0 is uniform between 0 and this
+    :param time_scale_range: tE is log-uniform in this range, in days
+    :return: number of rows written
+    """
+    times = np.asarray(times, dtype=float)
+    number_of_chunks = -(-number_of_events // chunk_size)
+    seed_sequences = np.random.SeedSequence(seed).spawn(number_of_chunks)
+    metadata = {'number_of_events': number_of_events, 'number_of_times': len(times), 'seed': seed,
+                'survey': {**DEFAULT_SURVEY, **(survey or {})}}
+    with ColumnarWriter(directory, metadata) as writer:
+        for chunk_index, seed_sequence in enumerate(seed_sequences):
+            rng = np.random.default_rng(seed_sequence)
+            first_event = chunk_index * chunk_size
+            size = min(chunk_size, number_of_events - first_event)
+            t0 = rng.uniform(times[0], times[-1], size)
+            u0 = maximum_impact_parameter * rng.random(size)
+            tE = np.exp(rng.uniform(*np.log(time_scale_range), size))
+            source_magnitude = rng.uniform(*source_magnitude_range, size)
+            magnification = pspl_light_curves(times, t0, u0, tE)
+            event = np.arange(first_event, first_event + size)[:, np.newaxis]
+            sample = np.arange(len(times))[np.newaxis, :]
+            photometry = synthetic_photometry(magnification, event, sample, source_magnitude[:, np.newaxis], seed,
+                                              survey)
+            columns = {'event': np.broadcast_to(event, magnification.shape).astype(np.int64),
+                       'time': np.broadcast_to(times, magnification.shape),
+                       'magnification': magnification.astype(np.float32)}
+            columns.update({name: value.astype(np.float32) for name, value in photometry.items()})
+            writer.append({name: column.ravel() for name, column in columns.items()})
+    return writer.number_of_rows
+
+
+def ragged_synthetic_photometry(magnification, offsets, source_magnitude, first_event=0, seed=0, survey=None):
+    """
+    synthetic_photometry for ragged light curves (all the samples one after the other, as point_lens.pspl_light_curves
+    with offsets)
+    :param magnification: flat array of magnifications
+    :param offsets: number of events + 1 positions, event i has the samples offsets[i]:offsets[i + 1]
+    :param source_magnitude: one per event
+    :param first_event: number of the first event (for the noise streams)
+    :param seed:
+    :param survey: dictionary like DEFAULT_SURVEY
+    :return: dictionary like synthetic_photometry, with the event of every sample
+    """
+    event = ragged_event_index(offsets)
+    sample = np.arange(len(event)) - np.asarray(offsets)[event]
+    photometry = synthetic_photometry(magnification, event + first_event, sample,
+                                      np.asarray(source_magnitude, dtype=float)[event], seed, survey)
+    return dict(photometry, event=event + first_event)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    from cumlus.sweep_stream import open_columns
+
+    # 100000 events of 200 samples (20 million rows), written 10000 events at a time
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = time.perf_counter()
+        rows = simulate_pspl_photometry(directory, 100000, np.linspace(-30, 30, 200), seed=1)
+        print(f'{rows} rows in {time.perf_counter() - start_time:.2f} s')
+        columns = open_columns(directory)
+        normalized = columns['flux'][:200] / columns['flux_error'][:200]
+        print(f'first event: S/N from {normalized.min():.1f} to {normalized.max():.1f}')
+        del columns
+
+    # The scatter of the flux matches its error bar
+    photometry = synthetic_photometry(np.full(100000, 3.0), 0, np.arange(100000), 19.0, seed=1)
+    print(f'scatter / error bar: {np.std(photometry["flux"]) / photometry["flux_error"][0]:.4f}')
+
+    # The noise does not depend on the chunks: the same event alone gives the same flux
+    one = synthetic_photometry(np.full(5, 2.0), 12345, np.arange(5), 18.0, seed=1)['flux']
+    many = synthetic_photometry(np.full((3, 5), 2.0), np.array([[1], [12345], [7]]), np.arange(5), 18.0,
+                                seed=1)['flux']
+    print(f'same noise for event 12345 alone and in a batch: {np.array_equal(one, many[1])}')